@@ -0,0 +1,152 @@
+import threading
+import time
+
+
+class Display:
+    """
+    Accesso al framebuffer concesso a un'app dall'host.
+
+    Le scritture arrivano al pannello solo mentre l'app è in primo piano:
+    un thread rimasto indietro in un'app sospesa non può sporcare lo
+    schermo di quella attiva. blit/show_image/clear restituiscono True se
+    la scrittura è avvenuta.
+    """
+
+    def __init__(self, framebuffer, lock):
+        self.framebuffer = framebuffer
+        self.mode = framebuffer.mode
+        self.width = framebuffer.width
+        self.height = framebuffer.height
+        self.bits_per_pixel = framebuffer.bits_per_pixel
+        self.frame_size = framebuffer.frame_size
+        self.active = False
+        self._lock = lock
+
+    def blit(self, *args, **kwargs):
+        with self._lock:
+            if self.active:
+                self.framebuffer.blit(*args, **kwargs)
+            return self.active
+
+    def show_image(self, *args, **kwargs):
+        with self._lock:
+            if self.active:
+                self.framebuffer.show_image(*args, **kwargs)
+            return self.active
+
+    def clear(self):
+        with self._lock:
+            if self.active:
+                self.framebuffer.clear()
+            return self.active
+
+
+class App:
+    """
+    App ospitata nel processo del manager.
+
+    L'host chiama load() una volta all'avvio, start() la prima volta che
+    l'app va in primo piano, poi suspend()/resume() a ogni cambio. Tutti gli
+    hook girano nel thread del loop e devono tornare subito: il lavoro lento
+    va passato a loop.run_in_background o a un thread dell'app.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.host = None
+        self.display = None
+        self.loop = None
+
+    def attach(self, host, display):
+        self.host = host
+        self.display = display
+        self.loop = host.loop
+
+    def load(self):
+        pass
+
+    def start(self):
+        pass
+
+    def suspend(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def on_gesture(self, gesture):
+        pass
+
+
+class AppHost:
+    """
+    Ospita più app nello stesso processo: possiede framebuffer, touch e loop
+    e li passa all'app in primo piano, così un cambio app costa un
+    suspend/resume invece di un nuovo interprete.
+    """
+
+    def __init__(self, apps, framebuffer, loop):
+        self.framebuffer = framebuffer
+        self.loop = loop
+        self.apps = {}
+        self.foreground = None
+        self._lock = threading.Lock()
+        self._started = set()
+
+        for app in apps:
+            app.attach(self, Display(framebuffer, self._lock))
+            self.apps[app.name] = app
+
+    def load(self):
+        for app in self.apps.values():
+            start = time.perf_counter()
+            app.load()
+            print(f"App {app.name} caricata in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def switch(self, name):
+        """Porta 'name' in primo piano sospendendo l'app corrente; False se l'app non esiste."""
+        app = self.apps.get(name)
+        if app is None:
+            print(f"App sconosciuta: {name}")
+            return False
+        if app is self.foreground:
+            return True
+
+        start = time.perf_counter()
+        previous = self.foreground
+        with self._lock:
+            if previous is not None:
+                previous.display.active = False
+            app.display.active = True
+            self.foreground = app
+
+        if previous is not None:
+            previous.suspend()
+        if name in self._started:
+            app.resume()
+        else:
+            self._started.add(name)
+            app.start()
+        print(f"--- App {name} in primo piano ({(time.perf_counter() - start) * 1000:.0f} ms) ---")
+        return True
+
+    def dispatch(self, gesture):
+        """Passa un gesto non usato dal manager all'app in primo piano."""
+        if self.foreground is not None:
+            self.foreground.on_gesture(gesture)
+
+    def stop(self):
+        with self._lock:
+            for app in self.apps.values():
+                app.display.active = False
+        for name in self._started:
+            try:
+                self.apps[name].stop()
+            except Exception as e:
+                print(f"Errore arresto app {name}: {e}")
+        self._started.clear()
+        self.foreground = None
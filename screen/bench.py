@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""
+Benchmark dello stack dello schermo, eseguibili su un normale PC Linux.
+
+Le app scrivono sul backend di display scelto con --display (per default
+in memoria, vedi framebuffer.py), il touchscreen è un dispositivo evdev
+simulato, le sorgenti di dati di rpi.py sono dati fissi, le foto e il video
+sono generati al volo. I risultati si possono salvare in JSON e
+confrontare con quelli di un'altra revisione:
+
+    python3 bench.py --json prima.json
+    python3 bench.py --confronta prima.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+from rgb565 import image_to_rgb565
+
+FB_WIDTH, FB_HEIGHT = 480, 320
+FRAME_SIZE = FB_WIDTH * FB_HEIGHT * 2
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+REPEAT = 10              # ripetizioni di default per ogni misura
+VIDEO_FRAMES = 300       # frame della sorgente video sintetica
+REGRESSION_THRESHOLD = 0.10   # nel confronto, peggioramenti oltre il 10% vengono segnalati
+
+# Avvio di un'app finta per misurare il cambio app del manager: importa le
+# stesse librerie pesanti delle app vere e scrive un frame riconoscibile
+STUB_APP = """import os, time
+import numpy, PIL.Image
+with open(os.environ['BENCH_FB'], 'r+b') as fb:
+    fb.write(bytes([{mark}]) * {size})
+time.sleep(3600)
+"""
+
+# ffmpeg finto: un flusso rawvideo RGB565 generato senza decodifica
+SYNTHETIC_FFMPEG = """#!{python}
+import sys
+sys.stderr.write("  Stream #0:0: Video: rawvideo (RGB[16] / 0x10424752), rgb565le, {w}x{h}, 30 fps, 30 tbr\\n")
+sys.stderr.flush()
+frame = bytes(range(256)) * ({size} // 256)
+try:
+    for _ in range({frames}):
+        sys.stdout.buffer.write(frame)
+except BrokenPipeError:
+    pass
+"""
+
+
+# --- Strumenti di misura ---
+def legacy_rgb565(img):
+    """Conversione originale pixel per pixel di rpi.draw_image_to_fb (riferimento)."""
+    image_bytes = img.tobytes("raw", "RGB")
+    buffer = bytearray(FB_WIDTH * FB_HEIGHT * 2)
+    idx = 0
+    for i in range(0, len(image_bytes), 3):
+        r = image_bytes[i]
+        g = image_bytes[i+1]
+        b = image_bytes[i+2]
+        pixel = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+        buffer[idx:idx+2] = struct.pack("<H", pixel)
+        idx += 2
+    return bytes(buffer)
+
+
+def sample_image():
+    """Immagine di prova con gradienti su tutti i canali (copre tutti i valori 0-255)."""
+    img = Image.new('RGB', (FB_WIDTH, FB_HEIGHT))
+    img.putdata([
+        ((x * 255) // (FB_WIDTH - 1), (y * 255) // (FB_HEIGHT - 1), (x ^ y) & 0xFF)
+        for y in range(FB_HEIGHT) for x in range(FB_WIDTH)
+    ])
+    return img
+
+
+def timeit(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure(func, repeat, setup=None):
+    """Esegue func() 'repeat' volte (dopo setup(), non misurato) e riassume i tempi in ms."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return summarize(times)
+
+
+def summarize(times_ms):
+    return {
+        'min_ms': round(min(times_ms), 4),
+        'median_ms': round(statistics.median(times_ms), 4),
+        'mean_ms': round(statistics.fmean(times_ms), 4),
+        'max_ms': round(max(times_ms), 4),
+        'runs': len(times_ms),
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silenzia le stampe delle app durante le misure."""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+class FakeFramebuffer:
+    """File temporaneo grande quanto il framebuffer, su cui scrivono le app finte del manager."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'fb')
+        with open(self.path, 'wb') as f:
+            f.write(bytes(FRAME_SIZE))
+
+    def clear(self):
+        with open(self.path, 'r+b') as f:
+            f.write(bytes(FRAME_SIZE))
+
+    def first_byte(self):
+        with open(self.path, 'rb') as f:
+            return f.read(1)[0]
+
+
+AbsInfo = namedtuple('AbsInfo', 'value min max fuzz flat resolution')
+
+class FakeTouchDevice:
+    """Dispositivo evdev simulato: read() restituisce gli eventi messi in coda con tap()."""
+
+    def __init__(self, max_raw=4095):
+        self.max_raw = max_raw
+        self._events = []
+
+    def absinfo(self, code):
+        return AbsInfo(0, 0, self.max_raw, 0, 0, 0)
+
+    def tap(self, raw_x, raw_y):
+        from evdev import InputEvent, ecodes
+        now = time.time()
+        sec, usec = int(now), int(now % 1 * 1e6)
+        self._events = [
+            InputEvent(sec, usec, ecodes.EV_KEY, ecodes.BTN_TOUCH, 1),
+            InputEvent(sec, usec, ecodes.EV_ABS, ecodes.ABS_X, raw_x),
+            InputEvent(sec, usec, ecodes.EV_ABS, ecodes.ABS_Y, raw_y),
+            InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+            InputEvent(sec, usec, ecodes.EV_KEY, ecodes.BTN_TOUCH, 0),
+            InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        ]
+
+    def read(self):
+        if not self._events:
+            raise BlockingIOError
+        events, self._events = self._events, []
+        return iter(events)
+
+
+# --- Benchmark ---
+def bench_rgb565(results, repeat, workdir, fb):
+    img = sample_image().rotate(180, expand=True)
+
+    if legacy_rgb565(img) != image_to_rgb565(img):
+        print("ERRORE: la conversione vettoriale non è identica a quella originale!", file=sys.stderr)
+        sys.exit(1)
+
+    t_legacy = timeit(lambda: legacy_rgb565(img), max(1, repeat // 5))
+    t_fast = timeit(lambda: image_to_rgb565(img), repeat * 20)
+
+    print(f"RGB565 {FB_WIDTH}x{FB_HEIGHT}: originale {t_legacy*1000:.1f} ms, "
+          f"vettoriale {t_fast*1000:.2f} ms (x{t_legacy/t_fast:.0f})")
+    results['rgb565.legacy'] = summarize([t_legacy * 1000])
+    results['rgb565.convert'] = measure(lambda: image_to_rgb565(img), repeat * 20)
+
+    import rpi
+    screen = sample_image()
+    with quiet():
+        results['rgb565.draw_image_to_fb'] = measure(lambda: rpi.draw_image_to_fb(screen), repeat * 5)
+
+
+def bench_rpi(results, repeat, workdir, fb):
+    """Ogni schermata di rpi.py dal dato al framebuffer, con sorgenti di dati fisse."""
+    import rpi
+    from status import StatusSnapshot
+
+    class FixedLogStream:
+        lines = [f"2025-01-01 12:00:{i:02d} servizio[123]: riga di log di prova numero {i}" for i in range(40)]
+
+        def start(self):
+            pass
+
+        def is_running(self):
+            return True
+
+        def snapshot(self):
+            return self.lines
+
+    class FixedStatus:
+        def snapshot(self):
+            return StatusSnapshot({service: True for service in rpi.SERVICES}, 'ok',
+                                  [('immich_server', 'Up 3 days'), ('immich_postgres', 'Up 3 days'),
+                                   ('redis', 'Up 3 days'), ('nginx-proxy', 'Exited (1)')], time.time())
+
+    rpi.display = None
+    for name in ('immich', 'nginx', 'squid'):
+        rpi.log_streams[name] = FixedLogStream()
+    rpi.status_poller = FixedStatus()
+    rpi.metrics_sampler.sample()
+    rpi.container_stats = [(f'container_{i}', 'Up 2 hours', {'cpu_percent': 12.5 * i, 'mem_used': 200 << 20})
+                           for i in range(5)]
+
+    def fresh_container_stats():
+        rpi.container_stats_time = time.monotonic()
+
+    screens = {
+        'dashboard': rpi.print_dashboard, 'logs': rpi.logs, 'immich_logs': rpi.immich,
+        'nginx_logs': rpi.nginx, 'squid_logs': rpi.squid, 'memoria': rpi.memoria,
+        'servizi': rpi.servizi, 'prestazioni': rpi.prestazioni, 'contenitori': rpi.contenitori,
+    }
+    with quiet():
+        for name, screen in screens.items():
+            # A freddo: nessun frame o intestazione in cache (primo accesso alla schermata)
+            results[f'rpi.{name}.cold'] = measure(screen, repeat, setup=lambda: (rpi.screen_cache.clear(),
+                                                                                   fresh_container_stats()))
+            results[f'rpi.{name}'] = measure(screen, repeat, setup=fresh_container_stats)
+    for timer in rpi.refresh_timers.values():
+        timer.cancel()
+    rpi.refresh_timers.clear()
+
+
+def make_photos(directory):
+    """Foto sintetiche come quelle di un telefono: 12 MP orizzontale e verticale (EXIF)."""
+    photos = {}
+    size = (4032, 3024)
+    bands = [Image.effect_noise(size, 40).point(lambda v, o=offset: (v + o) % 256) for offset in (0, 85, 170)]
+    base = Image.merge('RGB', bands)
+    photos['landscape'] = os.path.join(directory, 'landscape.jpg')
+    base.save(photos['landscape'], quality=90)
+    exif = Image.Exif()
+    exif[0x0112] = 6   # Orientation: ruotata di 90° (foto verticale)
+    photos['portrait_exif'] = os.path.join(directory, 'portrait.jpg')
+    base.save(photos['portrait_exif'], quality=90, exif=exif)
+    photos['png'] = os.path.join(directory, 'screenshot.png')
+    base.resize((1170, 2532)).save(photos['png'])
+    return photos
+
+
+def bench_immich(results, repeat, workdir, fb):
+    """Decodifica, adattamento e rotazione di una foto fino al framebuffer (immich.run_viewer)."""
+    import immich
+    from rendercache import RenderCache
+
+    immich.DELAY_BETWEEN_ASSETS = 0
+    photos = make_photos(workdir)
+    cache = RenderCache(os.path.join(workdir, 'frame_cache'), frame_size=immich.FRAME_SIZE)
+    with quiet():
+        for name, path in photos.items():
+            results[f'immich.run_viewer.{name}'] = measure(
+                lambda: immich.run_viewer(path, 'bench', immich.prepare_frame(path)), repeat)
+        path = photos['landscape']
+        immich.prepare_frame(path, cache)
+        results['immich.run_viewer.cache_hit'] = measure(
+            lambda: immich.run_viewer(path, 'bench', immich.prepare_frame(path, cache)), repeat * 5)
+
+
+def bench_yt(results, repeat, workdir, fb):
+    """Throughput di play_video_to_framebuffer con un flusso rawvideo sintetico (e con ffmpeg vero, se c'è)."""
+    import yt
+
+    real_ffmpeg = shutil.which('ffmpeg')
+    bin_dir = os.path.join(workdir, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    fake_ffmpeg = os.path.join(bin_dir, 'ffmpeg')
+    with open(fake_ffmpeg, 'w') as f:
+        f.write(SYNTHETIC_FFMPEG.format(python=sys.executable, w=FB_WIDTH, h=FB_HEIGHT,
+                                        size=FRAME_SIZE, frames=VIDEO_FRAMES))
+    os.chmod(fake_ffmpeg, 0o755)
+
+    def play(source, key):
+        runs = []
+        for _ in range(max(1, repeat // 5)):
+            with quiet():
+                runs.append(yt.play_video_to_framebuffer(source, pace=False))
+        best = max(runs, key=lambda stats: stats['shown'] / stats['elapsed'] if stats['elapsed'] else 0)
+        if not best['shown']:
+            print(f"  {key}: nessun frame ricevuto", file=sys.stderr)
+            return
+        results[key] = {
+            'fps': round(best['shown'] / best['elapsed'], 1),
+            'frames': best['shown'],
+            'write_mean_ms': round(best['write_total'] / best['shown'] * 1000, 4),
+            'write_max_ms': round(best['write_max'] * 1000, 4),
+            'ffmpeg_cpu_ms_per_frame': round(best['cpu'] / best['shown'] * 1000, 3) if best['cpu'] else None,
+            'runs': len(runs),
+        }
+
+    path = os.environ['PATH']
+    os.environ['PATH'] = bin_dir + os.pathsep + path
+    try:
+        play('sintetico', 'yt.play_video_to_framebuffer.synthetic')
+    finally:
+        os.environ['PATH'] = path
+
+    if real_ffmpeg:
+        clip = os.path.join(workdir, 'clip.mp4')
+        generated = subprocess.run([real_ffmpeg, '-v', 'error', '-y', '-f', 'lavfi', '-i',
+                                    'testsrc2=size=640x360:rate=30:duration=10',
+                                    '-c:v', 'libx264', '-pix_fmt', 'yuv420p', clip],
+                                   capture_output=True).returncode == 0
+        if generated:
+            play(clip, 'yt.play_video_to_framebuffer.h264_360p')
+
+
+def bench_touch(results, repeat, workdir, fb):
+    """Dal report evdev al gesto riconosciuto (TouchTracker su dispositivo simulato)."""
+    import touch
+
+    device = FakeTouchDevice()
+    gestures = []
+    open_device = touch.InputDevice
+    touch.InputDevice = lambda path: device
+    try:
+        _, tracker = touch.open_touchscreen('/dev/input/bench', FB_WIDTH, FB_HEIGHT, gestures.append)
+    finally:
+        touch.InputDevice = open_device
+
+    def setup():
+        tracker._release_time = float('-inf')   # niente debounce tra un tap e l'altro
+        device.tap(1000, 2000)
+
+    results['touch.tap_to_gesture'] = measure(lambda: tracker.read(device), repeat * 20, setup=setup)
+    if len(gestures) != repeat * 20:
+        print(f"  touch: riconosciuti {len(gestures)} gesti su {repeat * 20} tap", file=sys.stderr)
+
+
+def bench_manager(results, repeat, workdir, fb):
+    """Cambio app a processi (manager.start_app): durata della chiamata e tempo al primo frame."""
+    import manager
+
+    app_dir = os.path.join(workdir, 'apps')
+    os.makedirs(app_dir, exist_ok=True)
+    marks = {}
+    for mark, name in enumerate(manager.APPS, 1):
+        marks[name] = mark
+        with open(os.path.join(app_dir, f'{name}.py'), 'w') as f:
+            f.write(STUB_APP.format(mark=mark, size=FRAME_SIZE))
+    manager.APP_DIR = app_dir
+    manager.APP_GROUPS_FILE = os.path.join(workdir, 'groups')
+    os.environ['BENCH_FB'] = fb.path
+
+    calls, first_frames = [], []
+    try:
+        with quiet():
+            for i in range(repeat):
+                name = manager.APPS[i % len(manager.APPS)]
+                fb.clear()
+                start = time.perf_counter()
+                manager.start_app(name)
+                calls.append((time.perf_counter() - start) * 1000)
+                deadline = time.monotonic() + 10
+                while fb.first_byte() != marks[name] and time.monotonic() < deadline:
+                    time.sleep(0.001)
+                first_frames.append((time.perf_counter() - start) * 1000)
+    finally:
+        with quiet():
+            if manager.current_process is not None:
+                manager.stop_process_group(manager.current_process.pid, manager.current_process)
+                manager.current_process = None
+    results['manager.start_app.call'] = summarize(calls)
+    results['manager.start_app.first_frame'] = summarize(first_frames)
+
+
+def bench_metrics(results, repeat, workdir, fb):
+    """Costo di uno span di metrics.py per chiamata, con le metriche spente e accese."""
+    import metrics
+
+    calls = 10000
+    def spans():
+        for _ in range(calls):
+            with metrics.span('bench', 'vuoto'):
+                pass
+
+    enabled = metrics.ENABLED
+    try:
+        for name, state in (('off', False), ('on', True)):
+            metrics.ENABLED = state
+            timing = measure(spans, repeat)
+            results[f'metrics.span.{name}'] = {'ns_per_span': round(timing['median_ms'] * 1e6 / calls), 'runs': repeat}
+    finally:
+        metrics.ENABLED = enabled
+
+
+BENCHMARKS = {
+    'rgb565': bench_rgb565,
+    'rpi': bench_rpi,
+    'immich': bench_immich,
+    'yt': bench_yt,
+    'touch': bench_touch,
+    'manager': bench_manager,
+    'metrics': bench_metrics,
+}
+
+
+# --- Risultati ---
+def revision():
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=APP_DIR,
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    for key, values in results.items():
+        if 'min_ms' in values:
+            print(f"  {key:<42} min {values['min_ms']:>10.3f} ms   mediana {values['median_ms']:>10.3f} ms")
+        else:
+            details = ", ".join(f"{k}={v}" for k, v in values.items())
+            print(f"  {key:<42} {details}")
+
+
+def headline(values):
+    """Il valore da confrontare tra due revisioni (più basso = meglio)."""
+    if 'min_ms' in values:
+        return values['median_ms']
+    if values.get('fps'):
+        return 1000 / values['fps']
+    return None
+
+
+def compare(old, new):
+    print(f"\nConfronto con {old.get('revision') or 'revisione sconosciuta'} "
+          f"(più basso = meglio, oltre +{REGRESSION_THRESHOLD:.0%} = PEGGIORATO):")
+    for key, values in new['results'].items():
+        before = old['results'].get(key)
+        if before is None:
+            continue
+        a, b = headline(before), headline(values)
+        if not a or b is None:
+            continue
+        change = (b - a) / a
+        flag = "  PEGGIORATO" if change > REGRESSION_THRESHOLD else ""
+        print(f"  {key:<42} {a:>10.3f} -> {b:>10.3f} ms  ({change:+.0%}){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dello stack dello schermo (senza pannello).")
+    parser.add_argument('--solo', help=f"benchmark da eseguire, separati da virgola ({','.join(BENCHMARKS)})")
+    parser.add_argument('--ripetizioni', type=int, default=REPEAT, help="ripetizioni per misura")
+    parser.add_argument('--display', default='memoria', choices=('memoria', 'file', 'png'),
+                        help="backend di display su cui scrivono le app (default: memoria)")
+    parser.add_argument('--json', help="salva i risultati in questo file")
+    parser.add_argument('--confronta', help="confronta con i risultati salvati in questo file")
+    args = parser.parse_args()
+
+    selected = args.solo.split(',') if args.solo else list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"benchmark sconosciuti: {', '.join(unknown)}")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='screen-bench-') as workdir:
+        fb = FakeFramebuffer(workdir)
+        # Letti da framebuffer.py al primo import, che avviene nei singoli benchmark
+        os.environ['SCREEN_DISPLAY'] = args.display
+        os.environ['SCREEN_OUTPUT'] = os.path.join(workdir, 'display.png' if args.display == 'png' else 'display')
+        for name in selected:
+            print(f"--- {name} ---")
+            start = time.monotonic()
+            try:
+                BENCHMARKS[name](results, args.ripetizioni, workdir, fb)
+            except ImportError as e:
+                print(f"  saltato: dipendenza mancante ({e})", file=sys.stderr)
+            print(f"  ({time.monotonic() - start:.1f} s)")
+
+    report = {
+        'revision': revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'repeat': args.ripetizioni,
+        'display': args.display,
+        'results': results,
+    }
+    print("\nRisultati:")
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRisultati salvati in {args.json}")
+    if args.confronta:
+        with open(args.confronta) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
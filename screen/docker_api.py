@@ -0,0 +1,236 @@
+import http.client
+import io
+import json
+import socket
+import struct
+import threading
+from urllib.parse import quote, urlencode
+
+# --- Costanti di configurazione ---
+DOCKER_SOCKET = '/var/run/docker.sock'
+TIMEOUT = 5
+
+
+class DockerError(Exception):
+    pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """Connessione HTTP/1.1 su socket unix (keep-alive gestito da http.client)."""
+
+    def __init__(self, socket_path, timeout=TIMEOUT):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+def _container_path(name, action, **params):
+    path = f"/containers/{quote(name, safe='')}/{action}"
+    if params:
+        path += '?' + urlencode(params)
+    return path
+
+def _read_frames(read):
+    """
+    Demultiplexa lo stream dei log Docker (header di 8 byte: canale, 0, 0, 0,
+    lunghezza big-endian) restituendo i blocchi di dati in ordine.
+    """
+    while True:
+        header = read(8)
+        if len(header) < 8:
+            return
+        _, size = struct.unpack('>BxxxL', header)
+        data = read(size)
+        if not data:
+            return
+        yield data
+
+def _split_lines(chunks):
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8', errors='replace')
+    if pending:
+        yield pending.decode('utf-8', errors='replace')
+
+
+class DockerClient:
+    """
+    Client minimale per l'API Docker Engine su /var/run/docker.sock.
+
+    Tutte le richieste riusano la stessa connessione persistente (riaperta
+    una volta sola se il demone l'ha chiusa); i log in modalità follow usano
+    una connessione dedicata, vedi DockerLogSource.
+    """
+
+    def __init__(self, socket_path=DOCKER_SOCKET, timeout=TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+        self._tty = {}
+        self._last_cpu = {}
+
+    def _request(self, path):
+        with self._lock:
+            for attempt in range(2):
+                if self._conn is None:
+                    self._conn = UnixHTTPConnection(self.socket_path, self.timeout)
+                try:
+                    self._conn.request('GET', path)
+                    response = self._conn.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, ConnectionError, socket.timeout):
+                    self._close()
+                    if attempt:
+                        raise
+                    continue
+                except OSError:
+                    self._close()
+                    raise
+                if response.will_close:
+                    self._close()
+                return response.status, body
+
+    def _get_json(self, path):
+        status, body = self._request(path)
+        if status != 200:
+            try:
+                message = json.loads(body).get('message', '')
+            except ValueError:
+                message = body.decode('utf-8', errors='replace')
+            raise DockerError(f"{status}: {message.strip()}")
+        return json.loads(body)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def containers(self, all=False):
+        """Equivalente di 'docker ps': lista di (nome, stato), es. ('immich_server', 'Up 3 days')."""
+        path = '/containers/json' + ('?all=1' if all else '')
+        return [(c['Names'][0].lstrip('/'), c['Status']) for c in self._get_json(path)]
+
+    def is_tty(self, name):
+        if name not in self._tty:
+            self._tty[name] = self._get_json(_container_path(name, 'json'))['Config']['Tty']
+        return self._tty[name]
+
+    def logs(self, name, tail=20):
+        """Ultime 'tail' righe di stdout e stderr del container."""
+        tty = self.is_tty(name)
+        status, body = self._request(_container_path(name, 'logs', stdout=1, stderr=1, tail=tail))
+        if status != 200:
+            raise DockerError(f"{status}: {body.decode('utf-8', errors='replace').strip()}")
+        if tty:
+            chunks = [body]
+        else:
+            chunks = _read_frames(io.BytesIO(body).read)
+        return list(_split_lines(chunks))
+
+    def stats(self, name):
+        """
+        CPU (%) e memoria (byte usati, limite) di un container.
+
+        Usa la lettura singola 'one-shot' e calcola la CPU rispetto alla
+        lettura precedente: la prima chiamata per un container restituisce
+        cpu_percent = None.
+        """
+        data = self._get_json(_container_path(name, 'stats', stream='false', **{'one-shot': 'true'}))
+
+        cpu = data.get('cpu_stats', {})
+        total = cpu.get('cpu_usage', {}).get('total_usage', 0)
+        system = cpu.get('system_cpu_usage', 0)
+        online = cpu.get('online_cpus') or len(cpu.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+
+        cpu_percent = None
+        previous = self._last_cpu.get(name)
+        if previous and system > previous[1]:
+            cpu_percent = (total - previous[0]) / (system - previous[1]) * online * 100
+        self._last_cpu[name] = (total, system)
+
+        memory = data.get('memory_stats', {})
+        details = memory.get('stats', {})
+        cache = details.get('inactive_file', details.get('cache', 0))
+        mem_used = max(0, memory.get('usage', 0) - cache)
+
+        return {'cpu_percent': cpu_percent, 'mem_used': mem_used, 'mem_limit': memory.get('limit', 0)}
+
+
+class DockerLogSource:
+    """
+    Sorgente per logtail.LogStream: segue i log di un container tramite API
+    su una connessione dedicata, senza avviare il client 'docker'.
+    """
+
+    def __init__(self, client, name, tail=20):
+        self.client = client
+        self.name = name
+        self.tail = tail
+        self._conn = None
+        self._response = None
+        self._tty = False
+
+    def open(self):
+        tty = self.client.is_tty(self.name)
+        # Connessione e header con il timeout normale (un demone bloccato non blocca
+        # il lettore per sempre), poi lettura senza timeout: i log arrivano quando arrivano
+        self._conn = UnixHTTPConnection(self.client.socket_path)
+        self._conn.request('GET', _container_path(self.name, 'logs', stdout=1, stderr=1,
+                                                  follow=1, tail=self.tail))
+        self._response = self._conn.getresponse()
+        if self._response.status != 200:
+            body = self._response.read().decode('utf-8', errors='replace').strip()
+            self._conn.close()
+            raise DockerError(f"{self._response.status}: {body}")
+        self._conn.sock.settimeout(None)
+        self._tty = tty
+        return self
+
+    def __iter__(self):
+        # Riferimenti locali: una nuova open() non deve cambiare la connessione sotto il lettore
+        response, conn = self._response, self._conn
+        try:
+            if self._tty:
+                chunks = iter(lambda: response.read1(4096), b'')
+            else:
+                chunks = _read_frames(response.read)
+            yield from _split_lines(chunks)
+        except (OSError, ValueError, http.client.HTTPException):
+            return
+        finally:
+            conn.close()
+
+    def close(self):
+        """Interrompe la lettura: il thread che itera vede la fine dello stream e chiude la connessione."""
+        if self._conn is not None and self._conn.sock is not None:
+            try:
+                self._conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+# --- Client condiviso nel processo ---
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = DockerClient()
+    return _client
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+import metrics
+
+# --- Dimensioni delle cache ---
+FONT_CACHE_SIZE = 16
+TEXT_CACHE_SIZE = 256
+
+# --- Atlante dei testi già rasterizzati: (font, testo) -> (maschera, offset) ---
+_text_cache = OrderedDict()
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(path, size):
+    """Carica un font TrueType una sola volta per processo per ogni (path, size)."""
+    with metrics.span('rpi', 'font_load'):
+        try:
+            return ImageFont.truetype(path, size)
+        except IOError:
+            print(f"Attenzione: Font non trovato a {path}. Uso il default.")
+            return ImageFont.load_default()
+
+
+def _rasterize(text, font):
+    x0, y0, x1, y1 = font.getbbox(text)
+    mask = Image.new('L', (max(1, x1 - x0), max(1, y1 - y0)))
+    ImageDraw.Draw(mask).text((-x0, -y0), text, fill=255, font=font)
+    return mask, (x0, y0)
+
+
+def _glyphs(text, font):
+    key = (font, text)
+    entry = _text_cache.get(key)
+    if entry is not None:
+        _text_cache.move_to_end(key)
+        return entry
+
+    entry = _rasterize(text, font)
+    _text_cache[key] = entry
+    if len(_text_cache) > TEXT_CACHE_SIZE:
+        _text_cache.popitem(last=False)
+    return entry
+
+
+def draw_text(draw, xy, text, font, fill):
+    """
+    Equivalente di draw.text() per le stringhe fisse (etichette, pulsanti).
+
+    La prima volta il testo viene rasterizzato da FreeType in una maschera;
+    le volte successive è solo un blit della maschera con il colore richiesto.
+    """
+    x, y = xy
+    mask, (dx, dy) = _glyphs(text, font)
+    draw.bitmap((int(x) + dx, int(y) + dy), mask, fill=fill)
+
+
+def prewarm(strings):
+    """Pre-rasterizza una lista di (testo, path, size) all'avvio."""
+    for text, path, size in strings:
+        _glyphs(text, get_font(path, size))
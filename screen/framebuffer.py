@@ -0,0 +1,351 @@
+import mmap
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from rgb565 import pixel_array
+
+# --- Costanti di configurazione ---
+# Ogni valore si può cambiare con la variabile d'ambiente indicata, così lo
+# stesso codice gira sul pannello, su un pannello diverso o senza pannello.
+DISPLAY_BACKEND = os.environ.get('SCREEN_DISPLAY', 'fb')         # fb, memoria, file, png
+FRAMEBUFFER_DEVICE = os.environ.get('SCREEN_FB_DEVICE', '/dev/fb1')
+DISPLAY_OUTPUT = os.environ.get('SCREEN_OUTPUT')                  # file dei backend 'file' e 'png'
+DISPLAY_SIZE = os.environ.get('SCREEN_SIZE')                      # 'LxA'; se assente si legge da sysfs
+DISPLAY_BPP = os.environ.get('SCREEN_BPP')                        # 16 o 32; se assente si legge da sysfs
+SNAPSHOT_INTERVAL = float(os.environ.get('SCREEN_PNG_INTERVAL', '1.0'))  # secondi minimi tra due PNG
+
+DEFAULT_WIDTH, DEFAULT_HEIGHT = 480, 320   # geometria del pannello originale, se non è leggibile altrove
+DEFAULT_BPP = 16
+DEFAULT_OUTPUTS = {'file': '/tmp/screen_fb.raw', 'png': '/tmp/screen.png'}
+SYSFS_GRAPHICS = '/sys/class/graphics'
+BACKENDS = ('fb', 'memoria', 'file', 'png')
+
+# Formati dei pixel supportati: tipo NumPy di un pixel e nome del formato per ffmpeg
+PIXEL_FORMATS = {16: ('<u2', 'rgb565le'), 32: ('<u4', 'bgr0')}
+
+
+class DisplayMode(namedtuple('DisplayMode', 'width height bits_per_pixel stride')):
+    """Geometria e formato dei pixel di un display; 'stride' è la lunghezza in byte di una riga."""
+
+    __slots__ = ()
+
+    @property
+    def bytes_per_pixel(self):
+        return self.bits_per_pixel // 8
+
+    @property
+    def frame_size(self):
+        """Byte di un frame compatto (senza il padding di fine riga), come lo ricevono i blit."""
+        return self.width * self.height * self.bytes_per_pixel
+
+    @property
+    def dtype(self):
+        return PIXEL_FORMATS[self.bits_per_pixel][0]
+
+    @property
+    def pix_fmt(self):
+        return PIXEL_FORMATS[self.bits_per_pixel][1]
+
+    def encode(self, img, rotate_180=False):
+        """Byte dell'immagine PIL nel formato dei pixel di questo display."""
+        return pixel_array(img, self.bits_per_pixel, rotate_180=rotate_180).tobytes()
+
+
+def _read_sysfs(device, attribute):
+    path = os.path.join(SYSFS_GRAPHICS, os.path.basename(device), attribute)
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def sysfs_mode(device=None):
+    """
+    Geometria del framebuffer letta da sysfs, oppure None se non disponibile
+    (nessun pannello, oppure un file normale usato come framebuffer).
+    """
+    device = device or FRAMEBUFFER_DEVICE
+    bpp = _read_sysfs(device, 'bits_per_pixel')
+    # 'modes' contiene la risoluzione visibile (es. "U:480x320p-0"), 'virtual_size'
+    # quella virtuale, che con il doppio buffer può essere più alta
+    modes = _read_sysfs(device, 'modes')
+    virtual = _read_sysfs(device, 'virtual_size')
+    try:
+        if modes:
+            width, height = modes.splitlines()[0].split(':')[-1].split('p')[0].split('x')
+        elif virtual:
+            width, height = virtual.split(',')
+        else:
+            return None
+        width, height, bpp = int(width), int(height), int(bpp)
+        stride = int(_read_sysfs(device, 'stride') or width * bpp // 8)
+    except (TypeError, ValueError):
+        return None
+    return DisplayMode(width, height, bpp, stride)
+
+
+def display_mode(backend=None, device=None):
+    """
+    Geometria del display configurato: SCREEN_SIZE e SCREEN_BPP hanno la
+    precedenza, poi (per il backend 'fb') quanto dichiara il dispositivo in
+    sysfs, infine il pannello originale 480x320 a 16 bpp.
+    """
+    backend = backend or DISPLAY_BACKEND
+    detected = sysfs_mode(device) if backend == 'fb' else None
+    width, height = (detected.width, detected.height) if detected else (DEFAULT_WIDTH, DEFAULT_HEIGHT)
+    bpp = detected.bits_per_pixel if detected else DEFAULT_BPP
+    if DISPLAY_SIZE:
+        width, height = (int(value) for value in DISPLAY_SIZE.lower().split('x'))
+    if DISPLAY_BPP:
+        bpp = int(DISPLAY_BPP)
+    if bpp not in PIXEL_FORMATS:
+        raise ValueError(f"Profondità di colore non supportata: {bpp} bpp "
+                         f"(supportate: {', '.join(map(str, PIXEL_FORMATS))})")
+    stride = width * bpp // 8
+    if detected and (width, height, bpp) == detected[:3]:
+        stride = detected.stride
+    return DisplayMode(width, height, bpp, stride)
+
+
+# --- Backend ---
+class MemoryDisplay:
+    """
+    Display in memoria, senza pannello: misure e prove su qualunque macchina.
+
+    'buffer' è una memoryview scrivibile sull'intero schermo e 'pixels' una
+    vista NumPy (H, W) sugli stessi byte (uint16 a 16 bpp, uint32 a 32 bpp).
+    Gli altri backend cambiano solo la memoria sottostante.
+    """
+
+    def __init__(self, mode=None):
+        mode = mode or display_mode('memoria')
+        self._init_view(mode, bytearray(mode.stride * mode.height))
+
+    def _init_view(self, mode, memory):
+        self.mode = mode
+        self.width = mode.width
+        self.height = mode.height
+        self.bits_per_pixel = mode.bits_per_pixel
+        self.frame_size = mode.frame_size
+        self._packed = mode.stride == mode.width * mode.bytes_per_pixel
+        self._memory = memory
+        self.buffer = memoryview(memory)[:mode.stride * mode.height]
+        self.pixels = np.ndarray((mode.height, mode.width), dtype=mode.dtype, buffer=memory,
+                                 strides=(mode.stride, mode.bytes_per_pixel))
+
+    def blit(self, data, x=0, y=0, width=None, height=None):
+        """
+        Copia dati già convertiti nel formato del display sullo schermo.
+
+        Senza rettangolo copia un frame intero; altrimenti 'data' contiene
+        width*height pixel da posizionare a partire da (x, y).
+        """
+        if width is None and height is None:
+            if self._packed:
+                self.buffer[:] = data
+            else:
+                self.pixels[...] = np.frombuffer(data, dtype=self.mode.dtype).reshape(self.height, self.width)
+        else:
+            src = np.frombuffer(data, dtype=self.mode.dtype).reshape(height, width)
+            self.pixels[y:y + height, x:x + width] = src
+        self._updated()
+        if _first_frame_callbacks:
+            _frame_written()
+
+    def show_image(self, img, x=0, y=0, rotate_180=False):
+        """
+        Converte un'immagine PIL direttamente dentro il display.
+
+        Con rotate_180 le coordinate (x, y) sono quelle dell'immagine logica
+        (prima della rotazione del pannello), così un aggiornamento parziale
+        finisce nel punto giusto anche sullo schermo montato capovolto.
+        """
+        w, h = img.size
+        if rotate_180:
+            x = self.width - x - w
+            y = self.height - y - h
+        pixel_array(img, self.bits_per_pixel, rotate_180=rotate_180, out=self.pixels[y:y + h, x:x + w])
+        self._updated()
+        if _first_frame_callbacks:
+            _frame_written()
+
+    def clear(self):
+        self.pixels.fill(0)
+        self._updated()
+
+    def copy_frame(self):
+        """Copia compatta del frame mostrato, da ridare a blit() in seguito."""
+        return bytes(self.buffer) if self._packed else self.pixels.tobytes()
+
+    def snapshot(self):
+        """Il contenuto dello schermo come immagine PIL RGB, nell'ordine dei pixel in memoria."""
+        pixels = self.pixels
+        if self.bits_per_pixel == 16:
+            rgb = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            rgb[..., 0] = (pixels >> 8) & 0xF8
+            rgb[..., 1] = (pixels >> 3) & 0xFC
+            rgb[..., 2] = (pixels << 3) & 0xF8
+        else:
+            rgb = np.dstack([(pixels >> shift) & 0xFF for shift in (16, 8, 0)]).astype(np.uint8)
+        return Image.fromarray(rgb, 'RGB')
+
+    def _updated(self):
+        """Chiamato dopo ogni scrittura: i backend che devono pubblicare il frame lo fanno qui."""
+
+    def close(self):
+        self.pixels = None
+        self.buffer.release()
+        _forget(self)
+
+
+class Framebuffer(MemoryDisplay):
+    """
+    Framebuffer del pannello (/dev/fbN) mappato in memoria una sola volta:
+    scrivere in 'buffer' o 'pixels' significa scrivere direttamente sul
+    pannello, senza open/seek/write per ogni frame.
+    """
+
+    def __init__(self, device=None, mode=None):
+        self.device = device or FRAMEBUFFER_DEVICE
+        mode = mode or display_mode('fb', self.device)
+
+        self._fd = os.open(self.device, os.O_RDWR)
+        try:
+            self._mmap = mmap.mmap(self._fd, mode.stride * mode.height, mmap.MAP_SHARED,
+                                   mmap.PROT_READ | mmap.PROT_WRITE)
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._init_view(mode, self._mmap)
+
+    def close(self):
+        super().close()
+        self._mmap.close()
+        os.close(self._fd)
+
+
+class FileDisplay(Framebuffer):
+    """
+    Come Framebuffer, ma su un file normale (creato se manca): un altro
+    processo può leggerlo o mapparlo per vedere lo schermo.
+    """
+
+    def __init__(self, path=None, mode=None):
+        path = path or DISPLAY_OUTPUT or DEFAULT_OUTPUTS['file']
+        mode = mode or display_mode('file')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < mode.stride * mode.height:
+                os.ftruncate(fd, mode.stride * mode.height)
+        finally:
+            os.close(fd)
+        super().__init__(path, mode)
+
+
+class PngDisplay(MemoryDisplay):
+    """
+    Display in memoria che salva il contenuto in un PNG: al più uno ogni
+    'interval' secondi, e comunque l'ultimo frame entro 'interval' secondi
+    dalla scrittura. Utile per vedere le schermate senza pannello; con
+    rotate_180 il PNG è dritto come lo vede chi guarda il pannello capovolto.
+    """
+
+    def __init__(self, path=None, mode=None, interval=None, rotate_180=True):
+        super().__init__(mode or display_mode('png'))
+        self.path = path or DISPLAY_OUTPUT or DEFAULT_OUTPUTS['png']
+        self.interval = SNAPSHOT_INTERVAL if interval is None else interval
+        self.rotate_180 = rotate_180
+        self._lock = threading.Lock()
+        self._saved = float('-inf')
+        self._timer = None
+
+    def _updated(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            delay = self._saved + self.interval - time.monotonic()
+            if delay <= 0:
+                self._save()
+            else:
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Salva subito il PNG del frame corrente."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.pixels is not None:
+                self._save()
+
+    def _save(self):
+        temp = self.path + '.tmp'
+        image = self.snapshot()
+        if self.rotate_180:
+            image = image.transpose(Image.Transpose.ROTATE_180)
+        image.save(temp, 'PNG')
+        os.replace(temp, self.path)
+        self._saved = time.monotonic()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+# --- Display aperti (uno per backend e destinazione, condivisi nel processo) ---
+_framebuffers = {}
+
+
+def open_display(backend=None, target=None, mode=None):
+    """Apre un nuovo display del backend indicato ('target' è il dispositivo o il file di uscita)."""
+    backend = backend or DISPLAY_BACKEND
+    if backend == 'fb':
+        return Framebuffer(target, mode)
+    if backend == 'memoria':
+        return MemoryDisplay(mode)
+    if backend == 'file':
+        return FileDisplay(target, mode)
+    if backend == 'png':
+        return PngDisplay(target, mode)
+    raise ValueError(f"Backend del display sconosciuto: {backend} (validi: {', '.join(BACKENDS)})")
+
+
+def get_framebuffer(backend=None, target=None):
+    """
+    Restituisce il display configurato (SCREEN_DISPLAY, per default il
+    framebuffer del pannello), aprendolo al primo uso.
+    """
+    key = (backend or DISPLAY_BACKEND, target)
+    fb = _framebuffers.get(key)
+    if fb is None:
+        fb = open_display(*key)
+        _framebuffers[key] = fb
+    return fb
+
+
+def _forget(display):
+    for key, fb in list(_framebuffers.items()):
+        if fb is display:
+            del _framebuffers[key]
+
+
+# --- Notifica del primo frame (usata dal fork server per misurare l'avvio) ---
+_first_frame_callbacks = []
+
+def on_first_frame(callback):
+    """Chiama callback() una sola volta, dopo la prossima scrittura di un frame."""
+    _first_frame_callbacks.append(callback)
+
+def _frame_written():
+    callbacks = _first_frame_callbacks[:]
+    _first_frame_callbacks.clear()
+    for callback in callbacks:
+        callback()
@@ -1,124 +1,446 @@
 import os
-import subprocess
 import time
 import itertools
 import sys
-import tempfile
-from PIL import Image
+import multiprocessing
+import queue
+import threading
+from PIL import Image, ImageOps
 
-# --- CONFIGURAZIONE ---
-ROOT_SCAN_DIRECTORY = "/mnt/raidbox/library/library/43b4b13a-4027-4270-9b39-a0cf27ad1641/2025/"
+from framebuffer import get_framebuffer, display_mode
+from apphost import App
+import metrics
+from mediaindex import MediaIndex
+from playlist import Playlist
+from rendercache import EVICT_TO, RenderCache
+
+# Le foto HEIC (iPhone) si aprono solo se è installato pillow-heif
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
 
-FBI_COMMAND = "fbi"
+# --- CONFIGURAZIONE ---
+# Radice dell'intera libreria Immich: tutte le sottodirectory (anni, giorni...) finiscono nell'indice
+ROOT_SCAN_DIRECTORY = "/mnt/raidbox/library/library/43b4b13a-4027-4270-9b39-a0cf27ad1641/"
+INDEX_REFRESH_INTERVAL = 600   # secondi tra due aggiornamenti incrementali dell'indice
 
-FBI_ARGS = ["-a", "-T", "1", "-d", "/dev/fb1"]
+DISPLAY_MODE = display_mode()   # geometria e pixel del display configurato (SCREEN_DISPLAY, sysfs)
+FB_WIDTH, FB_HEIGHT = DISPLAY_MODE.width, DISPLAY_MODE.height
 
 DELAY_BETWEEN_ASSETS = 120
 
-ROTATED_IMAGE_PATH = os.path.join(tempfile.gettempdir(), "rotated_asset.png")
+# 'fit': foto intera su sfondo nero (come 'fbi -a'); 'crop': riempie lo schermo tagliando i bordi
+FIT_MODE = 'fit'
+
+# Ordine delle foto (vedi playlist.py): 'cartelle' alterna le directory,
+# 'casuale' è una permutazione senza ripetizioni, 'data' favorisce le più recenti
+PLAYLIST_MODE = 'cartelle'
+
+PREFETCH_FRAMES = 3   # frame pronti in anticipo (memoria: ~300 KB ciascuno a 480x320, 16 bpp)
+FRAME_POLL_INTERVAL = 0.2   # secondi tra due controlli della coda quando il frame successivo non è pronto
+
+# Cache su disco dei frame già pronti (vedi rendercache.py): le foto già viste
+# non vengono più decodificate. Le impostazioni entrano nella chiave, quindi
+# cambiando FIT_MODE o risoluzione i vecchi frame vengono semplicemente ignorati.
+FRAME_CACHE_BUDGET = 1 << 30   # byte (1 GiB = ~3400 foto)
+FRAME_SIZE = DISPLAY_MODE.frame_size
+RENDER_SETTINGS = f"{FB_WIDTH}x{FB_HEIGHT}:{FIT_MODE}:{DISPLAY_MODE.pix_fmt}:rot180"
+WARM_CACHE_FLAG = '--prepara-cache'
 
 PHOTO_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.tiff', '.heic']
 
 # --- LOGICA DELLO SCRIPT ---
-def find_subdirectories_with_media(root_dir):
-    all_media_lists = {}
-    
-    for subdir_name in os.listdir(root_dir):
-        subdir_path = os.path.join(root_dir, subdir_name)
-        
-        if not os.path.isdir(subdir_path):
-            continue
-            
-        photo_files = []
-        for filename in os.listdir(subdir_path):
-            filepath = os.path.join(subdir_path, filename)
-            
-            if not os.path.isfile(filepath):
+def open_media_index(root_dir):
+    """
+    Apre l'indice persistente delle foto. Solo al primo avvio (indice vuoto)
+    lo costruisce subito; altrimenti si parte da quello salvato e le novità
+    arrivano con refresh() in background.
+    """
+    index = MediaIndex(root_dir, extensions=PHOTO_EXTENSIONS)
+    if not len(index):
+        print(f"Costruzione dell'indice delle foto di {root_dir} (solo al primo avvio)...", file=sys.stderr)
+        index.refresh()
+    return index
+
+def refresh_periodically(index, interval=INDEX_REFRESH_INTERVAL):
+    while True:
+        try:
+            with metrics.span('immich', 'index_refresh'):
+                index.refresh()
+        except Exception as e:
+            print(f"ERRORE durante l'aggiornamento dell'indice: {e}", file=sys.stderr)
+        time.sleep(interval)
+
+
+def render_photo(file_path, mode=FIT_MODE):
+    """
+    Decodifica la foto già ridotta e la adatta a FB_WIDTH x FB_HEIGHT secondo
+    'mode' ('fit' o 'crop'). Il frame non è ruotato: la rotazione di 180° per
+    il pannello avviene gratis nella conversione RGB565 (show_image).
+    """
+    side = max(FB_WIDTH, FB_HEIGHT)
+    with Image.open(file_path) as image:
+        # JPEG: il decoder scala direttamente a 1/2, 1/4 o 1/8 restando >= side
+        # su entrambi i lati, così basta anche per le foto in verticale
+        image.draft('RGB', (side, side))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    w, h = image.size
+    if mode == 'crop':
+        scale = max(FB_WIDTH / w, FB_HEIGHT / h)
+        crop_w, crop_h = FB_WIDTH / scale, FB_HEIGHT / scale
+        box = ((w - crop_w) / 2, (h - crop_h) / 2, (w + crop_w) / 2, (h + crop_h) / 2)
+        return image.resize((FB_WIDTH, FB_HEIGHT), Image.BICUBIC, box=box, reducing_gap=2.0)
+
+    scale = min(FB_WIDTH / w, FB_HEIGHT / h)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    fitted = image.resize(size, Image.BICUBIC, reducing_gap=2.0)
+    frame = Image.new('RGB', (FB_WIDTH, FB_HEIGHT))
+    frame.paste(fitted, ((FB_WIDTH - size[0]) // 2, (FB_HEIGHT - size[1]) // 2))
+    return frame
+
+
+def open_frame_cache(budget=FRAME_CACHE_BUDGET):
+    """Apre la cache dei frame; se la directory non è scrivibile si va avanti senza."""
+    try:
+        return RenderCache(budget=budget, frame_size=FRAME_SIZE)
+    except OSError as e:
+        print(f"Cache dei frame non disponibile: {e}", file=sys.stderr)
+        return None
+
+def render_frame(file_path):
+    """Decodifica e adattamento della foto, poi conversione nel formato del pannello (già ruotata)."""
+    with metrics.span('immich', 'render'):
+        image = render_photo(file_path)
+    with metrics.span('immich', 'convert'):
+        return DISPLAY_MODE.encode(image, rotate_180=True)
+
+def prepare_frame(file_path, cache=None):
+    """
+    Frame nel formato del pannello, già ruotato e pronto per blit. Con
+    'cache' una foto già vista è solo un mmap del file in cache; le altre
+    vengono renderizzate e salvate.
+    """
+    if cache is None:
+        return render_frame(file_path)
+    key = cache.key(file_path, RENDER_SETTINGS)
+    with metrics.span('immich', 'cache_read'):
+        frame = cache.get(key)
+    if frame is None:
+        frame = render_frame(file_path)
+        try:
+            cache.put(key, frame)
+        except OSError as e:
+            print(f"Impossibile salvare in cache il frame di {file_path}: {e}", file=sys.stderr)
+    return frame
+
+
+class FramePrefetcher:
+    """
+    Prepara in un thread i frame delle prossime foto di 'media' (Playlist
+    o altro iteratore di (file, directory)): decodifica, adattamento e
+    conversione nel formato del pannello già ruotata, oppure lettura dalla
+    RenderCache 'cache' se la foto è già stata vista. I frame pronti stanno
+    in una coda di al massimo 'size' elementi, così la memoria resta
+    limitata e ogni cambio foto è una copia. Le foto che non si riescono ad
+    aprire vengono saltate. Ogni frame porta con sé il 'last_position' della
+    Playlist, da passare a mark_shown() quando viene mostrato.
+    """
+
+    def __init__(self, media, size=PREFETCH_FRAMES, cache=None):
+        self._media = media
+        self._cache = cache
+        self._queue = queue.Queue(maxsize=size)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def get(self):
+        """Prossimo (file, directory, frame, posizione) pronto; attende se la coda è vuota. None dopo stop()."""
+        while not self._stop.is_set():
+            try:
+                return self._queue.get(timeout=0.5)
+            except queue.Empty:
                 continue
+        return None
 
-            ext = os.path.splitext(filename)[1].lower()
-            
-            if ext in PHOTO_EXTENSIONS:
-                photo_files.append((filepath, "photo", subdir_name))
-        
-        if photo_files:
-            photo_files.sort(key=lambda x: x[0])
-            all_media_lists[subdir_name] = photo_files
-            
-    return all_media_lists
+    def get_nowait(self):
+        """Prossimo (file, directory, frame, posizione) se è già pronto, altrimenti None."""
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
 
+    def stop(self):
+        self._stop.set()
 
-def run_viewer(file_path, directory_name):
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                file_path, subdir_name = next(self._media)
+                position = getattr(self._media, 'last_position', None)
+            except StopIteration:
+                # Playlist vuota (tutte le foto rimosse): si aspetta il prossimo aggiornamento
+                self._stop.wait(5)
+                continue
+            try:
+                frame = prepare_frame(file_path, self._cache)
+            except Exception as e:
+                print(f"ERRORE durante la decodifica di {file_path}: {e}", file=sys.stderr)
+                continue
+            while not self._stop.is_set():
+                try:
+                    self._queue.put((file_path, subdir_name, frame, position), timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+
+def run_viewer(file_path, directory_name, frame, playlist=None, position=None):
     print(f"\n--- Visualizzazione FOTO da [{directory_name}]: {os.path.basename(file_path)} ---", file=sys.stderr)
-    
-    final_path = file_path
-    
-    # --- GESTIONE ROTAZIONE IMMAGINI (PIL, salva su percorso fisso) ---
-    try:
-        image = Image.open(file_path)
-        rotated_image = image.rotate(180) 
-        rotated_image.save(ROTATED_IMAGE_PATH)
-        
-        final_path = ROTATED_IMAGE_PATH 
-        print(f"File ruotato salvato in: {ROTATED_IMAGE_PATH}", file=sys.stderr)
 
-    except Exception as e:
-        print(f"ERRORE PIL/Rotazione Immagine. Visualizzazione dell'originale. Errore: {e}", file=sys.stderr)
-        final_path = file_path
-            
-    full_command = [FBI_COMMAND] + FBI_ARGS + [final_path]
-    print(f"Esecuzione: {' '.join(full_command)}", file=sys.stderr)
-    
+    # --- Il frame è già decodificato, adattato e ruotato: basta copiarlo ---
     try:
-        subprocess.run(full_command)
-        
-    except FileNotFoundError:
-        print(f"ERRORE: Comando '{FBI_COMMAND}' non trovato. Assicurati che fbi sia installato.", file=sys.stderr)
+        fb = get_framebuffer()
+        with metrics.span('immich', 'blit'):
+            fb.blit(frame)
+        if playlist is not None:
+            playlist.mark_shown(position)
+
     except Exception as e:
-        print(f"ERRORE durante l'esecuzione del visualizzatore fbi: {e}", file=sys.stderr)
+        print(f"ERRORE durante la visualizzazione di {file_path}: {e}", file=sys.stderr)
+
+    print(f"\nIn pausa per {DELAY_BETWEEN_ASSETS} secondi...", file=sys.stderr)
 
-    print(f"\nPremi 'q' in fbi per passare al prossimo asset. In pausa per {DELAY_BETWEEN_ASSETS} secondi...", file=sys.stderr)
-         
     time.sleep(DELAY_BETWEEN_ASSETS)
 
 
 def main():
+    metrics.start_exporter('immich')
     if not os.path.isdir(ROOT_SCAN_DIRECTORY):
         print(f"ERRORE: La directory radice non esiste: {ROOT_SCAN_DIRECTORY}", file=sys.stderr)
         print("Aggiorna la variabile ROOT_SCAN_DIRECTORY con un percorso valido.", file=sys.stderr)
         return
 
-    directory_media_map = find_subdirectories_with_media(ROOT_SCAN_DIRECTORY)
+    index = open_media_index(ROOT_SCAN_DIRECTORY)
+    generation = index.generation
+    playlist = Playlist(index, PLAYLIST_MODE)
     
-    if not directory_media_map:
-        print(f"Nessuna sottodirectory con foto trovate in: {ROOT_SCAN_DIRECTORY}", file=sys.stderr)
+    if not len(playlist):
+        print(f"Nessuna foto trovata in: {ROOT_SCAN_DIRECTORY}", file=sys.stderr)
         return
 
-    print(f"Trovate {len(directory_media_map)} sottodirectory con foto. Inizio visualizzazione a rotazione infinita...", file=sys.stderr)
+    print(f"{len(playlist)} foto in playlist (modalità '{playlist.mode}'). Inizio visualizzazione a rotazione infinita...", file=sys.stderr)
 
-    cyclic_iterators = {
-        dir_name: itertools.cycle(media_list) 
-        for dir_name, media_list in directory_media_map.items()
-    }
+    prefetcher = FramePrefetcher(playlist, cache=open_frame_cache())
+    prefetcher.start()
+    threading.Thread(target=refresh_periodically, args=(index,), daemon=True).start()
 
-    directory_cycler = itertools.cycle(cyclic_iterators.keys())
-    
     while True:
-        current_dir_name = next(directory_cycler)
-        current_iterator = cyclic_iterators[current_dir_name]
-        
         try:
-            file_path, _, subdir_name = next(current_iterator) 
-            
-            run_viewer(file_path, subdir_name)
-                
+            if index.generation != generation:
+                # Nuove foto (o foto rimosse): la playlist si aggiorna mantenendo la posizione
+                generation = index.generation
+                playlist.rebuild()
+
+            file_path, subdir_name, frame, position = prefetcher.get()
+
+            run_viewer(file_path, subdir_name, frame, playlist, position)
+
         except Exception as e:
             print(f"ERRORE critico durante il ciclo: {e}. Riavvio del ciclo di rotazione.", file=sys.stderr)
             time.sleep(5)
 
 
+# --- Preparazione della cache in batch (python3 immich.py --prepara-cache) ---
+_worker_cache = None
+
+def _init_warm_worker():
+    global _worker_cache
+    os.nice(19)
+    # Budget illimitato nei worker: l'eventuale pulizia la fa il processo principale alla fine
+    _worker_cache = RenderCache(budget=float('inf'), frame_size=FRAME_SIZE)
+
+def _warm_one(file_path):
+    """True se il frame è stato renderizzato, False se era già in cache, None in caso di errore."""
+    try:
+        key = _worker_cache.key(file_path, RENDER_SETTINGS)
+        if _worker_cache.get(key) is not None:
+            return False
+        _worker_cache.put(key, render_frame(file_path))
+        return True
+    except Exception as e:
+        print(f"ERRORE durante la preparazione di {file_path}: {e}", file=sys.stderr)
+        return None
+
+def warm_cache(root_dir=ROOT_SCAN_DIRECTORY, budget=FRAME_CACHE_BUDGET, workers=None):
+    """
+    Riempie la cache dei frame con un processo per core a priorità minima
+    (nice 19), a partire dalla posizione salvata della playlist e fino a
+    stare nel budget.
+    """
+    index = open_media_index(root_dir)
+    playlist = Playlist(index, PLAYLIST_MODE, persist=False)
+    total = len(playlist)
+    count = min(total, int(budget * EVICT_TO) // FRAME_SIZE)
+    workers = workers or os.cpu_count()
+    print(f"Preparazione di {count} frame su {total} foto con {workers} processi...", file=sys.stderr)
+
+    paths = (file_path for file_path, _ in itertools.islice(playlist, count))
+    results = {True: 0, False: 0, None: 0}
+    start = time.monotonic()
+    with multiprocessing.Pool(workers, initializer=_init_warm_worker) as pool:
+        for done, result in enumerate(pool.imap_unordered(_warm_one, paths, chunksize=4), 1):
+            results[result] += 1
+            if done % 100 == 0:
+                print(f"  {done}/{count} ({done / (time.monotonic() - start):.1f} foto/s)", file=sys.stderr)
+    index.close()
+
+    cache = RenderCache(budget=budget, frame_size=FRAME_SIZE)
+    if cache.size() > budget:
+        cache.evict()
+    print(f"Cache pronta in {time.monotonic() - start:.0f} s: {results[True]} nuovi frame, "
+          f"{results[False]} già presenti, {results[None]} errori, "
+          f"{cache.size() / (1 << 20):.0f} MB su disco.", file=sys.stderr)
+
+
+class ImmichApp(App):
+    """
+    Slideshow ospitato dal manager: indice e FramePrefetcher lavorano in
+    background, il cambio foto e l'aggiornamento dell'indice sono timer del
+    loop. Da sospesa l'app si limita a tenere pronti i frame in coda; alla
+    ripresa rimostra la foto corrente e riparte dal tempo rimasto.
+    """
+
+    name = 'immich'
+
+    def __init__(self, root=ROOT_SCAN_DIRECTORY, delay=DELAY_BETWEEN_ASSETS):
+        super().__init__()
+        self.root = root
+        self.delay = delay
+        self._index = None
+        self._playlist = None
+        self._cache = None
+        self._prefetcher = None
+        self._refresher = None
+        self._frame = None
+        self._timer = None
+        self._due = None
+        self._job = None
+        self._active = False
+
+    def start(self):
+        self._active = True
+        self.display.clear()
+        if not os.path.isdir(self.root):
+            print(f"ERRORE: La directory radice non esiste: {self.root}", file=sys.stderr)
+            return
+        self._job = self.loop.run_in_background(self._load_index, on_done=self._on_scan)
+
+    def _load_index(self):
+        self._index = open_media_index(self.root)
+        self._cache = open_frame_cache()
+        self._playlist = Playlist(self._index, PLAYLIST_MODE)
+        return len(self._playlist)
+
+    def _on_scan(self, future):
+        self._job = None
+        try:
+            count = future.result()
+        except Exception as e:
+            print(f"ERRORE durante la scansione di {self.root}: {e}", file=sys.stderr)
+            return
+        if not count:
+            print(f"Nessuna foto trovata in: {self.root}", file=sys.stderr)
+            return
+        print(f"{count} foto in playlist (modalità '{self._playlist.mode}').", file=sys.stderr)
+        self._prefetcher = FramePrefetcher(self._playlist, cache=self._cache)
+        self._prefetcher.start()
+        self._next()
+        self._refresh()
+        self._refresher = self.loop.call_every(INDEX_REFRESH_INTERVAL, self._refresh)
+
+    def _refresh(self):
+        if self._active:
+            self.loop.run_in_background(self._reload_if_changed, on_done=self._on_reload)
+
+    def _reload_if_changed(self):
+        generation = self._index.generation
+        with metrics.span('immich', 'index_refresh'):
+            self._index.refresh()
+        if self._index.generation == generation:
+            return None
+        self._playlist.rebuild()
+        return len(self._playlist)
+
+    def _on_reload(self, future):
+        try:
+            count = future.result()
+        except Exception as e:
+            print(f"ERRORE durante l'aggiornamento dell'indice: {e}", file=sys.stderr)
+            return
+        if count is not None:
+            print(f"Indice aggiornato: {count} foto in playlist.", file=sys.stderr)
+
+    def _next(self):
+        self._timer = None
+        self._due = None
+        if not self._active or self._prefetcher is None:
+            return
+        # Niente get() bloccante sul pool del loop: se il frame non è pronto si ricontrolla più tardi
+        ready = self._prefetcher.get_nowait()
+        if ready is None:
+            self._timer = self.loop.call_later(FRAME_POLL_INTERVAL, self._next)
+            return
+        file_path, subdir_name, self._frame, position = ready
+        print(f"\n--- Visualizzazione FOTO da [{subdir_name}]: {os.path.basename(file_path)} ---", file=sys.stderr)
+        with metrics.span('immich', 'blit'):
+            self.display.blit(self._frame)
+        self._playlist.mark_shown(position)
+        self._schedule(self.delay)
+
+    def _schedule(self, delay):
+        self._due = time.monotonic() + delay
+        self._timer = self.loop.call_later(delay, self._next)
+
+    def suspend(self):
+        self._active = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def resume(self):
+        self._active = True
+        if self._frame is not None:
+            self.display.blit(self._frame)
+        else:
+            self.display.clear()
+        if self._job is not None:
+            return
+        if self._due is not None:
+            self._schedule(max(0, self._due - time.monotonic()))
+        else:
+            self._next()
+
+    def stop(self):
+        self.suspend()
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+
 if __name__ == "__main__":
-    print("ATTENZIONE: Questo script chiama fbi e deve essere eseguito sulla console TTY.", file=sys.stderr)
     print("ATTENZIONE: Per la rotazione delle foto è richiesta la libreria PIL/Pillow. Installala con: 'pip install Pillow'.", file=sys.stderr)
     print("Potrebbe richiedere 'sudo' se non si dispone dei permessi per i dispositivi framebuffer.", file=sys.stderr)
-    main()
\ No newline at end of file
+    if WARM_CACHE_FLAG in sys.argv[1:]:
+        warm_cache()
+    else:
+        main()
\ No newline at end of file
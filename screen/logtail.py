@@ -0,0 +1,199 @@
+import subprocess
+import threading
+import time
+from collections import deque
+
+from docker_api import DockerError, DockerLogSource, get_client
+
+# --- Costanti di configurazione ---
+DEFAULT_LINES = 20
+UPDATE_INTERVAL = 0.5   # secondi minimi tra due notifiche di aggiornamento
+RESTART_BACKOFF = 10    # secondi di attesa prima di riaprire una sorgente fallita o terminata
+
+
+def journal_command(service_name, lines, follow=False):
+    if not service_name.endswith('.service'):
+        service_name += '.service'
+    command = ['journalctl', '-u', service_name, '-n', str(lines), '--no-pager']
+    if follow:
+        command.append('-f')
+    return command
+
+
+def get_docker_logs(container_name, lines=DEFAULT_LINES):
+    try:
+        logs = get_client().logs(container_name, tail=lines)
+        if logs:
+            return logs
+        else:
+            return ["(Nessun log Docker trovato)"]
+    except DockerError as e:
+        return [f"Errore Docker: {str(e)[:60]}..."]
+    except FileNotFoundError:
+        return ["Errore: Socket Docker non trovato."]
+    except Exception as e:
+        return [f"Eccezione Docker: {str(e)}"]
+
+def get_logs(service_name, lines=DEFAULT_LINES):
+    try:
+        if not service_name.endswith('.service'):
+            service_name += '.service'
+
+        command = journal_command(service_name, lines)
+
+        result = subprocess.run(command,
+                              capture_output=True, text=True, timeout=5)
+
+        if result.returncode == 0:
+            if result.stdout.strip():
+                return result.stdout.strip().split('\n')
+            else:
+                return [f"(Nessun log journal per {service_name})"]
+        else:
+            err = result.stderr.strip().split('\n')[-1]
+            if not err:
+                 err = result.stdout.strip().split('\n')[-1]
+            return [f"Errore Journal: {err[:60]}..."]
+    except FileNotFoundError:
+        return ["Errore: Comando 'journalctl' non trovato."]
+    except Exception as e:
+        return [f"Eccezione Journal: {str(e)}"]
+
+
+class CommandSource:
+    """
+    Sorgente per LogStream: righe dallo stdout di un comando (es. journalctl
+    -f). Lo stderr del comando va sullo stderr del processo, non nei log.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self._proc = None
+
+    def open(self):
+        self._proc = subprocess.Popen(self.command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                      text=True, errors='replace')
+        return self
+
+    def __iter__(self):
+        # close() può azzerare self._proc dal thread della UI mentre questo legge
+        proc = self._proc
+        try:
+            for line in proc.stdout:
+                yield line.rstrip('\n')
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+    def close(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            self._proc.wait()
+        self._proc = None
+
+
+class LogStream:
+    """
+    Segue una sorgente di log in modalità follow (journalctl -f, log Docker)
+    tenendo solo le ultime 'lines' righe in un ring buffer di dimensione fissa.
+
+    'source' è un oggetto con open() (che restituisce un iterabile di righe)
+    e close(). 'on_update' viene chiamata dal thread di lettura quando
+    arrivano righe nuove, al massimo una volta ogni UPDATE_INTERVAL secondi.
+    La sorgente si apre nel thread di lettura, così start() non blocca mai
+    il chiamante (il loop della UI). Se non si apre o termina, start() la
+    riapre solo dopo RESTART_BACKOFF secondi; l'errore resta in
+    'last_error', fuori dal buffer.
+    """
+
+    def __init__(self, source, lines=DEFAULT_LINES, on_update=None):
+        self.source = source
+        self.on_update = on_update
+        self._lines = deque(maxlen=lines)
+        self._lock = threading.Lock()
+        self._running = False
+        self._stopped = False
+        self._thread = None
+        self._timer = None
+        self._retry_at = 0
+        self.last_error = None
+
+    def start(self):
+        if self._running or self._stopped or time.monotonic() < self._retry_at:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    def is_running(self):
+        return self._running
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._lines)
+
+    def stop(self):
+        self._stopped = True
+        if self._timer:
+            self._timer.cancel()
+        self.source.close()
+
+    def _append(self, line):
+        with self._lock:
+            self._lines.append(line)
+
+    def _open(self):
+        try:
+            reader = self.source.open()
+        except FileNotFoundError as e:
+            self.last_error = f"Errore: '{e.filename}' non trovato."
+        except Exception as e:
+            self.last_error = f"Eccezione log: {str(e)}"
+        else:
+            if self._stopped:
+                # stop() è arrivato durante l'apertura: la sorgente appena aperta non si legge
+                self.source.close()
+                return None
+            # La sorgente riparte con le ultime righe: quelle della lettura precedente si scartano
+            with self._lock:
+                self._lines.clear()
+            self.last_error = None
+            return reader
+        # Ridisegno: chi legge il buffer può passare alla lettura singola
+        self._schedule_update()
+        return None
+
+    def _reader(self):
+        try:
+            reader = self._open()
+            if reader is None:
+                return
+            for line in reader:
+                self._append(line)
+                self._schedule_update()
+        finally:
+            self._retry_at = time.monotonic() + RESTART_BACKOFF
+            self._running = False
+
+    def _schedule_update(self):
+        if self.on_update is None:
+            return
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(UPDATE_INTERVAL, self._notify)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _notify(self):
+        with self._lock:
+            self._timer = None
+        self.on_update()
+
+
+def journal_stream(service_name, lines=DEFAULT_LINES, on_update=None):
+    return LogStream(CommandSource(journal_command(service_name, lines, follow=True)), lines, on_update)
+
+def docker_stream(container_name, lines=DEFAULT_LINES, on_update=None):
+    """Log del container via API Docker (connessione dedicata, nessun processo 'docker')."""
+    return LogStream(DockerLogSource(get_client(), container_name, lines), lines, on_update)
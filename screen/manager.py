@@ -1,4 +1,3 @@
-from evdev import InputDevice, ecodes
 import os
 import sys
 import time
@@ -6,177 +5,369 @@ import subprocess
 import signal
 import psutil 
 
+from runtime import get_event_loop
+from touch import open_touchscreen
+from framebuffer import get_framebuffer, display_mode
+from apphost import AppHost
+from zygote import ForkServer
+import metrics
+
 # --- Costanti di configurazione ---
-FB_WIDTH, FB_HEIGHT = 480, 320
+DISPLAY_MODE = display_mode()   # geometria del display configurato (SCREEN_DISPLAY, sysfs)
+FB_WIDTH, FB_HEIGHT = DISPLAY_MODE.width, DISPLAY_MODE.height
 TOUCHSCREEN_DEVICE = '/dev/input/event0'
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APPS = ('immich', 'yt', 'rpi')
+
+# Ogni app gira in un proprio gruppo di processi (insieme a ffmpeg, yt-dlp...),
+# terminato con un solo segnale; i gruppi ancora vivi sono annotati qui per
+# ripulirli al riavvio se il manager si è chiuso male
+APP_GROUPS_FILE = '/run/screen_manager_groups'
+GROUP_STOP_TIMEOUT = 3   # secondi prima di passare a SIGKILL
+
+# Con queste opzioni ogni app gira in un processo separato, rilanciato a ogni
+# cambio (--processi) oppure ottenuto con un fork dal fork server (--zygote)
+SUBPROCESS_FLAG = '--processi'
+FORK_SERVER_FLAG = '--zygote'
+
+# Con il fork server l'app che esce di scena viene fermata (SIGSTOP) e ripresa
+# al ritorno invece di essere terminata e riavviata
+SUSPEND_APPS = True
+STOP_TIMEOUT = 0.2   # secondi di attesa perché un'app sospesa sia davvero ferma
 
 # --- Variabile globale per il processo attivo ---
 current_process = None
 
-def clean_lingering_processes():
-    """
-    Cerca e termina processi binari che potrebbero bloccare il framebuffer.
-    """
-    target_processes = ['fbi', 'ffmpeg', 'yt-dlp', 'omxplayer']
-    for proc in psutil.process_iter(['pid', 'name']):
-        try:
-            if proc.info['name'] in target_processes:
-                print(f"Pulizia preventiva: termino processo orfano {proc.info['name']} (PID: {proc.info['pid']})")
-                proc.terminate()
-                try:
-                    proc.wait(timeout=1)
-                except psutil.TimeoutExpired:
-                    proc.kill()
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
-
-def kill_process_tree(pid):
+# --- App avviate dal fork server: {nome: PID} e ultimo frame di quelle sospese ---
+forked_apps = {}
+suspended_frames = {}
+current_app = None
+
+# --- Gruppi di processi delle app ---
+app_groups = {}
+
+def save_app_groups():
+    try:
+        with open(APP_GROUPS_FILE, 'w') as f:
+            for pgid, created in app_groups.items():
+                f.write(f"{pgid} {created}\n")
+    except OSError as e:
+        print(f"Avviso: impossibile aggiornare {APP_GROUPS_FILE}: {e}")
+
+def track_group(pgid):
+    try:
+        app_groups[pgid] = psutil.Process(pgid).create_time()
+    except psutil.NoSuchProcess:
+        return
+    save_app_groups()
+
+def untrack_group(pgid):
+    if app_groups.pop(pgid, None) is not None:
+        save_app_groups()
+
+def group_alive(pgid, process=None):
+    if process is not None:
+        process.poll()   # raccoglie il leader se è nostro figlio, altrimenti resterebbe zombie nel gruppo
+    try:
+        os.killpg(pgid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+
+def stop_process_group(pgid, process=None, timeout=GROUP_STOP_TIMEOUT):
     """
-    Termina un processo e TUTTI i suoi figli ricorsivamente in modo sicuro.
+    Termina un'app e tutti i suoi figli con un solo segnale al suo gruppo di
+    processi, anche se è sospesa, e attende che il gruppo si svuoti.
     """
     try:
-        parent = psutil.Process(pid)
-    except psutil.NoSuchProcess:
+        os.killpg(pgid, signal.SIGTERM)
+        os.killpg(pgid, signal.SIGCONT)
+    except ProcessLookupError:
+        untrack_group(pgid)
         return
 
-    children = parent.children(recursive=True)
-    
-    for child in children:
-        try:
-            child.terminate()
-        except psutil.NoSuchProcess:
-            pass
-            
+    deadline = time.monotonic() + timeout
+    while group_alive(pgid, process):
+        if time.monotonic() >= deadline:
+            print(f"Forzo kill sul gruppo {pgid}")
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            if process is not None:
+                process.wait()
+            break
+        time.sleep(0.02)
+    untrack_group(pgid)
+
+def clean_lingering_groups():
+    """
+    Termina i gruppi di app rimasti da un'esecuzione precedente del manager.
+    Un gruppo viene toccato solo se il suo leader è ancora lo stesso processo
+    (stesso istante di creazione): nessun altro processo del sistema viene
+    esaminato o terminato.
+    """
     try:
-        parent.terminate()
-    except psutil.NoSuchProcess:
-        pass
+        with open(APP_GROUPS_FILE) as f:
+            entries = [line.split() for line in f if line.strip()]
+    except OSError:
+        return
 
-    gone, alive = psutil.wait_procs(children + [parent], timeout=3)
-    
-    for p in alive:
+    for pgid, created in entries:
+        pgid = int(pgid)
         try:
-            print(f"Forzo kill su {p.pid}")
-            p.kill()
+            if psutil.Process(pgid).create_time() != float(created):
+                continue
         except psutil.NoSuchProcess:
-            pass
+            continue
+        print(f"Pulizia preventiva: termino il gruppo orfano {pgid}")
+        app_groups[pgid] = float(created)
+        stop_process_group(pgid)
+    app_groups.clear()
+    save_app_groups()
 
 def start_app(app_name):
     global current_process
-    
+
     if current_process:
         print(f"Stop app corrente (PID: {current_process.pid})...")
-        kill_process_tree(current_process.pid)
+        stop_process_group(current_process.pid, current_process)
         current_process = None
-        
-    clean_lingering_processes()
-    time.sleep(0.5) 
-
-    command = []
-    if app_name == 'immich':
-        command = ['sudo', 'python3', 'immich.py']
-    elif app_name == 'yt':
-        command = ['sudo', 'python3', 'yt.py']
-    elif app_name == 'rpi':
-        command = ['sudo', 'python3', 'rpi.py']
-    else:
+
+    if app_name not in APPS:
         print(f"App sconosciuta: {app_name}")
         return
 
     print(f"--- Avvio di: {app_name} ---")
     try:
-        current_process = subprocess.Popen(command)
+        current_process = subprocess.Popen([sys.executable, f'{app_name}.py'], cwd=APP_DIR,
+                                           start_new_session=True)
+        track_group(current_process.pid)
     except Exception as e:
         print(f"ERRORE critico avvio {app_name}: {e}")
 
+def wait_stopped(pid, timeout=STOP_TIMEOUT):
+    """Attende che il processo abbia ricevuto SIGSTOP (il segnale è asincrono)."""
+    deadline = time.monotonic() + timeout
+    try:
+        process = psutil.Process(pid)
+        while process.status() != psutil.STATUS_STOPPED and time.monotonic() < deadline:
+            time.sleep(0.005)
+    except psutil.NoSuchProcess:
+        pass
+
+def switch_forked_app(server, app_name):
+    """
+    Cambio app con il fork server: l'app corrente viene sospesa (salvandone
+    l'ultimo frame) o terminata, quella richiesta ripresa se è ancora viva,
+    altrimenti avviata con un fork.
+    """
+    global current_app
+    start = time.monotonic()
+    fb = get_framebuffer()
+
+    if current_app:
+        pid = forked_apps[current_app]
+        if SUSPEND_APPS:
+            print(f"Sospendo {current_app} (PID: {pid})...")
+            try:
+                os.killpg(pid, signal.SIGSTOP)
+                wait_stopped(pid)
+                suspended_frames[current_app] = fb.copy_frame()
+            except ProcessLookupError:
+                del forked_apps[current_app]
+                untrack_group(pid)
+        else:
+            print(f"Stop app corrente (PID: {pid})...")
+            stop_process_group(forked_apps.pop(current_app))
+        current_app = None
+
+    pid = forked_apps.get(app_name)
+    frame = suspended_frames.pop(app_name, None)
+    if pid is not None and frame is not None and psutil.pid_exists(pid):
+        fb.blit(frame)
+        os.killpg(pid, signal.SIGCONT)
+        print(f"--- Ripresa di {app_name} (PID: {pid}) in {(time.monotonic() - start) * 1000:.0f} ms ---")
+    else:
+        if pid is not None:
+            untrack_group(pid)
+        print(f"--- Avvio di: {app_name} (fork server) ---")
+        pid = forked_apps[app_name] = server.spawn(app_name)
+        track_group(pid)
+    current_app = app_name
+
+def report_first_frames(server):
+    for app_name, ms in server.read_reports():
+        print(f"Primo frame di {app_name} dopo {ms:.0f} ms (fork server)")
+        metrics.observe('manager', 'first_frame', ms / 1000, target=app_name)
+
+def timed_switch(switch_app, mode):
+    """Avvolge 'switch_app' misurando la durata di ogni cambio app."""
+    def switch(app_name):
+        with metrics.span('manager', 'app_switch', target=app_name, mode=mode):
+            return switch_app(app_name)
+    return switch
+
+def subprocess_switcher(loop, start=start_app):
+    """Cambio app a processi separati: lo stop/avvio gira in background, un cambio alla volta."""
+    switch_job = None
+
+    def on_switch_done(future):
+        nonlocal switch_job
+        switch_job = None
+        if future.exception():
+            print(f"ERRORE durante il cambio app: {future.exception()}")
+
+    def switch(app_name):
+        nonlocal switch_job
+        if switch_job is not None:
+            print("Cambio app già in corso, tocco ignorato.")
+            return False
+        # Lo stop/avvio dell'app gira in background: il touch resta reattivo
+        switch_job = loop.run_in_background(start, app_name, on_done=on_switch_done)
+        return True
+
+    return switch
+
 # --- Loop di ascolto ---
-def listen(stato_iniziale=10):
-    global current_process 
-    
+def listen(switch_app, stato_iniziale=10, forward=None):
+    """
+    Ascolta il touchscreen e cambia app con 'switch_app(nome)'; i gesti che
+    non servono a cambiare app vengono passati a 'forward', se presente.
+    """
     stato = stato_iniziale
-    
+
+    center_x = FB_WIDTH // 2
+
+    def on_gesture(gesture):
+        nonlocal stato
+
+        # Swipe verso destra = lato sinistro, swipe verso sinistra = lato destro.
+        # Nelle impostazioni (rpi) i tap servono all'app: lì si cambia solo con lo swipe.
+        if gesture.kind == 'swipe_right':
+            lato = 'sinistra'
+        elif gesture.kind == 'swipe_left':
+            lato = 'destra'
+        elif gesture.kind == 'tap' and stato != 0:
+            if gesture.x < center_x:
+                lato = 'sinistra'
+            elif gesture.x > center_x:
+                lato = 'destra'
+            else:
+                return
+        else:
+            if forward:
+                forward(gesture)
+            return
+
+        print(f"Touch rilevato: Stato {stato} -> {gesture.kind} X:{gesture.x} Y:{gesture.y}")
+
+        nuovo_stato = stato
+        app_da_lanciare = None
+
+        if stato == 0: # RPI SETTINGS
+            if lato == 'sinistra':
+                 nuovo_stato = 10
+                 app_da_lanciare = 'immich'
+
+        elif stato == 10: # IMMICH (HOME)
+            if lato == 'sinistra': # Sinistra -> YouTube
+                 nuovo_stato = 20
+                 app_da_lanciare = 'yt'
+            elif lato == 'destra': # Destra -> Settings
+                 nuovo_stato = 0
+                 app_da_lanciare = 'rpi'
+
+        elif stato == 20: # YOUTUBE
+            if lato == 'destra': # Destra -> Home
+                 nuovo_stato = 10
+                 app_da_lanciare = 'immich'
+
+        if app_da_lanciare:
+            print(f"Cambio stato: {stato} -> {nuovo_stato} ({app_da_lanciare})")
+            if switch_app(app_da_lanciare):
+                stato = nuovo_stato
+
     try:
-        device = InputDevice(TOUCHSCREEN_DEVICE)
+        device, tracker = open_touchscreen(TOUCHSCREEN_DEVICE, FB_WIDTH, FB_HEIGHT, on_gesture)
     except Exception as e:
         print(f"Errore Touchscreen: {e}")
         return
 
     print(f"Manager avviato. In ascolto su {TOUCHSCREEN_DEVICE}...")
 
+    loop = get_event_loop()
+    loop.add_reader(device, tracker.read, device)
     try:
-        abs_x_info = device.absinfo(ecodes.ABS_X)
-        abs_y_info = device.absinfo(ecodes.ABS_Y)
-        max_raw_x = abs_x_info.max
-        max_raw_y = abs_y_info.max
-    except KeyError:
-        max_raw_x = 4095 
-        max_raw_y = 4095
-    
-    center_x = FB_WIDTH // 2
-    count = 0 
-    
-    # --- FIX: Inizializzazione variabili coordinate ---
-    curr_x = 0
-    curr_y = 0
-    # --------------------------------------------------
+        loop.run()
+    except KeyboardInterrupt:
+        print("\nChiusura Manager...")
+    finally:
+        loop.remove_reader(device)
+
+def run_hosted():
+    """
+    Le app girano nel processo del manager: moduli, framebuffer e touch
+    vengono caricati una volta sola e un cambio app è un suspend/resume.
+    """
+    # Import qui: 'rpi' crea loop, poller e cache già all'import, che servono
+    # solo quando le app girano in questo processo (non con --processi o --zygote)
+    from immich import ImmichApp
+    from yt import YouTubeApp
+    from rpi import RpiApp
+
+    loop = get_event_loop()
+    host = AppHost([ImmichApp(), YouTubeApp(), RpiApp()],
+                   get_framebuffer(), loop)
+    host.load()
+
+    clean_lingering_groups()
 
+    host.switch('immich')
     try:
-        for event in device.read_loop():
-            if event.type == ecodes.EV_ABS:
-                if event.code == ecodes.ABS_X:
-                    curr_x = event.value
-                elif event.code == ecodes.ABS_Y:
-                    curr_y = event.value
-            
-            elif event.type == ecodes.EV_KEY and event.code == ecodes.BTN_TOUCH and event.value == 1:
-                count += 1
-                
-                # Calcolo coordinate
-                scaled_x = int(((max_raw_y - curr_y) / max_raw_y) * FB_WIDTH)
-                scaled_y = int((curr_x / max_raw_x) * FB_HEIGHT)
-                
-                if count % 2 == 0:
-                    print(f"Touch rilevato: Stato {stato} -> X:{scaled_x} Y:{scaled_y}")
-
-                    nuovo_stato = stato
-                    app_da_lanciare = None
-
-                    if stato == 0: # RPI SETTINGS
-                        if scaled_x < center_x: 
-                             nuovo_stato = 10
-                             app_da_lanciare = 'immich'
-
-                    elif stato == 10: # IMMICH (HOME)
-                        if scaled_x < center_x: # Sinistra -> YouTube
-                             nuovo_stato = 20
-                             app_da_lanciare = 'yt'
-                        elif scaled_x > center_x: # Destra -> Settings
-                             nuovo_stato = 0
-                             app_da_lanciare = 'rpi'
-
-                    elif stato == 20: # YOUTUBE
-                        if scaled_x > center_x: # Destra -> Home
-                             nuovo_stato = 10
-                             app_da_lanciare = 'immich'
-                    
-                    if app_da_lanciare:
-                        print(f"Cambio stato: {stato} -> {nuovo_stato} ({app_da_lanciare})")
-                        stato = nuovo_stato
-                        start_app(app_da_lanciare)
+        listen(timed_switch(host.switch, 'ospitate'), 10, forward=host.dispatch)
+    finally:
+        host.stop()
 
-    except KeyboardInterrupt:
-        print("\nChiusura Manager...")
+def run_subprocesses():
+    clean_lingering_groups()
+
+    start_app('immich')
+    try:
+        listen(subprocess_switcher(get_event_loop(), timed_switch(start_app, 'processi')), 10)
     finally:
         if current_process:
-             kill_process_tree(current_process.pid)
-        clean_lingering_processes()
+            stop_process_group(current_process.pid, current_process)
+
+def run_forked():
+    """Le app girano in processi separati, ottenuti con un fork dal fork server."""
+    server = ForkServer()
+    server.start()
+
+    loop = get_event_loop()
+    loop.add_reader(server.reports, report_first_frames, server)
+
+    clean_lingering_groups()
+
+    switch_forked_app(server, 'immich')
+    try:
+        listen(subprocess_switcher(loop, timed_switch(lambda app_name: switch_forked_app(server, app_name), 'zygote')), 10)
+    finally:
+        loop.remove_reader(server.reports)
+        for pid in forked_apps.values():
+            stop_process_group(pid)
+        forked_apps.clear()
+        server.close()
 
 if __name__ == "__main__":
     if os.geteuid() != 0:
         print("ERRORE: Questo script deve essere eseguito con sudo.")
         sys.exit(1)
 
-    clean_lingering_processes()
-    
-    start_app('immich') 
-    listen(10)
+    metrics.start_exporter('manager')
+    if FORK_SERVER_FLAG in sys.argv[1:]:
+        run_forked()
+    elif SUBPROCESS_FLAG in sys.argv[1:]:
+        run_subprocesses()
+    else:
+        run_hosted()
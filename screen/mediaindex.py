@@ -0,0 +1,193 @@
+import os
+import sqlite3
+import threading
+from array import array
+from collections import defaultdict
+
+# --- Costanti di configurazione ---
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media_index.sqlite')
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.tiff', '.heic')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    UNIQUE (directory, name)
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+"""
+
+
+class MediaIndex:
+    """
+    Indice persistente (SQLite) delle foto sotto 'root': percorso, mtime e
+    dimensione di ogni file.
+
+    refresh() è incrementale: una directory viene riletta con os.scandir
+    solo se il suo mtime è cambiato (file aggiunti, rimossi o rinominati),
+    le altre costano una sola stat. Una directory sparisce dall'indice solo
+    quando la directory padre, riletta, non la elenca più: se la radice non
+    è raggiungibile (disco smontato) o una directory non si può leggere, il
+    contenuto già indicizzato resta com'è. Le directory sono salvate relative a
+    'root', i file restituiti sono percorsi completi. Ogni foto ha un id
+    intero stabile finché il file resta nell'indice (vedi playlist.py).
+    Si può interrogare da un thread mentre un altro esegue refresh().
+    """
+
+    def __init__(self, root, path=INDEX_FILE, extensions=PHOTO_EXTENSIONS):
+        self.root = os.path.abspath(root)
+        self.extensions = tuple(extensions)
+        self.generation = 0   # cresce a ogni refresh() che cambia il contenuto
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+            if row is None or row[0] != self.root:
+                # Indice di un'altra libreria: si riparte da zero
+                self._db.execute('DELETE FROM directories')
+                self._db.execute('DELETE FROM media')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (self.root,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+
+    def grouped_ids(self):
+        """
+        Id di tutte le foto ordinati per directory e nome, più l'indice del
+        primo id di ogni directory (con in fondo il totale): due array('I')
+        da 4 byte per elemento, senza percorsi in memoria.
+        """
+        ids = array('I')
+        starts = array('I')
+        previous = None
+        with self._lock:
+            for media_id, directory in self._db.execute('SELECT id, directory FROM media ORDER BY directory, name'):
+                if directory != previous:
+                    starts.append(len(ids))
+                    previous = directory
+                ids.append(media_id)
+        starts.append(len(ids))
+        return ids, starts
+
+    def dated_ids(self):
+        """Id e mtime (secondi) di tutte le foto: array('I') e array('d') paralleli."""
+        ids = array('I')
+        mtimes = array('d')
+        with self._lock:
+            for media_id, mtime_ns in self._db.execute('SELECT id, mtime_ns FROM media ORDER BY id'):
+                ids.append(media_id)
+                mtimes.append(mtime_ns / 1e9)
+        return ids, mtimes
+
+    def lookup(self, media_id):
+        """(percorso completo, directory relativa) della foto, o None se non è più nell'indice."""
+        with self._lock:
+            row = self._db.execute('SELECT directory, name FROM media WHERE id = ?', (media_id,)).fetchone()
+        if row is None:
+            return None
+        directory, name = row
+        return os.path.join(self.root, directory, name), directory
+
+    def refresh(self):
+        """Aggiorna l'indice dal disco; restituisce il numero di directory rilette."""
+        with self._lock:
+            known = dict(self._db.execute('SELECT path, mtime_ns FROM directories'))
+            children = defaultdict(list)
+            for path, parent in self._db.execute('SELECT path, parent FROM directories'):
+                children[parent].append(path)
+
+        try:
+            os.stat(self.root)
+        except OSError as e:
+            print(f"Indice media: radice {self.root} non raggiungibile ({e}), indice invariato")
+            return 0
+
+        seen = set()
+        rescanned = 0
+        stack = ['']
+        while stack:
+            relative = stack.pop()
+            try:
+                mtime_ns = os.stat(os.path.join(self.root, relative)).st_mtime_ns
+            except OSError:
+                # Elencata dal padre ma non raggiungibile: si tiene quanto già indicizzato
+                self._keep_subtree(relative, children, seen)
+                continue
+            seen.add(relative)
+            if known.get(relative) == mtime_ns:
+                stack.extend(children[relative])
+                continue
+            subdirectories = self._scan_directory(relative, mtime_ns)
+            if subdirectories is None:
+                self._keep_subtree(relative, children, seen)
+                continue
+            rescanned += 1
+            stack.extend(subdirectories)
+
+        removed = [path for path in known if path not in seen]
+        if removed:
+            with self._lock, self._db:
+                self._db.executemany('DELETE FROM directories WHERE path = ?', ((p,) for p in removed))
+                self._db.executemany('DELETE FROM media WHERE directory = ?', ((p,) for p in removed))
+
+        if rescanned or removed:
+            self.generation += 1
+        return rescanned
+
+    @staticmethod
+    def _keep_subtree(relative, children, seen):
+        """Segna come viste 'relative' e tutte le sue sottodirectory note."""
+        stack = [relative]
+        while stack:
+            path = stack.pop()
+            seen.add(path)
+            stack.extend(children[path])
+
+    def _scan_directory(self, relative, mtime_ns):
+        """Rilegge una directory: aggiorna le sue foto e restituisce le sottodirectory."""
+        subdirectories = []
+        files = []
+        try:
+            with os.scandir(os.path.join(self.root, relative)) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(os.path.join(relative, entry.name))
+                    elif entry.is_file() and entry.name.lower().endswith(self.extensions):
+                        st = entry.stat()
+                        files.append((relative, entry.name, st.st_mtime_ns, st.st_size))
+        except OSError as e:
+            print(f"Indice media: impossibile leggere {relative or self.root}: {e}")
+            return None
+
+        parent = os.path.dirname(relative) if relative else None
+        names = {name for _, name, _, _ in files}
+        with self._lock, self._db:
+            existing = [name for (name,) in
+                        self._db.execute('SELECT name FROM media WHERE directory = ?', (relative,))]
+            self._db.executemany('DELETE FROM media WHERE directory = ? AND name = ?',
+                                 ((relative, name) for name in existing if name not in names))
+            self._db.executemany('INSERT INTO media (directory, name, mtime_ns, size) VALUES (?, ?, ?, ?) '
+                                 'ON CONFLICT (directory, name) DO UPDATE SET '
+                                 'mtime_ns = excluded.mtime_ns, size = excluded.size', files)
+            self._db.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?)',
+                             (relative, parent, mtime_ns))
+        return subdirectories
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,195 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Costanti di configurazione ---
+# SCREEN_METRICS='file' scrive le metriche per il textfile collector di
+# node_exporter, 'http' le serve su 127.0.0.1; vuoto (default) = disattivate:
+# span() restituisce un oggetto vuoto condiviso e observe() torna subito.
+METRICS_MODE = os.environ.get('SCREEN_METRICS', '')
+METRICS_DIR = os.environ.get('SCREEN_METRICS_DIR', '/var/lib/node_exporter/textfile_collector')
+METRICS_PORT = int(os.environ.get('SCREEN_METRICS_PORT', '9110'))
+EXPORT_INTERVAL = 15   # secondi tra due scritture del file
+ENABLED = METRICS_MODE in ('file', 'http')
+
+METRIC_NAME = 'screen_stage_seconds'
+# Limiti superiori dei bucket (secondi): da mezzo millisecondo (blit, conversioni)
+# a dieci secondi (yt-dlp, aggiornamento dell'indice)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Durate di una fase: conteggi per bucket, somma e numero di osservazioni."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # l'ultimo è +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class _Span:
+    __slots__ = ('_key', '_start')
+
+    def __init__(self, key):
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _observe(self._key, time.perf_counter() - self._start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+# --- Istogrammi del processo: {(app, fase, etichette): Histogram} ---
+_histograms = {}
+_lock = threading.Lock()
+_exporter = None
+
+
+def _key(app, stage, labels):
+    return (app, stage, tuple(sorted(labels.items())) if labels else ())
+
+
+def _observe(key, seconds):
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def span(app, stage, **labels):
+    """
+    Misura la durata del blocco 'with' come fase 'stage' dell'app 'app':
+
+        with metrics.span('rpi', 'screen', screen='servizi'):
+            servizi()
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(_key(app, stage, labels))
+
+
+def observe(app, stage, seconds, **labels):
+    """Registra una durata già misurata (es. la scrittura di un frame video)."""
+    if ENABLED:
+        _observe(_key(app, stage, labels), seconds)
+
+
+def render():
+    """Tutti gli istogrammi nel formato testuale di Prometheus."""
+    with _lock:
+        snapshot = [(key, list(h.counts), h.total, h.count) for key, h in sorted(_histograms.items())]
+    lines = [f"# HELP {METRIC_NAME} Durata delle fasi delle app dello schermo.",
+             f"# TYPE {METRIC_NAME} histogram"]
+    for (app, stage, labels), counts, total, count in snapshot:
+        label_text = ','.join([f'app="{app}"', f'stage="{stage}"'] +
+                              [f'{name}="{_escape(value)}"' for name, value in labels])
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += bucket_count
+            lines.append(f'{METRIC_NAME}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_NAME}_sum{{{label_text}}} {total:.6f}')
+        lines.append(f'{METRIC_NAME}_count{{{label_text}}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# --- Esportazione ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def write_textfile(path):
+    """Scrive le metriche in 'path' in modo atomico (il collector non legge mai un file a metà)."""
+    temp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp, 'w') as f:
+            f.write(render())
+        os.replace(temp, path)
+    except OSError as e:
+        print(f"Impossibile scrivere le metriche in {path}: {e}", file=sys.stderr)
+
+
+def start_exporter(process_name):
+    """
+    Avvia l'esportazione configurata (una sola volta per processo). Con
+    'file' ogni processo scrive il proprio screen_<process_name>.prom ogni
+    EXPORT_INTERVAL secondi e all'uscita; con 'http' il primo processo che
+    occupa la porta serve /metrics.
+    """
+    global _exporter
+    if not ENABLED or _exporter is not None:
+        return
+    if METRICS_MODE == 'file':
+        path = os.path.join(METRICS_DIR, f"screen_{process_name}.prom")
+
+        def export_periodically():
+            while True:
+                time.sleep(EXPORT_INTERVAL)
+                write_textfile(path)
+
+        _exporter = threading.Thread(target=export_periodically, name='metrics', daemon=True)
+        _exporter.start()
+        atexit.register(write_textfile, path)
+        print(f"Metriche in {path} ogni {EXPORT_INTERVAL} s")
+    else:
+        try:
+            server = ThreadingHTTPServer(('127.0.0.1', METRICS_PORT), _MetricsHandler)
+        except OSError as e:
+            print(f"Metriche HTTP non disponibili sulla porta {METRICS_PORT}: {e}", file=sys.stderr)
+            return
+        server.daemon_threads = True
+        _exporter = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+        _exporter.start()
+        print(f"Metriche su http://127.0.0.1:{METRICS_PORT}/metrics")
+
+
+def _after_fork():
+    # Il figlio del fork server riparte da zero: niente misure del manager
+    # ripetute con un altro nome, e l'esportatore (thread) non sopravvive al fork
+    global _exporter, _lock
+    _histograms.clear()
+    _lock = threading.Lock()
+    _exporter = None
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from array import array
+
+import numpy as np
+
+# --- Costanti di configurazione ---
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'playlist_state.json')
+MODES = ('cartelle', 'casuale', 'data')
+HALF_LIFE_DAYS = 365   # modalità 'data': il peso di una foto si dimezza ogni anno di età...
+MIN_WEIGHT = 0.05      # ...ma anche le più vecchie continuano a uscire
+
+
+class Playlist:
+    """
+    Ordine di visualizzazione delle foto di un MediaIndex, infinito:
+    next() restituisce (percorso, directory).
+
+    In memoria ci sono solo gli id delle foto in array('I') (4 byte per
+    foto, più 8 per directory in 'cartelle'); il percorso si chiede
+    all'indice una foto alla volta. Modalità:
+      - 'cartelle': alterna le directory e dentro ognuna le foto in ordine;
+      - 'casuale': permutazione con seme, ogni foto una volta per giro;
+      - 'data': come 'casuale', ma le foto recenti tendono a uscire prima
+        (peso dimezzato ogni HALF_LIFE_DAYS, mai sotto MIN_WEIGHT).
+    Dopo ogni next() 'last_position' descrive la posizione raggiunta; chi
+    mostra la foto la passa a mark_shown(), che la salva in 'state_file'
+    (le foto preparate in anticipo ma mai mostrate non contano). Al riavvio
+    si riprende da lì; rebuild() rilegge l'indice dopo un refresh()
+    mantenendo la posizione.
+    """
+
+    def __init__(self, index, mode='cartelle', seed=None, state_file=STATE_FILE, persist=True):
+        if mode not in MODES:
+            raise ValueError(f"Modalità playlist sconosciuta: {mode} (valide: {', '.join(MODES)})")
+        self.index = index
+        self.mode = mode
+        self.state_file = state_file
+        self.persist = persist and state_file is not None
+        self._lock = threading.Lock()
+        self._order = array('I')    # 'cartelle': id raggruppati per directory; altrimenti la permutazione
+        self._starts = array('I')   # 'cartelle': inizio di ogni directory in _order (più il totale)
+        self._cursors = array('I')  # 'cartelle': prossima foto di ogni directory
+        self._turn = 0              # 'cartelle': prossima directory
+        self._position = 0          # 'casuale' e 'data': prossima foto della permutazione
+        self._epoch = 0             # 'casuale' e 'data': giro corrente (entra nel seme)
+        self._last_id = None
+        self.last_position = None
+
+        state = self._load_state()
+        if state.get('mode') != mode or (seed is not None and state.get('seed') != seed):
+            state = {}
+        self._seed = state.get('seed', seed if seed is not None else int.from_bytes(os.urandom(4), 'little'))
+        self._epoch = state.get('epoch', 0)
+        self._turn = state.get('turn', 0)
+        self._last_id = state.get('last_id')
+        self.rebuild(state.get('cursors'))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._order)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            # Le foto sparite dopo l'ultimo rebuild() si saltano
+            for _ in range(len(self._order)):
+                media_id = self._advance()
+                found = self.index.lookup(media_id)
+                if found is not None:
+                    self._last_id = media_id
+                    self.last_position = self._state()
+                    return found
+        raise StopIteration
+
+    def mark_shown(self, position):
+        """Salva 'position' (il last_position di una foto) quando quella foto è sullo schermo."""
+        if not self.persist or position is None:
+            return
+        temp = self.state_file + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(position, f)
+            os.replace(temp, self.state_file)
+        except OSError as e:
+            print(f"Impossibile salvare lo stato della playlist: {e}")
+
+    def rebuild(self, cursors=None):
+        """Rilegge gli id dall'indice; la posizione corrente resta valida dove possibile."""
+        with self._lock:
+            if self.mode == 'cartelle':
+                self._order, starts = self.index.grouped_ids()
+                directories = len(starts) - 1
+                if cursors is None and len(starts) == len(self._starts):
+                    cursors = self._cursors
+                if cursors is None or len(cursors) != directories:
+                    cursors = [0] * directories
+                self._starts = starts
+                self._cursors = array('I', (
+                    cursor % (starts[d + 1] - starts[d]) for d, cursor in enumerate(cursors)
+                ))
+                self._turn = self._turn % directories if directories else 0
+            else:
+                self._order = self._permutation()
+                self._position = self._position_after(self._last_id)
+
+    def _advance(self):
+        if self.mode == 'cartelle':
+            d = self._turn
+            start, end = self._starts[d], self._starts[d + 1]
+            media_id = self._order[start + self._cursors[d]]
+            self._cursors[d] = (self._cursors[d] + 1) % (end - start)
+            self._turn = (d + 1) % (len(self._starts) - 1)
+            return media_id
+
+        if self._position >= len(self._order):
+            self._epoch += 1
+            self._order = self._permutation()
+            self._position = 0
+        media_id = self._order[self._position]
+        self._position += 1
+        return media_id
+
+    def _permutation(self):
+        """Ordine del giro corrente: dipende solo da seme, giro e contenuto dell'indice."""
+        rng = np.random.default_rng([self._seed, self._epoch])
+        if self.mode == 'casuale':
+            ids, _ = self.index.grouped_ids()
+            order = np.frombuffer(ids, dtype=np.uint32).copy()
+            rng.shuffle(order)
+        else:
+            # Campionamento pesato senza ripetizioni: chiave esponenziale / peso, in ordine crescente
+            ids, mtimes = self.index.dated_ids()
+            age_days = np.maximum(time.time() - np.frombuffer(mtimes), 0) / 86400
+            weights = np.maximum(0.5 ** (age_days / HALF_LIFE_DAYS), MIN_WEIGHT)
+            keys = rng.exponential(size=len(ids)) / weights
+            order = np.frombuffer(ids, dtype=np.uint32)[np.argsort(keys, kind='stable')]
+        return array('I', order.astype(np.uint32).tobytes())
+
+    def _position_after(self, media_id):
+        if media_id is None or not self._order:
+            return 0
+        found = np.flatnonzero(np.frombuffer(self._order, dtype=np.uint32) == media_id)
+        return int(found[0]) + 1 if len(found) else 0
+
+    def _load_state(self):
+        if self.state_file is None:
+            return {}
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Stato della playlist non leggibile ({e}): si riparte dall'inizio.")
+            return {}
+
+    def _state(self):
+        state = {'mode': self.mode, 'seed': self._seed, 'epoch': self._epoch,
+                 'turn': self._turn, 'last_id': self._last_id}
+        if self.mode == 'cartelle':
+            state['cursors'] = self._cursors.tolist()
+        return state
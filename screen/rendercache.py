@@ -0,0 +1,106 @@
+import hashlib
+import mmap
+import os
+import threading
+
+# --- Costanti di configurazione ---
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frame_cache')
+CACHE_BUDGET = 1 << 30      # byte massimi occupati dai frame su disco (1 GiB)
+EVICT_TO = 0.9              # quando si sfora il budget si scende fino a questa frazione
+FRAME_SUFFIX = '.raw'       # frame grezzi nel formato del pannello (il formato fa parte della chiave)
+OLD_SUFFIXES = ('.rgb565',)  # nomi delle versioni precedenti: contano nel budget ed escono per LRU
+
+
+class RenderCache:
+    """
+    Cache su disco dei frame finali (già nel formato del pannello), indirizzata per contenuto.
+
+    La chiave è lo SHA-1 di percorso, mtime e dimensione del file originale
+    più le impostazioni di rendering: se la foto o le impostazioni cambiano
+    la chiave cambia e il vecchio frame esce per LRU. I frame si rileggono
+    con mmap (nessuna copia in memoria Python); l'mtime del file in cache
+    fa da "ultimo uso" e oltre 'budget' byte si eliminano i meno recenti.
+    """
+
+    def __init__(self, directory=CACHE_DIR, budget=CACHE_BUDGET, frame_size=None):
+        self.directory = directory
+        self.budget = budget
+        self.frame_size = frame_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def key(self, file_path, settings):
+        st = os.stat(file_path)
+        data = f"{os.path.abspath(file_path)}\0{st.st_mtime_ns}\0{st.st_size}\0{settings}"
+        return hashlib.sha1(data.encode('utf-8', errors='surrogateescape')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + FRAME_SUFFIX)
+
+    def get(self, key):
+        """Frame in cache come mmap in sola lettura (da passare a blit), oppure None."""
+        try:
+            fd = os.open(self._path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            size = os.fstat(fd).st_size
+            if size == 0 or (self.frame_size is not None and size != self.frame_size):
+                return None
+            frame = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+            os.utime(fd)
+            return frame
+        finally:
+            os.close(fd)
+
+    def put(self, key, frame):
+        """Salva un frame in modo atomico (file temporaneo + rename), poi applica il budget."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(frame)
+        os.replace(temp, path)
+        with self._lock:
+            self._size += len(frame)
+            over_budget = self._size > self.budget
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Elimina i frame usati meno di recente finché si torna sotto il budget."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, _, size in entries)
+            target = self.budget * EVICT_TO
+            for _, path, size in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self._size = total
+
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def _entries(self):
+        """(ultimo uso, percorso, dimensione) di tutti i frame in cache."""
+        entries = []
+        with os.scandir(self.directory) as shards:
+            for shard in shards:
+                if not shard.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        if entry.name.endswith((FRAME_SUFFIX,) + OLD_SUFFIXES):
+                            try:
+                                st = entry.stat()
+                            except FileNotFoundError:
+                                continue
+                            entries.append((st.st_mtime_ns, entry.path, st.st_size))
+        return entries
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def rgb565_array(img, rotate_180=False, out=None):
+    """
+    Converte un'immagine PIL in un array (H, W) di pixel RGB565 little-endian.
+
+    La conversione avviene con poche operazioni vettoriali NumPy invece di un
+    ciclo Python per pixel. Se 'out' è fornito (es. una vista sul framebuffer)
+    il risultato viene scritto direttamente lì, senza buffer intermedi.
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    rgb = np.asarray(img)
+    if rotate_180:
+        rgb = rgb[::-1, ::-1]
+
+    r = rgb[..., 0].astype('<u2')
+    g = rgb[..., 1].astype('<u2')
+    b = rgb[..., 2].astype('<u2')
+
+    r &= 0xF8
+    r <<= 8
+    g &= 0xFC
+    g <<= 3
+    b >>= 3
+    r |= g
+    r |= b
+
+    if out is None:
+        return r
+    out[...] = r
+    return out
+
+
+def xrgb8888_array(img, rotate_180=False, out=None):
+    """Come rgb565_array, ma per i pannelli a 32 bpp: pixel 0x00RRGGBB (byte B, G, R, X)."""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    rgb = np.asarray(img)
+    if rotate_180:
+        rgb = rgb[::-1, ::-1]
+
+    r = rgb[..., 0].astype('<u4')
+    g = rgb[..., 1].astype('<u4')
+    r <<= 16
+    g <<= 8
+    r |= g
+    r |= rgb[..., 2]
+
+    if out is None:
+        return r
+    out[...] = r
+    return out
+
+
+# Conversione da usare per ogni profondità di colore supportata
+CONVERTERS = {16: rgb565_array, 32: xrgb8888_array}
+
+
+def pixel_array(img, bits_per_pixel=16, rotate_180=False, out=None):
+    """Converte l'immagine nel formato dei pixel di un pannello a 'bits_per_pixel' bit."""
+    return CONVERTERS[bits_per_pixel](img, rotate_180=rotate_180, out=out)
+
+
+def image_to_rgb565(img, rotate_180=False):
+    """Restituisce i byte RGB565 little-endian dell'immagine, pronti per il framebuffer."""
+    return rgb565_array(img, rotate_180=rotate_180).tobytes()
+
+
+def image_to_pixels(img, bits_per_pixel=16, rotate_180=False):
+    """Restituisce i byte dell'immagine nel formato di un pannello a 'bits_per_pixel' bit."""
+    return pixel_array(img, bits_per_pixel, rotate_180=rotate_180).tobytes()
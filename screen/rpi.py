@@ -1,15 +1,23 @@
-from evdev import InputDevice, ecodes
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import os
-import struct
 import sys
 import time
-import psutil
-import subprocess
+
+from framebuffer import get_framebuffer, display_mode
+from screencache import ScreenCache
+from fonts import get_font, draw_text, prewarm
+from logtail import get_logs, get_docker_logs, journal_stream, docker_stream
+from status import StatusPoller
+from docker_api import get_client as get_docker_client
+from sampler import MetricsSampler
+from runtime import get_event_loop
+from touch import open_touchscreen
+from apphost import App
+import metrics
 
 # --- Costanti di configurazione ---
-FB_WIDTH, FB_HEIGHT = 480, 320
-FRAMEBUFFER_DEVICE = '/dev/fb1'
+DISPLAY_MODE = display_mode()   # geometria e pixel del display configurato (SCREEN_DISPLAY, sysfs)
+FB_WIDTH, FB_HEIGHT = DISPLAY_MODE.width, DISPLAY_MODE.height
 TOUCHSCREEN_DEVICE = '/dev/input/event0'
 
 # --- Costanti di Design (Tema "Apple Dark") ---
@@ -29,59 +37,35 @@ CORNER_RADIUS = 10
 FONT_PATH_REG = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
 FONT_PATH_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
 
-# --- Funzioni di utilità (Helpers) ---
-def get_docker_logs(container_name, lines=10):
-    try:
-        command = ['docker', 'logs', container_name]
-        
-        result = subprocess.run(command, 
-                              capture_output=True, text=True, timeout=5)
-        
-        if result.returncode == 0:
-            if result.stdout.strip():
-                return result.stdout.strip().split('\n')
-            else:
-                return ["(Nessun log Docker trovato)"]
-        else:
-            err = result.stderr.strip().split('\n')[-1] 
-            return [f"Errore Docker: {err[:60]}..."]
-    except FileNotFoundError:
-        return ["Errore: Comando 'docker' non trovato."]
-    except Exception as e:
-        return [f"Eccezione Docker: {str(e)}"]
-    
-def get_logs(service_name, lines=10):
-    try:
-        if not service_name.endswith('.service'):
-            service_name += '.service'
-            
-        command = ['journalctl', '-u', service_name, '--no-pager']
-
-        result = subprocess.run(command, 
-                              capture_output=True, text=True, timeout=5)
-
-        if result.returncode == 0:
-            if result.stdout.strip():
-                return result.stdout.strip().split('\n')
-            else:
-                return [f"(Nessun log journal per {service_name})"]
-        else:
-            err = result.stderr.strip().split('\n')[-1]
-            if not err: 
-                 err = result.stdout.strip().split('\n')[-1]
-            return [f"Errore Journal: {err[:60]}..."]
-    except FileNotFoundError:
-        return ["Errore: Comando 'journalctl' non trovato."]
-    except Exception as e:
-        return [f"Eccezione Journal: {str(e)}"]
-
-def get_font(path, size):
-    try:
-        return ImageFont.truetype(path, size)
-    except IOError:
-        print(f"Attenzione: Font non trovato a {path}. Uso il default.")
-        return ImageFont.load_default()
+LOG_LINES = 20
+SERVICES = ['squid', 'nginx', 'docker', 'cron', 'ssh']
+CONTAINER_REFRESH = 2   # secondi tra due aggiornamenti della schermata Container
+
+# --- Titoli delle schermate con intestazione e tasto "< Home" ---
+SCREEN_TITLES = ("Logs: immich_service", "Logs: nginx", "Logs: squid",
+                 "Storage", "Servizi di Sistema", "Prestazioni", "Container")
+
+# --- Testi fissi pre-rasterizzati all'avvio (testo, font, dimensione) ---
+STATIC_TEXTS = (
+    [(t, FONT_PATH_BOLD, 20) for t in ("Prestazioni", "Logs", "Servizi", "Storage", "Immich", "Nginx", "Squid")]
+    + [(t, FONT_PATH_BOLD, 22) for t in SCREEN_TITLES]
+    + [("< Home", FONT_PATH_REG, 18), ("Ultime 20 righe:", FONT_PATH_BOLD, 14),
+       ("(tocca per CPU/RAM)", FONT_PATH_REG, 14), ("Caricamento...", FONT_PATH_REG, 14),
+       ("Caricamento...", FONT_PATH_REG, 16)]
+    + [(t, FONT_PATH_REG, 16) for t in ("Root (/)", "RAIDBOX", "ROUTER", "Utilizzo CPU", "Utilizzo RAM",
+                                        "Utilizzo SWAP", "Servizi Systemd:", "Container Docker:",
+                                        *SERVICES)]
+)
+
+# --- Display: il framebuffer, oppure quello concesso dall'host del manager ---
+display = None
+
+def get_display():
+    if display is not None:
+        return display
+    return get_framebuffer()
 
+# --- Funzioni di utilità (Helpers) ---
 def draw_rounded_rectangle(draw, xy, radius, fill=None, outline=None, width=1):
     x1, y1, x2, y2 = xy
     draw.rectangle(
@@ -109,39 +93,21 @@ def draw_rounded_rectangle(draw, xy, radius, fill=None, outline=None, width=1):
         0, 90, fill=fill, outline=outline, width=width
     )
 
-def rgb565(r, g, b):
-    pixel = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
-    return struct.pack("<H", pixel)
-
 def draw_image_to_fb(img):
-    img = img.rotate(180, expand=True)
-    
     try:
-        image_bytes = img.tobytes("raw", "RGB")
-        rgb565_data_buffer = bytearray(FB_WIDTH * FB_HEIGHT * 2)
-        
-        idx_565 = 0
-        for i in range(0, len(image_bytes), 3):
-            r = image_bytes[i]
-            g = image_bytes[i+1]
-            b = image_bytes[i+2]
-            
-            packed_pixel = rgb565(r, g, b)
-            rgb565_data_buffer[idx_565:idx_565+2] = packed_pixel
-            idx_565 += 2
-
-        with open(FRAMEBUFFER_DEVICE, 'wb') as fb:
-            fb.write(rgb565_data_buffer)
+        # Conversione e scrittura sono un solo passaggio: i pixel finiscono direttamente nel framebuffer
+        with metrics.span('rpi', 'convert_blit'):
+            get_display().show_image(img, rotate_180=True)
     except Exception as e:
         print(f"Errore during writing to framebuffer: {e}")
-        img.save('/tmp/fb_fallback.png')
+        img.rotate(180, expand=True).save('/tmp/fb_fallback.png')
         print("Immagine di fallback salvata in /tmp/fb_fallback.png")
 
 def draw_header(draw, title_text, show_back_button=False):
     font_title = get_font(FONT_PATH_BOLD, 22)
     font_back = get_font(FONT_PATH_REG, 18)
     
-    draw.text((PADDING, PADDING), title_text, fill=TEXT_COLOR, font=font_title)
+    draw_text(draw, (PADDING, PADDING), title_text, font_title, TEXT_COLOR)
     
     if show_back_button:
         back_btn_width = 100
@@ -155,11 +121,12 @@ def draw_header(draw, title_text, show_back_button=False):
             CORNER_RADIUS,
             fill=PRIMARY_COLOR
         )
-        draw.text(
+        draw_text(
+            draw,
             (back_btn_x + 20, back_btn_y + 8), 
             "< Home", 
-            fill=TEXT_COLOR, 
-            font=font_back
+            font_back,
+            TEXT_COLOR
         )
 
 def draw_progress_bar(draw, y_pos, percent, label, value_text):
@@ -170,7 +137,7 @@ def draw_progress_bar(draw, y_pos, percent, label, value_text):
     bar_height = 25
     bar_x = PADDING
     
-    draw.text((bar_x, y_pos), label, fill=TEXT_COLOR, font=font_label)
+    draw_text(draw, (bar_x, y_pos), label, font_label, TEXT_COLOR)
     percent_str = f"{percent:.1f}%"
     percent_w = draw.textlength(percent_str, font=font_label)
     draw.text((FB_WIDTH - PADDING - percent_w, y_pos), percent_str, fill=PRIMARY_COLOR, font=font_label)
@@ -210,83 +177,151 @@ def draw_progress_bar(draw, y_pos, percent, label, value_text):
     draw.text((FB_WIDTH - PADDING - value_w, y_pos + bar_height + 8), value_text, fill=SECONDARY_COLOR, font=font_value)
 
 
-# --- Schermate dell'applicazione ---
-def immich():
+def theme_key():
+    return (FB_WIDTH, FB_HEIGHT, DISPLAY_MODE.bits_per_pixel, BG_COLOR, TEXT_COLOR, PRIMARY_COLOR, SECONDARY_COLOR,
+            PADDING, CORNER_RADIUS, FONT_PATH_REG, FONT_PATH_BOLD)
+
+screen_cache = ScreenCache(theme_key)
+
+def render_chrome(title_text):
     image = Image.new('RGB', (FB_WIDTH, FB_HEIGHT), color=BG_COLOR)
     draw = ImageDraw.Draw(image)
-    draw_header(draw, "Logs: immich_service", show_back_button=True)
+    draw_header(draw, title_text, show_back_button=True)
+    return image
+
+def new_screen(title_text):
+    """Copia dell'intestazione già renderizzata, su cui disegnare il contenuto dinamico."""
+    image = screen_cache.get(('chrome', title_text), lambda: render_chrome(title_text)).copy()
+    return image, ImageDraw.Draw(image)
+
+def static_frame(name, render):
+    """Frame nel formato del pannello (già ruotato) di una schermata statica."""
+    def render_frame():
+        image = render()
+        with metrics.span('rpi', 'convert'):
+            return DISPLAY_MODE.encode(image, rotate_180=True)
+    return screen_cache.get(name, render_frame)
+
+def show_static_screen(name, render):
+    """Mostra una schermata statica: dopo il primo render è una sola copia nel framebuffer."""
+    frame = static_frame(name, render)
+    try:
+        with metrics.span('rpi', 'blit'):
+            get_display().blit(frame)
+    except Exception as e:
+        print(f"Errore during writing to framebuffer: {e}")
 
-    font_log = get_font(FONT_PATH_REG, 11) 
-    font_subtitle = get_font(FONT_PATH_BOLD, 14)
+def warm_screen_cache():
+    static_frame('dashboard', render_dashboard)
+    static_frame('logs', render_logs_menu)
+    for title in SCREEN_TITLES:
+        screen_cache.get(('chrome', title), lambda: render_chrome(title))
 
-    y_pos = 80
-    draw.text((PADDING, y_pos), "Ultime 20 righe:", fill=SECONDARY_COLOR, font=font_subtitle)
-    y_pos += 30
 
-    logs = get_docker_logs('immich_server', lines=20)
-    
-    line_height = 14
-    for line in logs:
-        clean_line = line.strip().replace('\t', ' ')
-        draw.text((PADDING, y_pos), clean_line[:70], fill=TEXT_COLOR, font=font_log)
-        y_pos += line_height
-        if y_pos > FB_HEIGHT - PADDING:
-            break 
+# --- Loop a eventi: touch, timer e aggiornamenti dai thread in background ---
+loop = get_event_loop()
+current_screen = None
+refresh_timers = {}
 
-    draw_image_to_fb(image)
+def notify_screen(screen):
+    """Da chiamare dai thread in background: ridisegna 'screen' nel thread del loop."""
+    return lambda: loop.call_soon_threadsafe(refresh_screen, screen)
 
-def nginx():
-    image = Image.new('RGB', (FB_WIDTH, FB_HEIGHT), color=BG_COLOR)
-    draw = ImageDraw.Draw(image)
-    draw_header(draw, "Logs: nginx", show_back_button=True)
+# --- Stream dei log, uno per sorgente, aperti all'avvio ---
+log_streams = {}
 
-    font_log = get_font(FONT_PATH_REG, 11)
-    font_subtitle = get_font(FONT_PATH_BOLD, 14)
+# --- Stato di servizi e container, aggiornato in background ---
+status_poller = StatusPoller(SERVICES, on_update=lambda: loop.call_soon_threadsafe(refresh_screen, servizi))
 
-    y_pos = 80
-    draw.text((PADDING, y_pos), "Ultime 20 righe:", fill=SECONDARY_COLOR, font=font_subtitle)
-    y_pos += 30
+# --- Metriche di sistema, campionate in background ---
+metrics_sampler = MetricsSampler(on_update=lambda: loop.call_soon_threadsafe(refresh_screen, prestazioni))
 
-    logs = get_logs('nginx', lines=20)
-    
-    line_height = 14
-    for line in logs:
-        clean_line = line.strip().replace('\t', ' ')
-        draw.text((PADDING, y_pos), clean_line[:70], fill=TEXT_COLOR, font=font_log)
-        y_pos += line_height
-        if y_pos > FB_HEIGHT - PADDING:
-            break
+# --- Statistiche dei container, lette in background ---
+container_stats = None
+container_stats_time = 0
+container_job = None
 
-    draw_image_to_fb(image)
+def draw_screen(screen):
+    """Disegna 'screen' misurandone la durata (lettura dei dati, disegno, conversione e scrittura)."""
+    with metrics.span('rpi', 'screen', screen=screen.__name__):
+        screen()
 
-def squid():
-    image = Image.new('RGB', (FB_WIDTH, FB_HEIGHT), color=BG_COLOR)
-    draw = ImageDraw.Draw(image)
-    draw_header(draw, "Logs: squid", show_back_button=True)
+def show_screen(screen):
+    global current_screen
+    current_screen = screen
+    draw_screen(screen)
 
-    font_log = get_font(FONT_PATH_REG, 11)
+def schedule_refresh(screen, delay):
+    """Ridisegna 'screen' dopo 'delay' secondi, se nel frattempo è ancora visualizzata."""
+    if screen in refresh_timers:
+        return
+    def refresh():
+        del refresh_timers[screen]
+        refresh_screen(screen)
+    refresh_timers[screen] = loop.call_later(delay, refresh)
+
+def refresh_screen(screen):
+    """Ridisegna 'screen' solo se è ancora quella visualizzata."""
+    if current_screen is screen:
+        draw_screen(screen)
+
+def start_log_streams():
+    log_streams['immich'] = docker_stream('immich_server', LOG_LINES, notify_screen(immich))
+    log_streams['nginx'] = journal_stream('nginx', LOG_LINES, notify_screen(nginx))
+    log_streams['squid'] = journal_stream('squid', LOG_LINES, notify_screen(squid))
+    for stream in log_streams.values():
+        stream.start()
+
+def read_log_stream(name, fallback):
+    """
+    Ultime righe dal ring buffer dello stream. Se lo stream è fermo e non
+    ha righe lette dal vivo (sorgente fallita o in attesa di riavvio) si
+    fa una lettura singola con fallback().
+    """
+    with metrics.span('rpi', 'fetch', source=name):
+        stream = log_streams.get(name)
+        if stream is not None:
+            stream.start()
+            logs = stream.snapshot()
+            if logs or stream.is_running():
+                return logs
+        return fallback()
+
+
+# --- Schermate dell'applicazione ---
+def draw_log_screen(title_text, logs):
+    image, draw = new_screen(title_text)
+
+    font_log = get_font(FONT_PATH_REG, 11) 
     font_subtitle = get_font(FONT_PATH_BOLD, 14)
 
     y_pos = 80
-    draw.text((PADDING, y_pos), "Ultime 20 righe:", fill=SECONDARY_COLOR, font=font_subtitle)
+    draw_text(draw, (PADDING, y_pos), "Ultime 20 righe:", font_subtitle, SECONDARY_COLOR)
     y_pos += 30
 
-    logs = get_logs('squid', lines=20)
-    
     line_height = 14
-    for line in logs:
+    visible_lines = (FB_HEIGHT - PADDING - y_pos) // line_height + 1
+    for line in logs[-visible_lines:]:
         clean_line = line.strip().replace('\t', ' ')
         draw.text((PADDING, y_pos), clean_line[:70], fill=TEXT_COLOR, font=font_log)
         y_pos += line_height
-        if y_pos > FB_HEIGHT - PADDING:
-            break
 
     draw_image_to_fb(image)
 
+def immich():
+    logs = read_log_stream('immich', lambda: get_docker_logs('immich_server', lines=LOG_LINES))
+    draw_log_screen("Logs: immich_service", logs)
+
+def nginx():
+    logs = read_log_stream('nginx', lambda: get_logs('nginx', lines=LOG_LINES))
+    draw_log_screen("Logs: nginx", logs)
+
+def squid():
+    logs = read_log_stream('squid', lambda: get_logs('squid', lines=LOG_LINES))
+    draw_log_screen("Logs: squid", logs)
+
 def memoria():
-    image = Image.new('RGB', (FB_WIDTH, FB_HEIGHT), color=BG_COLOR)
-    draw = ImageDraw.Draw(image)
-    draw_header(draw, "Storage", show_back_button=True)
+    image, draw = new_screen("Storage")
 
     def get_disk_usage(path):
         try:
@@ -298,15 +333,17 @@ def memoria():
         except:
             return 0, 1 
 
-    used_root, total_root = get_disk_usage('/')
+    with metrics.span('rpi', 'fetch', source='dischi'):
+        used_root, total_root = get_disk_usage('/')
+        used_mnt, total_mnt = get_disk_usage('/mnt/router_hdd')
+        used_mnt_R, total_mnt_R = get_disk_usage('/mnt/raidbox')
+
     percent_root = (used_root / total_root) * 100 if total_root > 0 else 0
     text_root = f"{used_root/1024**3:.1f} GB / {total_root/1024**3:.1f} GB"
     
-    used_mnt, total_mnt = get_disk_usage('/mnt/router_hdd')
     percent_mnt = (used_mnt / total_mnt) * 100 if total_mnt > 0 else 0
     text_mnt = f"{used_mnt/1024**3:.1f} GB / {total_mnt/1024**3:.1f} GB"
 
-    used_mnt_R, total_mnt_R = get_disk_usage('/mnt/raidbox')
     percent_mnt_R = (used_mnt_R / total_mnt_R) * 100 if total_mnt_R > 0 else 0
     text_mnt_R = f"{used_mnt_R/1024**3:.1f} GB / {total_mnt_R/1024**3:.1f} GB"
 
@@ -317,60 +354,125 @@ def memoria():
     draw_image_to_fb(image)
 
 def servizi():
-    image = Image.new('RGB', (FB_WIDTH, FB_HEIGHT), color=BG_COLOR)
-    draw = ImageDraw.Draw(image)
-    draw_header(draw, "Servizi di Sistema", show_back_button=True)
+    image, draw = new_screen("Servizi di Sistema")
 
     font_service = get_font(FONT_PATH_REG, 16)
     font_docker = get_font(FONT_PATH_REG, 14)
 
-    services = ['squid', 'nginx', 'docker', 'cron', 'ssh']
+    status = status_poller.snapshot()
+
     y_pos = 80
+    if status is None:
+        draw_text(draw, (PADDING, y_pos), "Caricamento...", font_service, SECONDARY_COLOR)
+        draw_image_to_fb(image)
+        return
     x_pos = PADDING + 25
     
-    draw.text((PADDING, y_pos), "Servizi Systemd:", fill=SECONDARY_COLOR, font=font_service)
+    draw_text(draw, (PADDING, y_pos), "Servizi Systemd:", font_service, SECONDARY_COLOR)
     y_pos += 30
 
-    for service in services:
-        try:
-            status = os.system(f"systemctl is-active --quiet {service}")
-            color = GREEN if status == 0 else RED
-        except Exception:
-            color = ORANGE
+    for service in SERVICES:
+        active = status.services.get(service)
+        color = ORANGE if active is None else GREEN if active else RED
         
         draw.ellipse((x_pos - 15, y_pos + 4, x_pos - 5, y_pos + 14), fill=color)
-        draw.text((x_pos, y_pos), service, fill=TEXT_COLOR, font=font_service)
+        draw_text(draw, (x_pos, y_pos), service, font_service, TEXT_COLOR)
         y_pos += 30
 
     y_pos += 10
-    draw.text((PADDING, y_pos), "Container Docker:", fill=SECONDARY_COLOR, font=font_service)
+    draw_text(draw, (PADDING, y_pos), "Container Docker:", font_service, SECONDARY_COLOR)
+    draw_text(draw, (PADDING + 155, y_pos + 2), "(tocca per CPU/RAM)", font_docker, SECONDARY_COLOR)
     y_pos += 25
     
+    if status.docker == 'ok':
+        if status.containers:
+            for name, status_text in status.containers[:4]: 
+                name = name[:20]
+                color = GREEN if 'Up' in status_text else RED
+                
+                draw.ellipse((x_pos - 15, y_pos + 3, x_pos - 5, y_pos + 13), fill=color)
+                draw.text((x_pos, y_pos), f"{name} ({status_text[:10]})", fill=TEXT_COLOR, font=font_docker)
+                y_pos += 25
+        else:
+            draw_text(draw, (x_pos, y_pos), "Nessun container attivo", font_docker, YELLOW)
+    elif status.docker == 'unavailable':
+        draw_text(draw, (x_pos, y_pos), "Docker non disponibile", font_docker, RED)
+    else:
+        draw_text(draw, (x_pos, y_pos), "Errore controllo Docker", font_docker, ORANGE)
+
+    draw_image_to_fb(image)
+
+def fetch_container_stats():
+    with metrics.span('rpi', 'fetch', source='container'):
+        client = get_docker_client()
+        result = []
+        for name, status_text in client.containers()[:5]:
+            try:
+                stats = client.stats(name)
+            except Exception:
+                stats = None
+            result.append((name, status_text, stats))
+        return result
+
+def on_container_stats(future):
+    global container_stats, container_stats_time, container_job
+    container_job = None
+    container_stats_time = time.monotonic()
     try:
-        result = subprocess.run(['docker', 'ps', '--format', '{{.Names}}\t{{.Status}}'], 
-                              capture_output=True, text=True, timeout=5)
-        if result.returncode == 0:
-            lines = result.stdout.strip().split('\n')
-            if lines and lines[0]:
-                for line in lines[:4]: 
-                    parts = line.split('\t')
-                    name = parts[0][:20]
-                    status_text = parts[1]
-                    color = GREEN if 'Up' in status_text else RED
-                    
-                    draw.ellipse((x_pos - 15, y_pos + 3, x_pos - 5, y_pos + 13), fill=color)
-                    draw.text((x_pos, y_pos), f"{name} ({status_text[:10]})", fill=TEXT_COLOR, font=font_docker)
-                    y_pos += 25
+        container_stats = future.result()
+    except Exception:
+        container_stats = 'errore'
+    refresh_screen(contenitori)
+
+def contenitori():
+    global container_job
+    image, draw = new_screen("Container")
+
+    font_name = get_font(FONT_PATH_REG, 14)
+    font_value = get_font(FONT_PATH_REG, 12)
+
+    y_pos = 80
+    bar_width = FB_WIDTH - (PADDING * 2)
+
+    if container_stats is None:
+        draw_text(draw, (PADDING, y_pos), "Caricamento...", font_name, SECONDARY_COLOR)
+    elif container_stats == 'errore':
+        draw_text(draw, (PADDING, y_pos), "Docker non disponibile", font_name, RED)
+    elif not container_stats:
+        draw_text(draw, (PADDING, y_pos), "Nessun container attivo", font_name, YELLOW)
+    else:
+        for name, status_text, stats in container_stats:
+            color = GREEN if 'Up' in status_text else RED
+            draw.text((PADDING, y_pos), name[:28], fill=TEXT_COLOR, font=font_name)
+
+            if stats is None:
+                value_text = "n/d"
+                cpu_percent = 0
             else:
-                draw.text((x_pos, y_pos), "Nessun container attivo", fill=YELLOW, font=font_docker)
-        else:
-            draw.text((x_pos, y_pos), "Docker non disponibile", fill=RED, font=font_docker)
-    except Exception as e:
-        draw.text((x_pos, y_pos), "Errore controllo Docker", fill=ORANGE, font=font_docker)
+                cpu_percent = stats['cpu_percent']
+                cpu_text = "--" if cpu_percent is None else f"{cpu_percent:.1f}%"
+                value_text = f"CPU {cpu_text}  RAM {stats['mem_used']/1024**2:.0f} MB"
+                cpu_percent = cpu_percent or 0
+            value_w = draw.textlength(value_text, font=font_value)
+            draw.text((FB_WIDTH - PADDING - value_w, y_pos + 2), value_text, fill=SECONDARY_COLOR, font=font_value)
+
+            draw.rectangle((PADDING, y_pos + 22, PADDING + bar_width, y_pos + 27), fill=(50, 50, 50))
+            filled_width = int(min(cpu_percent, 100) / 100 * bar_width)
+            if filled_width > 0:
+                draw.rectangle((PADDING, y_pos + 22, PADDING + filled_width, y_pos + 27), fill=color)
+            y_pos += 44
 
     draw_image_to_fb(image)
 
-def logs():
+    # Nuova lettura in background quando i dati sono più vecchi di CONTAINER_REFRESH
+    age = time.monotonic() - container_stats_time
+    if container_job is None:
+        if age >= CONTAINER_REFRESH:
+            container_job = loop.run_in_background(fetch_container_stats, on_done=on_container_stats)
+        else:
+            schedule_refresh(contenitori, CONTAINER_REFRESH - age)
+
+def render_logs_menu():
     image = Image.new('RGB', (FB_WIDTH, FB_HEIGHT), color=BG_COLOR)
     draw = ImageDraw.Draw(image)
     
@@ -393,40 +495,68 @@ def logs():
     draw_rounded_rectangle(draw, q1_xy, CORNER_RADIUS, fill=BG_COLOR)
     
     draw_rounded_rectangle(draw, q2_xy, CORNER_RADIUS, fill=btn_color)
-    draw.text((q2_xy[0] + 20, text_y_bottom), "Immich", fill=TEXT_COLOR, font=font_btn)
+    draw_text(draw, (q2_xy[0] + 20, text_y_bottom), "Immich", font_btn, TEXT_COLOR)
 
     draw_rounded_rectangle(draw, q3_xy, CORNER_RADIUS, fill=btn_color)
-    draw.text((q3_xy[0] + 20, text_y_top), "Nginx", fill=TEXT_COLOR, font=font_btn)
+    draw_text(draw, (q3_xy[0] + 20, text_y_top), "Nginx", font_btn, TEXT_COLOR)
 
     draw_rounded_rectangle(draw, q4_xy, CORNER_RADIUS, fill=btn_color)
-    draw.text((q4_xy[0] + 20, text_y_top), "Squid", fill=TEXT_COLOR, font=font_btn)
+    draw_text(draw, (q4_xy[0] + 20, text_y_top), "Squid", font_btn, TEXT_COLOR)
 
-    draw_image_to_fb(image)
+    return image
+
+def logs():
+    show_static_screen('logs', render_logs_menu)
+
+def draw_sparkline(draw, xy, values, color, max_value=100):
+    x1, y1, x2, y2 = xy
+    if len(values) < 2:
+        return
+    step = (x2 - x1) / (len(values) - 1)
+    points = [
+        (x1 + i * step, y2 - (min(value, max_value) / max_value) * (y2 - y1))
+        for i, value in enumerate(values)
+    ]
+    draw.line(points, fill=color, width=1)
 
 def prestazioni():
-    image = Image.new('RGB', (FB_WIDTH, FB_HEIGHT), color=BG_COLOR)
-    draw = ImageDraw.Draw(image)
-    draw_header(draw, "Prestazioni", show_back_button=True)
+    image, draw = new_screen("Prestazioni")
+
+    # Il primo campione arriva dal thread del campionatore, che poi ridisegna la schermata
+    sample = metrics_sampler.latest()
+    if sample is None:
+        draw_text(draw, (PADDING, 80), "Caricamento...", get_font(FONT_PATH_REG, 16), SECONDARY_COLOR)
+        draw_image_to_fb(image)
+        return
+    font_info = get_font(FONT_PATH_REG, 12)
+
+    # Load average e temperatura SoC
+    load_text = "Load: " + " ".join(f"{value:.2f}" for value in sample.load)
+    if sample.temperature is not None:
+        load_text += f"   Temp: {sample.temperature:.1f}°C"
+    draw.text((PADDING, 58), load_text, fill=SECONDARY_COLOR, font=font_info)
     
-    # CPU
-    cpu_percent = psutil.cpu_percent(interval=1)
-    draw_progress_bar(draw, 80, cpu_percent, "Utilizzo CPU", f"{cpu_percent:.1f}%")
+    # CPU (media, per core e storico recente)
+    cores_text = "core: " + " ".join(f"{value:.0f}%" for value in sample.cpu_per_core)
+    draw_progress_bar(draw, 80, sample.cpu, "Utilizzo CPU", cores_text)
+    draw_sparkline(draw, (150, 82, FB_WIDTH - PADDING - 80, 98), metrics_sampler.history('cpu'), PRIMARY_COLOR)
     
     # RAM
-    mem = psutil.virtual_memory()
+    mem = sample.mem
     mem_percent = mem.percent
     mem_text = f"{mem.used/1024**3:.1f} GB / {mem.total/1024**3:.1f} GB"
     draw_progress_bar(draw, 160, mem_percent, "Utilizzo RAM", mem_text)
+    draw_sparkline(draw, (150, 162, FB_WIDTH - PADDING - 80, 178), metrics_sampler.history('mem'), SECONDARY_COLOR)
     
     # SWAP totale
-    swap = psutil.swap_memory()
+    swap = sample.swap
     swap_percent = swap.percent
     swap_text = f"{swap.used/1024**3:.1f} GB / {swap.total/1024**3:.1f} GB"
     draw_progress_bar(draw, 240, swap_percent, "Utilizzo SWAP", swap_text)
     
     draw_image_to_fb(image)
     
-def print_dashboard():
+def render_dashboard():
     image = Image.new('RGB', (FB_WIDTH, FB_HEIGHT), color=BG_COLOR)
     draw = ImageDraw.Draw(image)
     
@@ -447,23 +577,102 @@ def print_dashboard():
     text_y_bottom = (q2_xy[1] + q2_xy[3]) // 2 - (font_btn.size // 2)
 
     draw_rounded_rectangle(draw, q1_xy, CORNER_RADIUS, fill=btn_color)
-    draw.text((q1_xy[0] + 20, text_y_bottom), "Prestazioni", fill=TEXT_COLOR, font=font_btn)
+    draw_text(draw, (q1_xy[0] + 20, text_y_bottom), "Prestazioni", font_btn, TEXT_COLOR)
     
     draw_rounded_rectangle(draw, q2_xy, CORNER_RADIUS, fill=btn_color)
-    draw.text((q2_xy[0] + 20, text_y_bottom), "Logs", fill=TEXT_COLOR, font=font_btn)
+    draw_text(draw, (q2_xy[0] + 20, text_y_bottom), "Logs", font_btn, TEXT_COLOR)
 
     draw_rounded_rectangle(draw, q3_xy, CORNER_RADIUS, fill=btn_color)
-    draw.text((q3_xy[0] + 20, text_y_top), "Servizi", fill=TEXT_COLOR, font=font_btn)
+    draw_text(draw, (q3_xy[0] + 20, text_y_top), "Servizi", font_btn, TEXT_COLOR)
 
     draw_rounded_rectangle(draw, q4_xy, CORNER_RADIUS, fill=btn_color)
-    draw.text((q4_xy[0] + 20, text_y_top), "Storage", fill=TEXT_COLOR, font=font_btn)
+    draw_text(draw, (q4_xy[0] + 20, text_y_top), "Storage", font_btn, TEXT_COLOR)
 
-    draw_image_to_fb(image)
+    return image
+
+def print_dashboard():
+    show_static_screen('dashboard', render_dashboard)
+
+
+def make_gesture_handler(stato = 0):
+    """Macchina a stati delle schermate guidata dai gesti del touchscreen."""
+    center_x = FB_WIDTH // 2
+    center_y = FB_HEIGHT // 2
+
+    def on_gesture(gesture):
+        nonlocal stato
+        x, y = gesture.x, gesture.y
+        print(f"Gesto: {gesture.kind} ({x}, {y})")
+
+        if gesture.kind == 'long_press' and stato != 0:
+            print("-> Long-press (Home)")
+            stato = 0
+            show_screen(print_dashboard)
+            return
+
+        if gesture.kind != 'tap':
+            return
+
+        if stato == 0: 
+            
+            if x >= center_x and y < center_y:
+                    print("-> LOGS")
+                    stato = 2
+                    show_screen(logs)
+            elif x < center_x and y < center_y:
+                    print("-> PRESTAZIONI")
+                    stato = 1
+                    show_screen(prestazioni)
+            elif x < center_x and y >= center_y:
+                    print("-> SERVIZI")
+                    stato = 3
+                    show_screen(servizi)
+            elif x >= center_x and y >= center_y:
+                    print("-> MEMORIA")
+                    stato = 1
+                    show_screen(memoria)
+                    
+        elif stato == 1: 
+            
+            if x >= center_x and y >= center_y:
+                    print("-> Tasto BACK (Home)")
+                    stato = 0
+                    show_screen(print_dashboard)
+
+        elif stato == 3: 
+            
+            if x >= center_x and y >= center_y:
+                    print("-> Tasto BACK (Home)")
+                    stato = 0
+                    show_screen(print_dashboard)
+            else:
+                    print("-> CONTAINER")
+                    stato = 1
+                    show_screen(contenitori)
+
+        elif stato == 2: 
+            
+            if x >= center_x and y < center_y:
+                    print("-> IMMICH")
+                    stato = 1
+                    show_screen(immich)
+            elif x < center_x and y >= center_y:
+                    print("-> NGINX")
+                    stato = 1
+                    show_screen(nginx)
+            elif x >= center_x and y >= center_y:
+                    print("-> SQUID")
+                    stato = 1
+                    show_screen(squid)
+
+    return on_gesture
 
 
 def listen_touchscreen(stato = 0):
+    on_gesture = make_gesture_handler(stato)
+
     try:
-        device = InputDevice(TOUCHSCREEN_DEVICE)
+        device, tracker = open_touchscreen(TOUCHSCREEN_DEVICE, FB_WIDTH, FB_HEIGHT, on_gesture)
     except Exception as e:
         print(f"Errore: Impossibile avviare il listener del touchscreen: {e}")
         print("Assicurati che il dispositivo sia connesso e i permessi siano corretti ('sudo'?).")
@@ -472,95 +681,78 @@ def listen_touchscreen(stato = 0):
     print(f"Dispositivo: {device.name}")
     print(f"In attesa di tocchi su {TOUCHSCREEN_DEVICE}...")
 
+    loop.add_reader(device, tracker.read, device)
     try:
-        abs_x_info = device.absinfo(ecodes.ABS_X)
-        abs_y_info = device.absinfo(ecodes.ABS_Y)
-        max_touch_raw_x = abs_x_info.max
-        max_touch_raw_y = abs_y_info.max
-    except KeyError:
-        print("Avviso: Impossibile ottenere absinfo. Uso valori di fallback (4095).")
-        max_touch_raw_x = 4095 
-        max_touch_raw_y = 4095
-    
-    if max_touch_raw_x == 0 or max_touch_raw_y == 0:
-        print("Errore: I valori massimi del touchscreen non sono validi (0).")
-        return
-
-    current_raw_x, current_raw_y = 0, 0
-    center_x = FB_WIDTH // 2
-    center_y = FB_HEIGHT // 2
-
-    count = 0 
-    try:
-        for event in device.read_loop():
-            if event.type == ecodes.EV_ABS:
-                if event.code == ecodes.ABS_X:
-                    current_raw_x = event.value
-                elif event.code == ecodes.ABS_Y:
-                    current_raw_y = event.value
-            
-            elif event.type == ecodes.EV_KEY and event.code == ecodes.BTN_TOUCH and event.value == 1:
-                count += 1
-                
-                scaled_x = int(((max_touch_raw_y - current_raw_y) / max_touch_raw_y) * FB_WIDTH)
-                scaled_y = int((current_raw_x / max_touch_raw_x) * FB_HEIGHT)
-                scaled_x = max(0, min(FB_WIDTH - 1, scaled_x))
-                scaled_y = max(0, min(FB_HEIGHT - 1, scaled_y))
-
-                print(f"Tocco raw: ({current_raw_x}, {current_raw_y}) -> Scalato: ({scaled_x}, {scaled_y})")
-                
-                if count % 2 == 0:
-                    if stato == 0: 
-                        
-                        if scaled_x >= center_x and scaled_y < center_y:
-                                print("-> LOGS")
-                                stato = 2
-                                logs()
-                        elif scaled_x < center_x and scaled_y < center_y:
-                                print("-> PRESTAZIONI")
-                                stato = 1
-                                prestazioni()
-                        elif scaled_x < center_x and scaled_y >= center_y:
-                                print("-> SERVIZI")
-                                stato = 1
-                                servizi()
-                        elif scaled_x >= center_x and scaled_y >= center_y:
-                                print("-> MEMORIA")
-                                stato = 1
-                                memoria()
-                                
-                    elif stato == 1: 
-                        
-                        if scaled_x >= center_x and scaled_y >= center_y:
-                                print("-> Tasto BACK (Home)")
-                                stato = 0
-                                print_dashboard()
-
-                    elif stato == 2: 
-                        
-                        if scaled_x >= center_x and scaled_y < center_y:
-                                print("-> IMMICH")
-                                stato = 1
-                                immich()
-                        elif scaled_x < center_x and scaled_y >= center_y:
-                                print("-> NGINX")
-                                stato = 1
-                                nginx()
-                        elif scaled_x >= center_x and scaled_y >= center_y:
-                                print("-> SQUID")
-                                stato = 1
-                                squid()
-
+        loop.run()
     except KeyboardInterrupt:
         print("\nInterrotto dall'utente.")
+    finally:
+        loop.remove_reader(device)
+
+def suspend_screens():
+    """Smette di ridisegnare e di campionare; restituisce la schermata da ripristinare."""
+    global current_screen
+    screen, current_screen = current_screen, None
+    for timer in refresh_timers.values():
+        timer.cancel()
+    refresh_timers.clear()
+    status_poller.stop()
+    metrics_sampler.stop()
+    return screen
 
 def main():
     if sys.platform != 'linux':
         print("Questo script è progettato per sistemi Linux.")
 
+    metrics.start_exporter('rpi')
+    prewarm(STATIC_TEXTS)
+    warm_screen_cache()
+    start_log_streams()
+    status_poller.start()
+    metrics_sampler.start()
+
     stato = 0
-    print_dashboard()
+    show_screen(print_dashboard)
     listen_touchscreen(stato)
 
+
+class RpiApp(App):
+    """
+    Schermate di sistema ospitate dal manager: usano il loop, il display e
+    i gesti dell'host invece di aprire framebuffer e touchscreen. Da
+    sospese poller e campionatore si fermano e nulla viene ridisegnato; gli
+    stream dei log restano aperti per avere le righe pronte alla ripresa.
+    """
+
+    name = 'rpi'
+
+    def __init__(self):
+        super().__init__()
+        self._screen = None
+        self.on_gesture = make_gesture_handler(0)
+
+    def load(self):
+        global display
+        display = self.display
+        prewarm(STATIC_TEXTS)
+        warm_screen_cache()
+
+    def start(self):
+        start_log_streams()
+        self.resume()
+
+    def resume(self):
+        status_poller.start()
+        metrics_sampler.start()
+        show_screen(self._screen or print_dashboard)
+
+    def suspend(self):
+        self._screen = suspend_screens()
+
+    def stop(self):
+        suspend_screens()
+        for stream in log_streams.values():
+            stream.stop()
+
 if __name__ == "__main__":
     main()
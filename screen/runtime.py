@@ -0,0 +1,172 @@
+import heapq
+import itertools
+import os
+import selectors
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Costanti di configurazione ---
+BACKGROUND_WORKERS = 2
+
+
+class Timer:
+    """Handle restituito da call_later/call_every; cancel() lo disattiva."""
+
+    def __init__(self, callback, args, interval=None):
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """
+    Loop a eventi su un solo thread, basato su selectors.
+
+    Multiplexa file descriptor (es. il touchscreen), timer e callback
+    provenienti da altri thread (stream dei log, poller, lavori in
+    background), così nessuna attività lenta blocca l'input e le schermate
+    possono aggiornarsi da sole. Tutte le callback girano nel thread del loop.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread_id = None
+        self._pool = None
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, self._drain_wakeup)
+
+    # --- File descriptor ---
+    def add_reader(self, fileobj, callback, *args):
+        self._selector.register(fileobj, selectors.EVENT_READ, lambda: callback(*args))
+
+    def remove_reader(self, fileobj):
+        try:
+            self._selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    # --- Callback e timer ---
+    def call_soon(self, callback, *args):
+        with self._lock:
+            self._ready.append((callback, args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        with self._lock:
+            self._ready.append((callback, args))
+        self._wakeup()
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(callback, args)
+        self._schedule(time.monotonic() + delay, timer)
+        return timer
+
+    def call_every(self, interval, callback, *args):
+        timer = Timer(callback, args, interval)
+        self._schedule(time.monotonic() + interval, timer)
+        return timer
+
+    def _schedule(self, when, timer):
+        with self._lock:
+            heapq.heappush(self._timers, (when, next(self._sequence), timer))
+        if self._thread_id != threading.get_ident():
+            self._wakeup()
+
+    # --- Lavori in background ---
+    def run_in_background(self, func, *args, on_done=None):
+        """
+        Esegue func(*args) in un thread del pool; on_done(future) viene poi
+        chiamata nel thread del loop.
+        """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS)
+        future = self._pool.submit(func, *args)
+        if on_done is not None:
+            future.add_done_callback(lambda f: self.call_soon_threadsafe(on_done, f))
+        return future
+
+    # --- Esecuzione ---
+    def run(self):
+        self._running = True
+        self._thread_id = threading.get_ident()
+        try:
+            while self._running:
+                self._run_once()
+        finally:
+            self._running = False
+            self._thread_id = None
+
+    def stop(self):
+        self._running = False
+        self._wakeup()
+
+    def _run_once(self):
+        timeout = None
+        with self._lock:
+            if self._ready:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+
+        for key, _ in self._selector.select(timeout):
+            self._invoke(key.data, ())
+
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heapq.heappop(self._timers)[2])
+            ready, self._ready = self._ready, deque()
+
+        for callback, args in ready:
+            self._invoke(callback, args)
+        for timer in due:
+            if timer.cancelled:
+                continue
+            if timer.interval is not None:
+                self._schedule(now + timer.interval, timer)
+            self._invoke(timer.callback, timer.args)
+
+    def _invoke(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            print(f"Errore nella callback {getattr(callback, '__name__', callback)}:")
+            traceback.print_exc()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+# --- Loop condiviso nel processo ---
+_loop = None
+
+def get_event_loop():
+    global _loop
+    if _loop is None:
+        _loop = EventLoop()
+    return _loop
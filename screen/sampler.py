@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+import psutil
+
+# --- Costanti di configurazione ---
+SAMPLE_INTERVAL = 1.0   # secondi tra due campioni
+HISTORY_SIZE = 60       # campioni conservati per le sparkline
+THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+
+Sample = namedtuple('Sample', ['timestamp', 'cpu', 'cpu_per_core', 'mem', 'swap', 'load', 'temperature'])
+
+
+class RingBuffer:
+    """Ultimi 'size' valori float in un array compatto a dimensione fissa."""
+
+    def __init__(self, size):
+        self._data = array('f', bytes(4 * size))
+        self._next = 0
+        self._count = 0
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % len(self._data)
+        self._count = min(self._count + 1, len(self._data))
+
+    def values(self):
+        """Valori dal più vecchio al più recente."""
+        if self._count < len(self._data):
+            return self._data[:self._count].tolist()
+        return (self._data[self._next:] + self._data[:self._next]).tolist()
+
+
+def read_temperature():
+    try:
+        with open(THERMAL_ZONE) as f:
+            return int(f.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+class MetricsSampler:
+    """
+    Campiona CPU (anche per core), RAM, swap, load average e temperatura del
+    SoC a cadenza fissa in un thread in background.
+
+    La CPU è misurata come differenza tra due campioni consecutivi, quindi
+    nessuna lettura blocca chi la chiede; lo storico di CPU, RAM e
+    temperatura resta in ring buffer di HISTORY_SIZE elementi.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, history=HISTORY_SIZE, on_update=None):
+        self.interval = interval
+        self.on_update = on_update
+        self.cpu_history = RingBuffer(history)
+        self.mem_history = RingBuffer(history)
+        self.temp_history = RingBuffer(history)
+        self._latest = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        psutil.cpu_percent(percpu=True)
+
+    def latest(self):
+        with self._lock:
+            return self._latest
+
+    def history(self, name):
+        with self._lock:
+            return getattr(self, f'{name}_history').values()
+
+    def sample(self):
+        per_core = psutil.cpu_percent(percpu=True)
+        cpu = sum(per_core) / len(per_core) if per_core else 0.0
+        mem = psutil.virtual_memory()
+        swap = psutil.swap_memory()
+        temperature = read_temperature()
+        sample = Sample(time.time(), cpu, per_core, mem, swap, os.getloadavg(), temperature)
+
+        with self._lock:
+            self._latest = sample
+            self.cpu_history.append(cpu)
+            self.mem_history.append(mem.percent)
+            if temperature is not None:
+                self.temp_history.append(temperature)
+
+        if self.on_update:
+            self.on_update()
+        return sample
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ferma il thread; start() lo può riavviare."""
+        self._stop.set()
+        self._thread = None
+
+    def _run(self, stop):
+        while not stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Errore campionamento metriche: {e}")
@@ -0,0 +1,28 @@
+class ScreenCache:
+    """
+    Cache dei frame statici (menu, intestazioni) renderizzati una sola volta.
+
+    'theme_key' è una funzione che restituisce una tupla con tutto ciò che
+    influenza l'aspetto (colori, dimensioni, font): se cambia, la cache viene
+    svuotata e i frame vengono ridisegnati al primo uso.
+    """
+
+    def __init__(self, theme_key):
+        self._theme_key = theme_key
+        self._theme = None
+        self._frames = {}
+
+    def get(self, name, render):
+        theme = self._theme_key()
+        if theme != self._theme:
+            self._frames.clear()
+            self._theme = theme
+
+        frame = self._frames.get(name)
+        if frame is None:
+            frame = render()
+            self._frames[name] = frame
+        return frame
+
+    def clear(self):
+        self._frames.clear()
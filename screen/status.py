@@ -0,0 +1,97 @@
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from docker_api import DockerError, get_client
+import metrics
+
+# --- Costanti di configurazione ---
+POLL_INTERVAL = 5   # secondi tra due controlli
+
+# services: {nome: True (attivo) / False (non attivo) / None (errore)}
+# docker: 'ok', 'unavailable' o 'error'; containers: [(nome, stato), ...]
+StatusSnapshot = namedtuple('StatusSnapshot', ['services', 'docker', 'containers', 'timestamp'])
+
+
+def query_services(services):
+    """Stato di tutte le unità con un solo 'systemctl is-active'."""
+    try:
+        result = subprocess.run(['systemctl', 'is-active', *services],
+                                capture_output=True, text=True, timeout=5)
+        states = result.stdout.split()
+        if len(states) != len(services):
+            return {service: None for service in services}
+        return {service: state == 'active' for service, state in zip(services, states)}
+    except Exception:
+        return {service: None for service in services}
+
+def query_containers():
+    """Equivalente di 'docker ps' tramite l'API Docker sulla connessione persistente."""
+    try:
+        return 'ok', get_client().containers()
+    except (FileNotFoundError, ConnectionError, DockerError):
+        return 'unavailable', []
+    except Exception:
+        return 'error', []
+
+
+class StatusPoller:
+    """
+    Controlla periodicamente servizi systemd e container Docker in un thread
+    in background e mantiene l'ultimo risultato in uno snapshot condiviso.
+
+    Le due interrogazioni partono in parallelo; 'on_update' viene chiamata
+    solo quando lo stato cambia rispetto al controllo precedente.
+    """
+
+    def __init__(self, services, interval=POLL_INTERVAL, on_update=None):
+        self.services = list(services)
+        self.interval = interval
+        self.on_update = on_update
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=2)
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot
+
+    def poll(self):
+        with metrics.span('rpi', 'fetch', source='stato'):
+            services_future = self._pool.submit(query_services, self.services)
+            docker_future = self._pool.submit(query_containers)
+            docker_state, containers = docker_future.result()
+            snapshot = StatusSnapshot(services_future.result(), docker_state, containers, time.time())
+
+        with self._lock:
+            previous = self._snapshot
+            self._snapshot = snapshot
+
+        changed = previous is None or previous[:3] != snapshot[:3]
+        if changed and self.on_update:
+            self.on_update()
+        return snapshot
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ferma il thread; start() lo può riavviare."""
+        self._stop.set()
+        self._thread = None
+
+    def _run(self, stop):
+        while not stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Errore controllo servizi: {e}")
+            stop.wait(self.interval)
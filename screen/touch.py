@@ -0,0 +1,173 @@
+import json
+import os
+import time
+from collections import namedtuple
+
+from evdev import InputDevice, ecodes
+
+# --- Costanti di configurazione ---
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'touch_calibration.json')
+FALLBACK_RAW_MAX = 4095
+
+DEBOUNCE = 0.15         # secondi: pressioni così vicine al rilascio precedente sono rimbalzi
+LONG_PRESS = 0.8        # secondi di pressione per un long-press
+SWIPE_DISTANCE = 60     # pixel di spostamento minimo per uno swipe
+MAX_EVENT_AGE = 1.0     # secondi: eventi rimasti in coda più a lungo (app sospesa o bloccata) vengono scartati
+
+# kind: 'tap', 'long_press', 'swipe_left', 'swipe_right', 'swipe_up', 'swipe_down'
+# (x, y) è il punto di pressione in pixel, (dx, dy) lo spostamento fino al rilascio
+Gesture = namedtuple('Gesture', ['kind', 'x', 'y', 'dx', 'dy', 'duration'])
+
+
+class Calibration:
+    """
+    Trasformazione affine precalcolata dalle coordinate raw del touch ai pixel:
+
+        x = a * raw_x + b * raw_y + c
+        y = d * raw_x + e * raw_y + f
+
+    Il file di calibrazione è un JSON del tipo {"matrix": [a, b, c, d, e, f]}.
+    In sua assenza si usa lo scambio di assi del pannello montato sul Pi.
+    """
+
+    def __init__(self, matrix, width, height):
+        self.a, self.b, self.c, self.d, self.e, self.f = (float(v) for v in matrix)
+        self.max_x = width - 1
+        self.max_y = height - 1
+
+    @classmethod
+    def default(cls, max_raw_x, max_raw_y, width, height):
+        return cls((0, -width / max_raw_y, width, height / max_raw_x, 0, 0), width, height)
+
+    @classmethod
+    def load(cls, max_raw_x, max_raw_y, width, height, path=CALIBRATION_FILE):
+        try:
+            with open(path) as f:
+                matrix = json.load(f)['matrix']
+            print(f"Calibrazione touch caricata da {path}")
+            return cls(matrix, width, height)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Avviso: file di calibrazione {path} non valido ({e}). Uso la calibrazione di default.")
+        return cls.default(max_raw_x, max_raw_y, width, height)
+
+    def map(self, raw_x, raw_y):
+        x = int(self.a * raw_x + self.b * raw_y + self.c)
+        y = int(self.d * raw_x + self.e * raw_y + self.f)
+        return max(0, min(self.max_x, x)), max(0, min(self.max_y, y))
+
+
+class TouchTracker:
+    """
+    Macchina a stati pressione/movimento/rilascio sugli eventi evdev.
+
+    Le coordinate vengono lette alla fine di ogni report (SYN_REPORT), così
+    la pressione usa la posizione reale del tocco e non quella del tocco
+    precedente. Il gesto viene riconosciuto al primo rilascio e passato a
+    on_gesture(Gesture).
+    """
+
+    def __init__(self, calibration, on_gesture, clock=time.monotonic):
+        self.calibration = calibration
+        self.on_gesture = on_gesture
+        self.clock = clock
+        self._raw_x = 0
+        self._raw_y = 0
+        self._button = None       # ultimo valore di BTN_TOUCH non ancora elaborato
+        self._pressed = False
+        self._ignored = False     # pressione scartata dal debounce
+        self._start = None
+        self._last = None
+        self._press_time = 0
+        self._release_time = float('-inf')
+
+    def read(self, device):
+        """Elabora gli eventi disponibili sul dispositivo (da usare come reader del loop)."""
+        try:
+            events = list(device.read())
+        except BlockingIOError:
+            return
+        oldest = time.time() - MAX_EVENT_AGE
+        fresh = [event for event in events if event.timestamp() >= oldest]
+        if len(fresh) < len(events):
+            # Scartare solo una parte di un gesto (es. il rilascio) lascerebbe una pressione
+            # appesa: si riparte da zero e si elaborano solo gli eventi recenti
+            self.reset()
+        for event in fresh:
+            self.feed(event)
+
+    def reset(self):
+        """Dimentica il gesto in corso (pressione, pulsante e coordinate raw)."""
+        self._raw_x = 0
+        self._raw_y = 0
+        self._button = None
+        self._pressed = False
+        self._ignored = False
+        self._start = None
+        self._last = None
+
+    def feed(self, event):
+        if event.type == ecodes.EV_ABS:
+            if event.code == ecodes.ABS_X:
+                self._raw_x = event.value
+            elif event.code == ecodes.ABS_Y:
+                self._raw_y = event.value
+        elif event.type == ecodes.EV_KEY and event.code == ecodes.BTN_TOUCH:
+            self._button = event.value
+        elif event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+            self._sync()
+
+    def _sync(self):
+        now = self.clock()
+        position = self.calibration.map(self._raw_x, self._raw_y)
+        button, self._button = self._button, None
+
+        if button == 1 and not self._pressed:
+            self._pressed = True
+            self._ignored = now - self._release_time < DEBOUNCE
+            self._start = self._last = position
+            self._press_time = now
+        elif button == 0 and self._pressed:
+            self._pressed = False
+            self._release_time = now
+            if not self._ignored:
+                self.on_gesture(self._classify(now))
+        elif self._pressed:
+            self._last = position
+
+    def _classify(self, now):
+        x, y = self._start
+        dx = self._last[0] - x
+        dy = self._last[1] - y
+        duration = now - self._press_time
+
+        if max(abs(dx), abs(dy)) >= SWIPE_DISTANCE:
+            if abs(dx) >= abs(dy):
+                kind = 'swipe_right' if dx > 0 else 'swipe_left'
+            else:
+                kind = 'swipe_down' if dy > 0 else 'swipe_up'
+        elif duration >= LONG_PRESS:
+            kind = 'long_press'
+        else:
+            kind = 'tap'
+        return Gesture(kind, x, y, dx, dy, duration)
+
+
+def open_touchscreen(device_path, width, height, on_gesture):
+    """Apre il touchscreen e restituisce (device, tracker) con la calibrazione caricata."""
+    device = InputDevice(device_path)
+
+    try:
+        max_raw_x = device.absinfo(ecodes.ABS_X).max
+        max_raw_y = device.absinfo(ecodes.ABS_Y).max
+    except KeyError:
+        print(f"Avviso: Impossibile ottenere absinfo. Uso valori di fallback ({FALLBACK_RAW_MAX}).")
+        max_raw_x = FALLBACK_RAW_MAX
+        max_raw_y = FALLBACK_RAW_MAX
+
+    if max_raw_x == 0 or max_raw_y == 0:
+        raise ValueError("I valori massimi del touchscreen non sono validi (0).")
+
+    calibration = Calibration.load(max_raw_x, max_raw_y, width, height)
+    return device, TouchTracker(calibration, on_gesture)
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import mmap
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from framebuffer import display_mode
+import metrics
+
+# --- Costanti di configurazione ---
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'video_cache')
+CACHE_BUDGET = 8 << 30          # byte massimi occupati dai video su disco (8 GiB)
+MAX_VIDEO_FRACTION = 0.25       # un singolo video non può occupare più di questa frazione del budget
+CACHE_FPS = 24                  # i frame grezzi pesano ~300 KB l'uno (480x320, 16 bpp): 24 fps bastano sul pannello
+FAILURE_TTL = 24 * 3600         # per quanto non si riprova la conversione di un video fallita o troppo lunga
+VIDEO_SUFFIX = '.raw'           # frame grezzi nel formato indicato da 'pix_fmt' nel JSON
+META_SUFFIX = '.json'
+FAILED_SUFFIX = '.failed'
+
+CachedVideo = namedtuple('CachedVideo', 'path fps frames')
+
+
+class VideoCache:
+    """
+    Cache locale dei video della playlist, già pronti per il pannello:
+    frame grezzi nel formato di 'mode' (ruotati e scalati da ffmpeg con
+    'filters') uno dopo l'altro in un file, più un JSON con fps, numero
+    di frame e formato dei pixel.
+
+    request() mette in coda la conversione, che un thread esegue un video
+    alla volta con ffmpeg a priorità minima; lookup() restituisce i video
+    pronti, che si riproducono con play_cached() leggendo il file via mmap.
+    La sorgente può essere un URL di streaming o un file locale. Oltre
+    'budget' byte si eliminano i video usati meno di recente. I video che
+    non si convertono (o che non starebbero nella loro quota di budget) si
+    segnano su disco e non si riprovano per FAILURE_TTL secondi.
+    """
+
+    def __init__(self, filters, directory=CACHE_DIR, budget=CACHE_BUDGET, fps=CACHE_FPS, mode=None):
+        self.filters = f'fps={fps},{filters}'
+        self.directory = directory
+        self.budget = budget
+        self.fps = fps
+        self.mode = mode or display_mode()
+        self.frame_size = self.mode.frame_size
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._process = None
+        self._closed = False
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _base(self, video_url):
+        # I filtri fanno parte della chiave: cambiando profilo i vecchi file escono per LRU
+        key = hashlib.sha1(f"{video_url}\0{self.filters}".encode()).hexdigest()
+        return os.path.join(self.directory, key)
+
+    def lookup(self, video_url):
+        """CachedVideo pronto per 'video_url' (e lo segna come usato), oppure None."""
+        base = self._base(video_url)
+        try:
+            with open(base + META_SUFFIX) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Un video convertito per un altro pannello non si riproduce: si riconverte
+        if (meta.get('pix_fmt'), meta.get('width'), meta.get('height')) != \
+                (self.mode.pix_fmt, self.mode.width, self.mode.height):
+            return None
+        try:
+            os.utime(base + META_SUFFIX)
+        except OSError:
+            return None
+        return CachedVideo(base + VIDEO_SUFFIX, meta['fps'], meta['frames'])
+
+    def max_bytes(self):
+        """Byte massimi di un singolo video."""
+        return int(self.budget * MAX_VIDEO_FRACTION)
+
+    def fits(self, duration):
+        """Falso se un video di 'duration' secondi supererebbe la quota di un singolo video."""
+        return duration * self.fps * self.frame_size <= self.max_bytes()
+
+    def failed(self, video_url):
+        """Vero se la conversione di 'video_url' è fallita da meno di FAILURE_TTL secondi."""
+        path = self._base(video_url) + FAILED_SUFFIX
+        try:
+            with open(path) as f:
+                until = json.load(f)['until']
+        except (OSError, ValueError, KeyError):
+            return False
+        if until > time.time():
+            return True
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+    def request(self, video_url, source, duration=None):
+        """
+        Mette in coda la conversione di 'source' (URL di streaming o file) se
+        il video non è già pronto. Con 'duration' (secondi, se nota) i video
+        troppo lunghi per la cache si scartano senza scaricarli.
+        """
+        with self._lock:
+            if self._closed or video_url in self._queued or self.failed(video_url):
+                return
+            if self.lookup(video_url) is not None:
+                return
+            if duration is not None and not self.fits(duration):
+                self._mark_failed(video_url, f"video troppo lungo ({duration:.0f} s)")
+                return
+            self._queued.add(video_url)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put((video_url, source))
+
+    def close(self):
+        """Ferma il thread di conversione, interrompendo l'eventuale ffmpeg in corso."""
+        with self._lock:
+            self._closed = True
+            process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            video_url, source = item
+            try:
+                self.transcode(video_url, source)
+            finally:
+                with self._lock:
+                    self._queued.discard(video_url)
+
+    def transcode(self, video_url, source):
+        """Converte 'source' nel formato del pannello; True se il video è ora in cache."""
+        base = self._base(video_url)
+        temp = base + VIDEO_SUFFIX + '.tmp'
+        max_bytes = self.max_bytes()
+        cmd = [
+            'nice', '-n', '19',
+            'ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error', '-y',
+            '-i', source,
+            '-an', '-sn', '-dn',
+            '-vf', self.filters,
+            '-f', 'rawvideo', '-pix_fmt', self.mode.pix_fmt,
+            '-fs', str(max_bytes),
+            temp,
+        ]
+        print(f"-> Conversione in cache di {video_url}...")
+        started = time.monotonic()
+        with self._lock:
+            if self._closed:
+                return False
+            self._process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            process = self._process
+        _, errors = process.communicate()
+        with self._lock:
+            self._process = None
+        metrics.observe('yt', 'transcode', time.monotonic() - started)
+
+        size = os.path.getsize(temp) if os.path.exists(temp) else 0
+        if process.returncode != 0 or size == 0 or size + self.frame_size > max_bytes:
+            if os.path.exists(temp):
+                os.remove(temp)
+            if self._closed:
+                return False
+            reason = 'video troppo lungo' if size + self.frame_size > max_bytes else errors.decode(errors='replace').strip()
+            with self._lock:
+                self._mark_failed(video_url, reason)
+            return False
+
+        frames = size // self.frame_size
+        os.replace(temp, base + VIDEO_SUFFIX)
+        # Il JSON si scrive per ultimo: la sua presenza indica un video completo
+        with open(base + META_SUFFIX + '.tmp', 'w') as f:
+            json.dump({'url': video_url, 'fps': self.fps, 'frames': frames, 'pix_fmt': self.mode.pix_fmt,
+                       'width': self.mode.width, 'height': self.mode.height}, f)
+        os.replace(base + META_SUFFIX + '.tmp', base + META_SUFFIX)
+        print(f"-> {video_url} in cache: {frames} frame, {size / (1 << 20):.0f} MB "
+              f"in {time.monotonic() - started:.0f} s")
+        self.evict()
+        return True
+
+    def _mark_failed(self, video_url, reason):
+        """Segna su disco il fallimento di 'video_url' per FAILURE_TTL secondi."""
+        print(f"Conversione di {video_url} fallita: {reason}", file=sys.stderr)
+        path = self._base(video_url) + FAILED_SUFFIX
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'url': video_url, 'reason': reason, 'until': time.time() + FAILURE_TTL}, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Impossibile segnare il fallimento di {video_url}: {e}", file=sys.stderr)
+
+    def size(self):
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self):
+        """Elimina i video usati meno di recente finché si torna sotto il budget."""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, base, size in entries:
+            if total <= self.budget:
+                break
+            for suffix in (META_SUFFIX, VIDEO_SUFFIX):
+                try:
+                    os.remove(base + suffix)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def _entries(self):
+        """(ultimo uso, percorso senza estensione, dimensione) dei video completi."""
+        entries = []
+        with os.scandir(self.directory) as files:
+            for entry in files:
+                if not entry.name.endswith(META_SUFFIX):
+                    continue
+                base = entry.path[:-len(META_SUFFIX)]
+                try:
+                    entries.append((entry.stat().st_mtime_ns, base, os.path.getsize(base + VIDEO_SUFFIX)))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+
+def play_cached(video, fb, stop_event=None):
+    """
+    Riproduce un video della cache: il file è mappato in memoria e a ogni
+    istante si copia sul display il frame che corrisponde al tempo trascorso
+    (se il display è lento si saltano frame, senza accumulare ritardo).
+    Restituisce le statistiche come play_video_to_framebuffer().
+    """
+    frame_size = fb.frame_size
+    stats = {'profile': 'cache', 'shown': 0, 'dropped': 0, 'resyncs': 0, 'write_total': 0.0,
+             'write_max': 0.0, 'elapsed': 0.0, 'cpu': None, 'fps': video.fps, 'input': 'file locale'}
+    wait = stop_event.wait if stop_event is not None else time.sleep
+    with open(video.path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+    if hasattr(data, 'madvise'):
+        data.madvise(mmap.MADV_SEQUENTIAL)
+    view = memoryview(data)
+    frames = min(video.frames, len(data) // frame_size)
+    try:
+        start = time.monotonic()
+        last = -1
+        while stop_event is None or not stop_event.is_set():
+            number = int((time.monotonic() - start) * video.fps)
+            if number >= frames:
+                break
+            stats['dropped'] += max(0, number - last - 1)
+            written = time.monotonic()
+            fb.blit(view[number * frame_size:(number + 1) * frame_size])
+            written = time.monotonic() - written
+            metrics.observe('yt', 'frame_write', written, source='cache')
+            stats['shown'] += 1
+            stats['write_total'] += written
+            stats['write_max'] = max(stats['write_max'], written)
+            last = number
+            delay = start + (number + 1) / video.fps - time.monotonic()
+            if delay > 0:
+                wait(delay)
+        stats['elapsed'] = time.monotonic() - start
+    finally:
+        view.release()
+        data.close()
+    return stats
@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 import subprocess
-import os
+import re
 import sys
+import threading
+import time
+from collections import deque
 import numpy as np
+import psutil
+
+from framebuffer import get_framebuffer, display_mode
+from apphost import App
+import metrics
+from ytresolve import StreamResolver, resolved_streams
+from videocache import VideoCache, play_cached
 
 NUM_VIDS = 10
 VIDEO_URL = [
@@ -18,46 +28,128 @@ VIDEO_URL = [
   "https://youtu.be/OemrJrhZuOw"
 ]
 
-FRAMEBUFFER_DEV = "/dev/fb1"
+# Geometria e formato dei pixel del display configurato (SCREEN_DISPLAY, sysfs)
+DISPLAY_MODE = display_mode()
+FB_WIDTH, FB_HEIGHT = DISPLAY_MODE.width, DISPLAY_MODE.height
+PIXEL_FORMAT = DISPLAY_MODE.pix_fmt
+
+# Profili di riproduzione: 'format' è il selettore di yt-dlp, 'scaler' l'algoritmo
+# di ridimensionamento di ffmpeg. 'leggero' prende lo stream più piccolo che copre
+# ancora il pannello, preferendo H.264 (avc1), molto più economico da decodificare
+# di VP9/AV1; i fallback evitano di restare senza video se quel formato manca.
+PLAYBACK_PROFILES = {
+    'leggero': {
+        'format': (f'worstvideo[width>={FB_WIDTH}][height>={FB_HEIGHT}][vcodec^=avc1]'
+                   f'/worstvideo[width>={FB_WIDTH}][height>={FB_HEIGHT}]/bestvideo'),
+        'scaler': 'fast_bilinear',
+    },
+    'qualita': {
+        'format': 'bestvideo[height<=720][vcodec^=avc1]/bestvideo[height<=720]/bestvideo',
+        'scaler': 'bicubic',
+    },
+    'originale': {
+        'format': 'bestvideo',
+        'scaler': 'bicubic',
+    },
+}
+PLAYBACK_PROFILE = 'leggero'
+PROFILE_TEST_SECONDS = 20     # durata della prova di ogni profilo (python3 yt.py --profili)
+PROFILE_FLAG = '--profili'
+
+# Cache locale (vedi videocache.py): ogni video, dopo la prima riproduzione in
+# streaming, viene convertito in background in frame già pronti per il pannello;
+# dal giro successivo si riproduce dal disco senza rete né decodifica.
+USE_VIDEO_CACHE = True
+PRELOAD_FLAG = '--precarica'   # python3 yt.py --precarica FILE [URL]: riempie la cache da un file locale
 
-FB_WIDTH = 480
-FB_HEIGHT = 320
+DEFAULT_FPS = 30     # se ffmpeg non indica il frame rate del video
+RESYNC_AFTER = 1.0   # ritardo (s) oltre il quale si riallinea l'orologio invece di scartare frame
 
-PIXEL_FORMAT = "rgb565" 
-BYTES_PER_PIXEL = 2      
+_FPS_PATTERN = re.compile(r'Video:.*?, (\d+(?:\.\d+)?) fps')
+_INPUT_PATTERN = re.compile(r'Video: (\w+).*?, (\d+x\d+)')
 
 # --- Funzioni ---
 
-def get_youtube_stream_url(youtube_url):
-    """Usa yt-dlp per ottenere l'URL diretto del flusso video."""
-    print("-> Ottenimento dell'URL di streaming con yt-dlp...")
-    try:
-        cmd = ['yt-dlp', '-f', 'bestvideo', '-g', youtube_url]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"Errore nell'esecuzione di yt-dlp: {e.stderr}", file=sys.stderr)
-        sys.exit(1)
+def read_frame(pipe, view):
+    """Riempie 'view' leggendo da 'pipe' (anche a più riprese); False a fine video."""
+    filled = 0
+    while filled < len(view):
+        count = pipe.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
 
-def play_video_to_framebuffer(stream_url):
-    """Decodifica il video con ffmpeg e scrive su /dev/fb1."""
-    print(f"-> Apertura del framebuffer {FRAMEBUFFER_DEV}...")
-    fb = None 
+def watch_ffmpeg_log(pipe, info):
+    """
+    Legge lo stderr di ffmpeg: ricava frame rate, codec e risoluzione del
+    video in ingresso (info['fps'], info['input']) e tiene le ultime righe
+    per i messaggi di errore (info['log']).
+    """
+    for raw_line in pipe:
+        line = raw_line.decode(errors='replace').rstrip()
+        info['log'].append(line)
+        if 'fps' not in info:
+            match = _FPS_PATTERN.search(line)
+            if match:
+                info['fps'] = float(match.group(1))
+                match = _INPUT_PATTERN.search(line)
+                if match:
+                    info['input'] = f"{match.group(1)} {match.group(2)}"
+                info['ready'].set()
+    info['ready'].set()
 
+def open_display():
+    """Il display configurato; se non si apre (dispositivo assente, permessi) si esce."""
+    print(f"-> Apertura del display ({DISPLAY_MODE.width}x{DISPLAY_MODE.height}, {DISPLAY_MODE.pix_fmt})...")
     try:
-        fb = os.open(FRAMEBUFFER_DEV, os.O_WRONLY)
+        return get_framebuffer()
     except OSError as e:
-        print(f"ERRORE: Impossibile aprire {FRAMEBUFFER_DEV}. Controlla i permessi: {e}", file=sys.stderr)
+        print(f"ERRORE: Impossibile aprire il display. Controlla dispositivo e permessi: {e}", file=sys.stderr)
         sys.exit(1)
 
-    print(f"-> Avvio della decodifica con ffmpeg...")
+def process_cpu_seconds(pid):
+    """CPU (utente + sistema) consumata finora dal processo, anche se è già terminato ma non raccolto."""
+    try:
+        times = psutil.Process(pid).cpu_times()
+        return times.user + times.system
+    except psutil.Error:
+        return None
+
+def video_filters(profile):
+    """
+    Catena di filtri di ffmpeg: una sola scalatura (con conversione diretta
+    nel formato del pannello) e poi la rotazione di 180° come hflip + vflip sul frame già
+    piccolo; vflip non copia nulla, inverte solo il passo delle righe.
+    """
+    scaler = PLAYBACK_PROFILES[profile]['scaler']
+    return (f'scale={FB_WIDTH}:{FB_HEIGHT}:flags={scaler}:in_range=mpeg,'
+            f'format={PIXEL_FORMAT},hflip,vflip')
+
+def play_video_to_framebuffer(stream_url, fb=None, stop_event=None, profile=PLAYBACK_PROFILE, pace=True):
+    """
+    Decodifica il video con ffmpeg e scrive sul display configurato (o su
+    'fb', se passato). Se 'stop_event' viene impostato la riproduzione si interrompe
+    al frame successivo.
 
-    video_filters = f'scale={FB_WIDTH}:{FB_HEIGHT}:in_range=mpeg,transpose=2,transpose=2'
+    I frame arrivano con readinto() in un unico buffer riusato (nessuna
+    allocazione per frame) e vengono mostrati al ritmo del video: il frame
+    N esce a N / fps secondi dal primo, quelli già in ritardo di un intero
+    frame vengono scartati. Con pace=False i frame si scrivono appena
+    arrivano (misura degli fps raggiungibili). Restituisce le statistiche
+    della riproduzione, compresa la CPU usata da ffmpeg.
+    """
+    if fb is None:
+        fb = open_display()
+
+    print(f"-> Avvio della decodifica con ffmpeg...")
 
     ffmpeg_cmd = [
         'ffmpeg',
+        '-hide_banner', '-nostats',
         '-i', stream_url,
-        '-vf', video_filters, 
+        '-an', '-sn', '-dn',
+        '-vf', video_filters(profile), 
         '-f', 'rawvideo',
         '-pix_fmt', PIXEL_FORMAT, 
         '-s', f'{FB_WIDTH}x{FB_HEIGHT}',
@@ -65,21 +157,64 @@ def play_video_to_framebuffer(stream_url):
     ]
 
     ffmpeg_proc = None 
+    info = {'log': deque(maxlen=5), 'ready': threading.Event()}
+    stats = {'profile': profile, 'shown': 0, 'dropped': 0, 'resyncs': 0,
+             'write_total': 0.0, 'write_max': 0.0, 'elapsed': 0.0, 'cpu': None}
 
     try:
-        frame_size = FB_WIDTH * FB_HEIGHT * BYTES_PER_PIXEL
+        frame_size = DISPLAY_MODE.frame_size
         print(f"-> Streaming a {FB_WIDTH}x{FB_HEIGHT} con {PIXEL_FORMAT} (dimensione frame: {frame_size} bytes)...")
 
-        ffmpeg_proc = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, bufsize=frame_size)
+        ffmpeg_proc = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+        threading.Thread(target=watch_ffmpeg_log, args=(ffmpeg_proc.stderr, info), daemon=True).start()
+
+        frame = bytearray(frame_size)
+        view = memoryview(frame)
+        wait = stop_event.wait if stop_event is not None else time.sleep
+        fps = None
+        start = None
+        number = 0
+
+        while stop_event is None or not stop_event.is_set():
+            with metrics.span('yt', 'frame_read'):
+                if not read_frame(ffmpeg_proc.stdout, view):
+                    break
+
+            now = time.monotonic()
+            if start is None:
+                # ffmpeg stampa le informazioni sugli stream prima del primo frame
+                info['ready'].wait(0.5)
+                fps = info.get('fps', DEFAULT_FPS)
+                start = now
+            due = start + number / fps
+            number += 1
 
-        while True:
-            raw_frame = ffmpeg_proc.stdout.read(frame_size)
+            late = now - due
+            if not pace:
+                pass
+            elif late > RESYNC_AFTER:
+                # Pausa lunga (rete, buffering): si riparte da qui invece di scartare secondi di video
+                start += late
+                stats['resyncs'] += 1
+            elif late > 1 / fps:
+                stats['dropped'] += 1
+                continue
+            elif late < 0:
+                wait(-late)
 
-            if not raw_frame or len(raw_frame) != frame_size:
-                break
+            written = time.monotonic()
+            fb.blit(frame)
+            written = time.monotonic() - written
+            metrics.observe('yt', 'frame_write', written, source='stream')
+            stats['shown'] += 1
+            stats['write_total'] += written
+            stats['write_max'] = max(stats['write_max'], written)
 
-            os.lseek(fb, 0, os.SEEK_SET) 
-            os.write(fb, raw_frame)
+        if start is not None:
+            stats['elapsed'] = time.monotonic() - start
+        stats['fps'] = fps
+        stats['input'] = info.get('input')
+        stats['cpu'] = process_cpu_seconds(ffmpeg_proc.pid)
 
     except KeyboardInterrupt:
         print("\nInterrotto dall'utente.")
@@ -89,20 +224,177 @@ def play_video_to_framebuffer(stream_url):
         if ffmpeg_proc and ffmpeg_proc.poll() is None:
             ffmpeg_proc.terminate()
             ffmpeg_proc.wait()
-        if fb:
-            os.close(fb)
-            print("Fatto. Framebuffer chiuso.")
+        elif ffmpeg_proc and ffmpeg_proc.returncode:
+            print(f"ffmpeg terminato con codice {ffmpeg_proc.returncode}:", file=sys.stderr)
+            for line in info['log']:
+                print(f"   {line}", file=sys.stderr)
+        report_playback(stats)
+        print("Fatto.")
+    return stats
+
+def report_playback(stats):
+    if not stats['shown']:
+        return
+    achieved = stats['shown'] / stats['elapsed'] if stats['elapsed'] else 0
+    print(f"-> {stats['shown']} frame mostrati a {achieved:.1f} fps (video: {stats.get('fps') or 0:g} fps), "
+          f"{stats['dropped']} scartati, {stats['resyncs']} riallineamenti; scrittura frame "
+          f"media {stats['write_total'] / stats['shown'] * 1000:.2f} ms, massima {stats['write_max'] * 1000:.2f} ms")
+    if stats['cpu'] is not None and stats['elapsed']:
+        print(f"-> Profilo '{stats['profile']}' ({stats.get('input') or 'ingresso sconosciuto'}): "
+              f"CPU ffmpeg {stats['cpu'] / stats['elapsed'] * 100:.0f}% di un core, "
+              f"{stats['cpu'] / (stats['shown'] + stats['dropped']) * 1000:.1f} ms per frame")
+
+class NullDisplay:
+    """Display che scarta i frame: misura la sola decodifica."""
+
+    def blit(self, *args, **kwargs):
+        return True
+
+def compare_profiles(video_url=VIDEO_URL[0], seconds=PROFILE_TEST_SECONDS):
+    """
+    Decodifica 'video_url' per 'seconds' secondi con ogni profilo, alla
+    massima velocità e senza scrivere sul pannello, e riassume CPU di
+    ffmpeg e fps raggiungibili.
+    """
+    results = []
+    for profile, settings in PLAYBACK_PROFILES.items():
+        print(f"\n=== Profilo '{profile}' ===")
+        resolver = StreamResolver(stream_format=settings['format'], cache_file=None)
+        stream_url = resolver.get(video_url)
+        resolver.close()
+        if stream_url is None:
+            continue
+        stop = threading.Event()
+        timer = threading.Timer(seconds, stop.set)
+        timer.start()
+        results.append(play_video_to_framebuffer(stream_url, NullDisplay(), stop, profile, pace=False))
+        timer.cancel()
+
+    print(f"\n{'profilo':<10} {'ingresso':<18} {'fps':>7} {'CPU %':>6} {'ms/frame':>9}")
+    for stats in results:
+        if not stats['shown'] or not stats['elapsed'] or stats['cpu'] is None:
+            print(f"{stats['profile']:<10} nessun frame decodificato")
+            continue
+        print(f"{stats['profile']:<10} {stats.get('input') or '?':<18} "
+              f"{stats['shown'] / stats['elapsed']:>7.1f} {stats['cpu'] / stats['elapsed'] * 100:>6.0f} "
+              f"{stats['cpu'] / stats['shown'] * 1000:>9.1f}")
+
+def open_video_cache(profile=PLAYBACK_PROFILE):
+    """Cache locale dei video per 'profile', oppure None se disattivata o non disponibile."""
+    if not USE_VIDEO_CACHE:
+        return None
+    try:
+        return VideoCache(video_filters(profile), mode=DISPLAY_MODE)
+    except OSError as e:
+        print(f"Cache dei video non disponibile: {e}", file=sys.stderr)
+        return None
+
+def play_entry(video_url, stream_url, fb=None, stop_event=None, profile=PLAYBACK_PROFILE, video_cache=None,
+               duration=None):
+    """
+    Riproduce un video della playlist: dalla cache locale se è pronto,
+    altrimenti in streaming, mettendolo poi in coda per la conversione
+    (se la sua durata, quando nota, ci sta nella cache).
+    """
+    cached = video_cache.lookup(video_url) if video_cache is not None else None
+    if cached is not None:
+        print(f"-> Riproduzione di {video_url} dalla cache locale")
+        if fb is None:
+            fb = open_display()
+        report_playback(play_cached(cached, fb, stop_event))
+        return
+    if stream_url is None:
+        # Uscito dalla cache tra la scelta del video e la riproduzione: lo si salta
+        return
+    play_video_to_framebuffer(stream_url, fb, stop_event, profile)
+    if video_cache is not None and (stop_event is None or not stop_event.is_set()):
+        video_cache.request(video_url, stream_url, duration)
+
+def preload_video(source, video_url=VIDEO_URL[0], profile=PLAYBACK_PROFILE):
+    """Converte il file locale 'source' nella cache come se fosse il video 'video_url'."""
+    VideoCache(video_filters(profile), mode=DISPLAY_MODE).transcode(video_url, source)
+
+def needs_stream(video_cache):
+    """Predicato per resolved_streams(): serve yt-dlp solo per i video non ancora in cache."""
+    if video_cache is None:
+        return None
+    return lambda video_url: video_cache.lookup(video_url) is None
 
 def main():
-    if not os.path.exists(FRAMEBUFFER_DEV):
-        print(f"Errore: Il dispositivo framebuffer {FRAMEBUFFER_DEV} non esiste.", file=sys.stderr)
-        sys.exit(1)
+    metrics.start_exporter('yt')
+    open_display()
+
+    # L'URL del video successivo si risolve mentre si riproduce quello corrente;
+    # i video che yt-dlp non riesce a risolvere vengono saltati
+    resolver = StreamResolver(stream_format=PLAYBACK_PROFILES[PLAYBACK_PROFILE]['format'])
+    video_cache = open_video_cache()
+    for _, video_url, stream_url in resolved_streams(VIDEO_URL[:NUM_VIDS], resolver, repeat=False,
+                                                     needs_stream=needs_stream(video_cache)):
+        play_entry(video_url, stream_url, video_cache=video_cache, duration=resolver.duration(video_url))
+    resolver.close()
+    if video_cache is not None:
+        video_cache.close()
+
+
+class YouTubeApp(App):
+    """
+    Riproduzione ospitata dal manager: un thread legge i frame da ffmpeg
+    scrivendoli sul display concesso dall'host, mentre StreamResolver
+    risolve già l'URL del video successivo; i video già convertiti nella
+    VideoCache si leggono dal disco. Sospendere l'app ferma la riproduzione;
+    alla ripresa il video corrente riparte da capo (l'URL è in cache).
+    """
+
+    name = 'yt'
+
+    def __init__(self, urls=VIDEO_URL, profile=PLAYBACK_PROFILE):
+        super().__init__()
+        self.urls = list(urls)
+        self.profile = profile
+        self._index = 0
+        self._stop = None
+        self._resolver = None
+        self._video_cache = None
+
+    def start(self):
+        self._resolver = StreamResolver(stream_format=PLAYBACK_PROFILES[self.profile]['format'])
+        self._video_cache = open_video_cache(self.profile)
+        self.resume()
+
+    def resume(self):
+        self.display.clear()
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, args=(self._stop,), daemon=True).start()
+
+    def suspend(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def stop(self):
+        self.suspend()
+        if self._resolver is not None:
+            self._resolver.close()
+        if self._video_cache is not None:
+            self._video_cache.close()
 
-    for i in range(NUM_VIDS):
-        stream_url = get_youtube_stream_url(VIDEO_URL[i])
-        play_video_to_framebuffer(stream_url)
+    def _run(self, stop):
+        for index, video_url, stream_url in resolved_streams(self.urls, self._resolver, self._index, stop_event=stop,
+                                                             needs_stream=needs_stream(self._video_cache)):
+            self._index = index
+            play_entry(video_url, stream_url, self.display, stop, self.profile, self._video_cache,
+                       self._resolver.duration(video_url))
+            if stop.is_set():
+                return
 
 # --- Esecuzione principale ---
 
 if __name__ == "__main__":
-    main()
+    if PROFILE_FLAG in sys.argv[1:]:
+        args = [arg for arg in sys.argv[1:] if arg != PROFILE_FLAG]
+        compare_profiles(*args[:1])
+    elif PRELOAD_FLAG in sys.argv[1:]:
+        args = [arg for arg in sys.argv[1:] if arg != PRELOAD_FLAG]
+        preload_video(*args[:2])
+    else:
+        main()
@@ -0,0 +1,229 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# --- Costanti di configurazione ---
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yt_url_cache.json')
+YTDLP_COMMAND = ['yt-dlp']   # comando (e opzioni fisse) di yt-dlp; sostituibile con uno stub nei test
+STREAM_FORMAT = 'bestvideo'
+RESOLVE_TIMEOUT = 60         # secondi massimi per una singola chiamata a yt-dlp
+URL_TTL = 4 * 3600           # durata massima di un URL in cache (YouTube li fa scadere dopo ~6 ore)
+EXPIRY_MARGIN = 600          # margine prima della scadenza indicata nell'URL stesso (expire=...)
+FAILURE_TTL = 300            # per quanto non si riprova un video che yt-dlp non è riuscito a risolvere
+RETRY_DELAY = 5              # attesa quando nessun video della playlist è risolvibile
+LOOKAHEAD = 2                # video successivi da risolvere in anticipo (così un fallimento non lascia buchi)
+
+_EXPIRE_PATTERN = re.compile(r'[?&/]expire[=/](\d+)')
+
+
+def url_expiry(stream_url, now, ttl=URL_TTL):
+    """Istante (time.time()) oltre il quale l'URL di streaming non va più usato."""
+    match = _EXPIRE_PATTERN.search(stream_url)
+    if match:
+        return min(now + ttl, int(match.group(1)) - EXPIRY_MARGIN)
+    return now + ttl
+
+
+class StreamResolver:
+    """
+    Risolve gli URL YouTube in URL di streaming diretti con yt-dlp, insieme
+    alla durata del video (se yt-dlp la conosce).
+
+    I risultati restano in cache (in memoria e in 'cache_file', così
+    sopravvivono ai riavvii) fino alla loro scadenza; i fallimenti vengono
+    ricordati per FAILURE_TTL secondi in sola memoria. prefetch() avvia la
+    risoluzione in background, get() attende il risultato: chiamando
+    prefetch() sul video successivo mentre si riproduce quello corrente,
+    il cambio video non aspetta più yt-dlp.
+    """
+
+    def __init__(self, command=YTDLP_COMMAND, stream_format=STREAM_FORMAT, cache_file=CACHE_FILE,
+                 ttl=URL_TTL, timeout=RESOLVE_TIMEOUT):
+        self.command = list(command)
+        self.stream_format = stream_format
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._cache = self._load()
+        self._failures = {}
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ytresolve')
+
+    def _key(self, video_url):
+        # Il formato fa parte della chiave: cambiandolo non si usano URL risolti con quello vecchio
+        return f"{self.stream_format} {video_url}"
+
+    def cached(self, video_url):
+        """URL di streaming ancora valido in cache, oppure None."""
+        with self._lock:
+            entry = self._cache.get(self._key(video_url))
+        if entry is not None and entry['expires'] > time.time():
+            return entry['url']
+        return None
+
+    def duration(self, video_url):
+        """Durata in secondi di 'video_url' dall'ultima risoluzione ancora valida, oppure None."""
+        with self._lock:
+            entry = self._cache.get(self._key(video_url))
+        if entry is not None and entry['expires'] > time.time():
+            return entry.get('duration')
+        return None
+
+    def prefetch(self, video_url):
+        """Avvia in background la risoluzione di 'video_url' (se non è già in cache o in corso)."""
+        with self._lock:
+            future = self._pending.get(video_url)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._resolve, video_url)
+            self._pending[video_url] = future
+        # Fuori dal lock: se il future è già concluso la callback gira subito in questo thread
+        future.add_done_callback(lambda _: self._forget(video_url, future))
+        return future
+
+    def get(self, video_url):
+        """URL di streaming di 'video_url', oppure None se yt-dlp non lo risolve."""
+        stream_url = self.cached(video_url)
+        if stream_url is not None:
+            return stream_url
+        return self.prefetch(video_url).result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _forget(self, video_url, future):
+        with self._lock:
+            if self._pending.get(video_url) is future:
+                del self._pending[video_url]
+
+    def _resolve(self, video_url):
+        stream_url = self.cached(video_url)
+        if stream_url is not None:
+            return stream_url
+        now = time.time()
+        with self._lock:
+            if self._failures.get(video_url, 0) > now:
+                return None
+
+        print(f"-> Ottenimento dell'URL di streaming di {video_url} con yt-dlp...")
+        started = time.monotonic()
+        # Una riga con la durata ('NA' per le dirette), poi l'URL di streaming
+        cmd = self.command + ['-f', self.stream_format, '--print', 'duration', '--print', 'urls', video_url]
+        duration = None
+        try:
+            with metrics.span('yt', 'resolve'):
+                result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=self.timeout)
+            lines = result.stdout.strip().splitlines()
+            stream_url = lines[1] if len(lines) >= 2 else None
+            if lines:
+                try:
+                    duration = float(lines[0])
+                except ValueError:
+                    pass
+        except subprocess.CalledProcessError as e:
+            print(f"Errore nell'esecuzione di yt-dlp per {video_url}: {e.stderr}", file=sys.stderr)
+            stream_url = None
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"Errore nell'esecuzione di yt-dlp per {video_url}: {e}", file=sys.stderr)
+            stream_url = None
+
+        now = time.time()
+        if stream_url is None:
+            with self._lock:
+                self._failures[video_url] = now + FAILURE_TTL
+            return None
+
+        print(f"-> URL di {video_url} risolto in {time.monotonic() - started:.1f} s")
+        with self._lock:
+            self._cache[self._key(video_url)] = {'url': stream_url, 'expires': url_expiry(stream_url, now, self.ttl),
+                                                 'duration': duration}
+            self._failures.pop(video_url, None)
+            self._save()
+        return stream_url
+
+    def _load(self):
+        if self.cache_file is None:
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Cache degli URL non leggibile ({e}): si riparte da vuota.", file=sys.stderr)
+            return {}
+        now = time.time()
+        return {key: entry for key, entry in cache.items() if entry.get('expires', 0) > now}
+
+    def _save(self):
+        """Riscrive la cache su disco (chiamata con il lock preso), scartando le voci scadute."""
+        if self.cache_file is None:
+            return
+        now = time.time()
+        self._cache = {key: entry for key, entry in self._cache.items() if entry['expires'] > now}
+        temp = self.cache_file + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(self._cache, f)
+            os.replace(temp, self.cache_file)
+        except OSError as e:
+            print(f"Impossibile salvare la cache degli URL: {e}", file=sys.stderr)
+
+
+def resolved_streams(video_urls, resolver, start=0, repeat=True, stop_event=None, needs_stream=None):
+    """
+    Scorre 'video_urls' a partire da 'start' e restituisce (indice, URL
+    video, URL di streaming) dei soli video risolti, saltando quelli che
+    falliscono. Prima di restituire un video avvia già la risoluzione dei
+    LOOKAHEAD successivi, che così avviene durante la riproduzione. Con 'repeat'
+    ricomincia dall'inizio all'infinito (finché 'stop_event' non è impostato).
+    I video per cui needs_stream(URL video) è falso (per esempio perché già
+    in una cache locale) si restituiscono con URL di streaming None, senza
+    chiamare yt-dlp.
+    """
+    if not video_urls:
+        return
+    if needs_stream is None:
+        needs_stream = lambda video_url: True
+    index = start % len(video_urls)
+    failures = 0
+    played = 0
+    while stop_event is None or not stop_event.is_set():
+        if not repeat and played >= len(video_urls):
+            return
+        video_url = video_urls[index]
+        if needs_stream(video_url):
+            stream_url = resolver.get(video_url)
+            available = stream_url is not None
+        else:
+            stream_url = None
+            available = True
+        if stop_event is not None and stop_event.is_set():
+            return
+        for ahead in range(1, LOOKAHEAD + 1):
+            next_url = video_urls[(index + ahead) % len(video_urls)]
+            if (repeat or played + ahead < len(video_urls)) and needs_stream(next_url):
+                resolver.prefetch(next_url)
+
+        if not available:
+            failures += 1
+            if repeat and failures >= len(video_urls):
+                # Nessun video risolvibile (rete assente?): si riprova con calma
+                failures = 0
+                if stop_event is not None:
+                    stop_event.wait(RETRY_DELAY)
+                else:
+                    time.sleep(RETRY_DELAY)
+        else:
+            failures = 0
+            yield index, video_url, stream_url
+        index = (index + 1) % len(video_urls)
+        played += 1
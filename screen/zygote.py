@@ -0,0 +1,163 @@
+import importlib
+import os
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+# --- Costanti di configurazione ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MESSAGE_SIZE = 256
+
+# Moduli pesanti caricati una volta nel fork server e condivisi (copy-on-write)
+# da tutte le app; quelli del progetto non hanno effetti collaterali all'import.
+PRELOAD_MODULES = (
+    'numpy', 'psutil', 'evdev',
+    'PIL.Image', 'PIL.ImageDraw', 'PIL.ImageFont', 'PIL.ImageOps',
+    'framebuffer', 'rgb565', 'fonts', 'screencache', 'touch', 'runtime',
+    'docker_api', 'logtail', 'status', 'sampler', 'ytresolve', 'metrics',
+)
+
+
+class ForkServer:
+    """
+    Lato manager del fork server (zygote).
+
+    Avvia una volta sola 'python3 zygote.py', che precarica PRELOAD_MODULES
+    e poi, a ogni richiesta, fa fork di sé stesso ed esegue <app>.py nel
+    figlio: l'app parte con interprete e librerie già pronti. Ogni app
+    avviata segnala sul socket 'reports' quanto ha impiegato a scrivere il
+    primo frame; read_reports() restituisce le coppie (app, millisecondi).
+    """
+
+    def __init__(self):
+        self._process = None
+        self._commands = None
+        self._lock = threading.Lock()
+        self.reports = None
+
+    def start(self):
+        commands, zygote_commands = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        reports, app_reports = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        fds = (zygote_commands.fileno(), app_reports.fileno())
+        self._process = subprocess.Popen([sys.executable, os.path.abspath(__file__), *map(str, fds)],
+                                         pass_fds=fds, cwd=APP_DIR)
+        zygote_commands.close()
+        app_reports.close()
+        self._commands = commands
+        reports.setblocking(False)
+        self.reports = reports
+
+        # Il primo messaggio arriva quando il precaricamento è finito
+        ready = self._commands.recv(MESSAGE_SIZE).decode()
+        print(f"Fork server pronto (PID: {self._process.pid}, {ready})")
+
+    def spawn(self, app_name):
+        """Avvia <app_name>.py con un fork del server; restituisce il PID dell'app."""
+        with self._lock:
+            self._commands.send(f"spawn {app_name} {time.monotonic()}".encode())
+            reply = self._commands.recv(MESSAGE_SIZE).decode().split()
+        if not reply or reply[0] != 'pid':
+            raise RuntimeError(f"Avvio di {app_name} fallito: {' '.join(reply[1:])}")
+        return int(reply[1])
+
+    def read_reports(self):
+        results = []
+        while True:
+            try:
+                app_name, ms = self.reports.recv(MESSAGE_SIZE).decode().split()
+            except BlockingIOError:
+                return results
+            results.append((app_name, float(ms)))
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._commands.send(b"quit")
+            self._process.wait(timeout=3)
+        except (OSError, subprocess.TimeoutExpired):
+            self._process.kill()
+        self._commands.close()
+        self.reports.close()
+        self._process = None
+
+
+# --- Lato server: gira in un processo separato ---
+def preload():
+    start = time.monotonic()
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Fork server: impossibile precaricare {name}: {e}", file=sys.stderr)
+    # Registra subito i plugin dei formati, che PIL altrimenti carica alla prima apertura
+    from PIL import Image
+    Image.init()
+    return time.monotonic() - start
+
+def run_app(app_name, launched, commands, reports):
+    """Corpo del figlio: diventa l'app e non torna mai al server."""
+    code = 1
+    try:
+        commands.close()
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        def report():
+            elapsed = (time.monotonic() - launched) * 1000
+            reports.send(f"{app_name} {elapsed:.1f}".encode())
+
+        import framebuffer
+        framebuffer.on_first_frame(report)
+
+        script = os.path.join(APP_DIR, f"{app_name}.py")
+        sys.argv = [script]
+        runpy.run_path(script, run_name='__main__')
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+def serve(commands, reports):
+    # Le app terminate vengono raccolte dal kernel: niente zombie da attendere
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    elapsed = preload()
+    commands.send(f"precaricati {len(PRELOAD_MODULES)} moduli in {elapsed * 1000:.0f} ms".encode())
+
+    while True:
+        try:
+            message = commands.recv(MESSAGE_SIZE).decode().split()
+        except OSError:
+            return
+        if not message or message[0] == 'quit':
+            return
+        if message[0] != 'spawn' or len(message) != 3:
+            commands.send(b"error richiesta non valida")
+            continue
+
+        app_name, launched = message[1], float(message[2])
+        if not app_name.isidentifier() or not os.path.isfile(os.path.join(APP_DIR, f"{app_name}.py")):
+            commands.send(f"error app sconosciuta {app_name}".encode())
+            continue
+
+        pid = os.fork()
+        if pid == 0:
+            run_app(app_name, launched, commands, reports)
+        commands.send(f"pid {pid}".encode())
+
+
+if __name__ == "__main__":
+    serve(socket.socket(fileno=int(sys.argv[1])), socket.socket(fileno=int(sys.argv[2])))